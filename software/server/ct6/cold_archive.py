@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import struct
+import pathlib
+
+from time import mktime
+from datetime import datetime, date, timedelta
+
+import numpy as np
+
+class ColdArchive(object):
+    """@brief Responsible for holding the max resolution rows (CT6_SENSOR table) of closed days in a
+              compact columnar file per day. The archive of <ASSY>.db is held in the <ASSY>_archive
+              folder, one file per day (YYYY-MM-DD.ct6a). Each file holds
+              - A header (see HEADER_FORMAT) followed by a JSON list of the [column name, numpy dtype, scale]
+                of each column.
+              - The TIMESTAMP column as the milliseconds since the previous row (the first row is
+                held in the header).
+              - Each of the other columns. Power factor, voltage, frequency, temperature and RSSI are held
+                as scaled integers, the power columns as float32.
+              Each column starts on an 8 byte boundary so that it can be read using numpy.memmap.
+              The days are always archived in order so the archive holds every day up to the last day archived."""
+
+    FOLDER_SUFFIX = "_archive"
+    FILE_EXTENSION = ".ct6a"
+    MAGIC = b"CT6A"
+    VERSION = 1
+    # Magic, version, row count, first TIMESTAMP, column list length.
+    HEADER_FORMAT = "<4sHIqI"
+    TIMESTAMP = "TIMESTAMP"
+    TIMESTAMP_DTYPE = "<u4"
+    # The dtype and scale of the columns that are not held as float32.
+    COLUMN_ENCODING_DICT = {"_PF": ("<i2", 10000.0),
+                            "VOLTAGE": ("<u2", 100.0),
+                            "FREQUENCY": ("<u2", 1000.0),
+                            "TEMPERATURE": ("<i2", 100.0),
+                            "RSSI_DBM": ("<i2", 10.0)}
+    DEFAULT_COLUMN_ENCODING = ("<f4", 1.0)
+
+    @staticmethod
+    def GetArchiveFolder(db_file):
+        """@param db_file The main database file.
+           @return The folder holding the archive of the database."""
+        db_path = pathlib.Path(db_file)
+        return str(db_path.parent / (db_path.stem + ColdArchive.FOLDER_SUFFIX))
+
+    @staticmethod
+    def GetEpochMS(_date):
+        """@param _date A date instance.
+           @return The start of the day (local time) in milliseconds since the epoch."""
+        return int(mktime(_date.timetuple()))*1000
+
+    @staticmethod
+    def GetColumnEncoding(col_name):
+        """@param col_name The name of a column.
+           @return A tuple holding the numpy dtype and the scale of the column."""
+        for suffix, column_encoding in ColdArchive.COLUMN_ENCODING_DICT.items():
+            if col_name.endswith(suffix):
+                return column_encoding
+        return ColdArchive.DEFAULT_COLUMN_ENCODING
+
+    @staticmethod
+    def _Align(offset):
+        """@return The offset rounded up to the next 8 byte boundary."""
+        return (offset + 7) & ~7
+
+    @staticmethod
+    def Write(archive_file, column_list, row_list):
+        """@brief Write an archive file. The file is written to a temporary file first so that a partially
+                  written file is never present.
+           @param archive_file The archive file.
+           @param column_list The names of the columns. The first must be the TIMESTAMP.
+           @param row_list A list of rows in TIMESTAMP order. The TIMESTAMP is the milliseconds since the epoch."""
+        encoding_list = [[col_name] + list(ColdArchive.GetColumnEncoding(col_name)) for col_name in column_list[1:]]
+        encoded_column_list = json.dumps(encoding_list).encode()
+        first_timestamp = 0
+        array_list = []
+        if row_list:
+            values = np.array(row_list, dtype=np.float64)
+            timestamps = np.array([row[0] for row in row_list], dtype=np.int64)
+            first_timestamp = int(timestamps[0])
+            array_list.append(np.diff(timestamps, prepend=first_timestamp).astype(ColdArchive.TIMESTAMP_DTYPE))
+            for index, (_, dtype, scale) in enumerate(encoding_list):
+                column = values[:, index+1]
+                if np.dtype(dtype).kind == 'f':
+                    array_list.append(column.astype(dtype))
+                else:
+                    info = np.iinfo(np.dtype(dtype))
+                    array_list.append(np.clip(np.rint(column*scale), info.min, info.max).astype(dtype))
+
+        tmp_file = archive_file + ".tmp"
+        with open(tmp_file, 'wb') as fd:
+            fd.write(struct.pack(ColdArchive.HEADER_FORMAT, ColdArchive.MAGIC, ColdArchive.VERSION, len(row_list), first_timestamp, len(encoded_column_list)))
+            fd.write(encoded_column_list)
+            for array in array_list:
+                fd.write(b"\0" * (ColdArchive._Align(fd.tell()) - fd.tell()))
+                fd.write(array.tobytes())
+        os.replace(tmp_file, archive_file)
+
+    @staticmethod
+    def Read(archive_file, start=None, stop=None):
+        """@brief Read the columns from an archive file.
+           @param archive_file The archive file.
+           @param start The start of the period (milliseconds since the epoch) or None for the first row.
+           @param stop The end of the period (milliseconds since the epoch, not included) or None for the last row.
+           @return A dict holding the numpy array of each column, keyed by column name. The TIMESTAMP
+                   column holds the milliseconds since the epoch."""
+        header_size = struct.calcsize(ColdArchive.HEADER_FORMAT)
+        with open(archive_file, 'rb') as fd:
+            magic, version, row_count, first_timestamp, encoded_column_list_size = struct.unpack(ColdArchive.HEADER_FORMAT, fd.read(header_size))
+            if magic != ColdArchive.MAGIC or version != ColdArchive.VERSION:
+                raise Exception(f"{archive_file} is not a version {ColdArchive.VERSION} CT6 archive file.")
+            encoding_list = json.loads(fd.read(encoded_column_list_size))
+
+        column_dict = {}
+        offset = ColdArchive._Align(header_size + encoded_column_list_size)
+        deltas = np.memmap(archive_file, dtype=ColdArchive.TIMESTAMP_DTYPE, mode='r', offset=offset, shape=(row_count,)) if row_count else np.zeros(0, ColdArchive.TIMESTAMP_DTYPE)
+        timestamps = first_timestamp + np.cumsum(deltas, dtype=np.int64)
+        first_index = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+        stop_index = row_count if stop is None else int(np.searchsorted(timestamps, stop, side='left'))
+        column_dict[ColdArchive.TIMESTAMP] = timestamps[first_index:stop_index]
+        offset = ColdArchive._Align(offset + deltas.nbytes)
+        for col_name, dtype, scale in encoding_list:
+            dtype = np.dtype(dtype)
+            if row_count:
+                column = np.memmap(archive_file, dtype=dtype, mode='r', offset=offset, shape=(row_count,))[first_index:stop_index]
+            else:
+                column = np.zeros(0, dtype)
+            if dtype.kind == 'f':
+                column_dict[col_name] = column.astype(np.float64)
+            else:
+                column_dict[col_name] = column/scale
+            offset = ColdArchive._Align(offset + dtype.itemsize*row_count)
+        return column_dict
+
+    def __init__(self, db_file):
+        """@brief Constructor
+           @param db_file The main database file."""
+        self._db_file = db_file
+        self._archive_folder = ColdArchive.GetArchiveFolder(db_file)
+
+    def get_day_file(self, _date):
+        """@param _date A date instance.
+           @return The archive file of the day."""
+        return os.path.join(self._archive_folder, _date.isoformat() + ColdArchive.FILE_EXTENSION)
+
+    def get_day_list(self):
+        """@return A list of the days (date instances) in the archive in time order."""
+        day_list = []
+        if os.path.isdir(self._archive_folder):
+            for entry in sorted(os.listdir(self._archive_folder)):
+                if entry.endswith(ColdArchive.FILE_EXTENSION):
+                    day_list.append(date.fromisoformat(entry[:-len(ColdArchive.FILE_EXTENSION)]))
+        return day_list
+
+    def get_stop(self):
+        """@return The start of the day after the last day archived (milliseconds since the epoch) or None if no days are archived."""
+        day_list = self.get_day_list()
+        if not day_list:
+            return None
+        return ColdArchive.GetEpochMS(day_list[-1] + timedelta(days=1))
+
+    def write_day(self, _date, column_list, row_list):
+        """@brief Archive a day.
+           @param _date A date instance.
+           @param column_list The names of the columns. The first must be the TIMESTAMP.
+           @param row_list A list of the rows of the day in TIMESTAMP order."""
+        os.makedirs(self._archive_folder, exist_ok=True)
+        ColdArchive.Write(self.get_day_file(_date), column_list, row_list)
+
+    def read(self, column_list, start, stop):
+        """@brief Read the archived rows in a period of time.
+           @param column_list The names of the columns to read.
+           @param start The start of the period (milliseconds since the epoch).
+           @param stop The end of the period (milliseconds since the epoch, not included).
+           @return A list of row tuples in TIMESTAMP order. Columns that are not in the archive are None."""
+        row_list = []
+        first_day = datetime.fromtimestamp(start/1000).date()
+        last_day = datetime.fromtimestamp((stop-1)/1000).date()
+        for _date in self.get_day_list():
+            if first_day <= _date <= last_day:
+                column_dict = ColdArchive.Read(self.get_day_file(_date), start, stop)
+                row_count = len(column_dict[ColdArchive.TIMESTAMP])
+                value_list = []
+                for col_name in column_list:
+                    if col_name in column_dict:
+                        value_list.append(column_dict[col_name].tolist())
+                    else:
+                        value_list.append([None]*row_count)
+                row_list.extend(zip(*value_list))
+        return row_list
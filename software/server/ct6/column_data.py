@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from time import localtime
+
+class ColumnData(object):
+    """@brief Holds the rows read from a CT6 database table as numpy arrays so that the values
+              plotted are scaled, downsampled and passed to a bokeh ColumnDataSource without
+              processing each row in python. The rows are converted once when they are read."""
+
+    MS_PER_HOUR = 3600000
+    HOUR = "h"
+    DAY = "D"
+
+    @staticmethod
+    def GetLocalDatetime64(timestamps):
+        """@brief Get the local times to plot.
+           @param timestamps A numpy int64 array of the milliseconds since the epoch.
+           @return A numpy datetime64[ms] array holding the local time of each timestamp.
+                   Bokeh shows datetime64 values without converting them to the local time so
+                   the UTC offset at each time (this may change in the period, E.G DST) is added."""
+        hours, inverse = np.unique(timestamps // ColumnData.MS_PER_HOUR, return_inverse=True)
+        offsets = np.array([localtime(hour*3600).tm_gmtoff*1000 for hour in hours.tolist()], dtype=np.int64)
+        return (timestamps + offsets[inverse.reshape(-1)]).astype("datetime64[ms]")
+
+    @staticmethod
+    def GetSteps(x_array, y_array, unit):
+        """@brief Add a point at the end of the hour or day of each point so that the plot is stepped.
+           @param x_array A numpy datetime64[ms] array of the start of each hour or day.
+           @param y_array A numpy array of the values.
+           @param unit ColumnData.HOUR or ColumnData.DAY.
+           @return A tuple holding the X and Y numpy arrays with twice as many points."""
+        end_array = x_array.astype(f"datetime64[{unit}]") + np.timedelta64(1, unit) - np.timedelta64(1, "ms")
+        step_x_array = np.empty(len(x_array)*2, dtype="datetime64[ms]")
+        step_x_array[0::2] = x_array
+        step_x_array[1::2] = end_array
+        return step_x_array, np.repeat(y_array, 2)
+
+    def __init__(self, row_list):
+        """@brief Constructor
+           @param row_list A list of the rows read from a table in TIMESTAMP order. The first column must
+                           hold the TIMESTAMP (milliseconds since the epoch). None values are held as NaN."""
+        if row_list:
+            self._values = np.array(row_list, dtype=np.float64)
+        else:
+            self._values = np.zeros((0, 1), dtype=np.float64)
+        self.timestamps = self._values[:, 0].astype(np.int64)
+        self.x = ColumnData.GetLocalDatetime64(self.timestamps)
+
+    def __len__(self):
+        """@return The number of rows."""
+        return len(self.timestamps)
+
+    def get_size(self):
+        """@return The number of bytes used to hold the rows."""
+        return self._values.nbytes + self.timestamps.nbytes + self.x.nbytes
+
+    def get_column_count(self):
+        """@return The number of columns in each row."""
+        return self._values.shape[1]
+
+    def get_column(self, index):
+        """@param index The index of the column.
+           @return A numpy float64 array of the column values."""
+        return self._values[:, index]
+
+    def get_kwh(self, index_list, invert=False):
+        """@brief Calculate the energy of several power columns in a single pass. The power of each row is
+                  taken to be the power since the previous row.
+           @param index_list A list of the indexes of the power (Watts) columns.
+           @param invert If True the power is negated.
+           @return A tuple of numpy arrays holding the total, positive and negative kWh of each column."""
+        hours = np.diff(self.timestamps)/3600000.0
+        watts = self._values[1:, index_list]
+        if invert:
+            watts = -watts
+        # The same time deltas are used for all the columns.
+        kwh = hours[:, np.newaxis]*watts/1000.0
+        return kwh.sum(axis=0), np.where(kwh >= 0.0, kwh, 0.0).sum(axis=0), np.where(kwh < 0.0, kwh, 0.0).sum(axis=0)
@@ -2,12 +2,15 @@
 # -*- coding: UTF-8 -*-
 
 import os
+import json
 import argparse
 import sqlite3
 import threading
 import shutil
 
-from time import time, sleep
+from time import time, sleep, mktime
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import mysql.connector
 
@@ -17,10 +20,13 @@ from p3lib.helper import logTraceBack
 
 from lib.config import ConfigBase
 from lib.yview import YViewCollector, LocalYViewCollector
+from lib.rollup import RollupAccumulator
 
 from ct6.ct6_dash_mgr import CRED_JSON_FILE
 
 from ct6.ct6_app_gui import AppConfig, SQLite3DBClient, GUI
+from ct6.partition_router import PartitionRouter
+from ct6.db_exporter import DBExporter
 
 
 class MYSQLImporter(object):
@@ -172,6 +178,8 @@ class MYSQLImporter(object):
         self._copy_mysql_to_sqlite_db(mysql_cursor, imported_sqlite_db_file)
         self.create_timestamp_index(imported_sqlite_db_file, MYSQLImporter.VALID_CT6_DB_TABLE_NAMES[1])
         self.add_unit_name_column(imported_sqlite_db_file, db_name)
+        schema_migrator = SchemaMigrator(self._uio, self._options, self._config)
+        schema_migrator.migrate(imported_sqlite_db_file)
         sqlite_db_file = self._get_sqlite_database_file(db_name, mysql_cursor, imported=False)
         shutil.move(imported_sqlite_db_file, sqlite_db_file)
         self._uio.info(f"Renamed {imported_sqlite_db_file} to {sqlite_db_file}")
@@ -328,6 +336,536 @@ class MYSQLImporter(object):
             if sqlite_conn:
                 sqlite_conn.close()
 
+class SchemaMigrator(object):
+    """@brief Responsible for migrating CT6 sqlite databases to the current schema version.
+              The tables are converted in place in chunks so that each transaction is short."""
+
+    DATA_TABLE_NAMES = (SQLite3DBClient.CT6_TABLE_NAME,
+                        SQLite3DBClient.MINUTE_RES_DB_DATA_TABLE_NAME,
+                        SQLite3DBClient.HOUR_RES_DB_DATA_TABLE_NAME,
+                        SQLite3DBClient.DAY_RES_DB_DATA_TABLE_NAME)
+
+    # Converts a local time ISO format string to milliseconds since the epoch.
+    TEXT_TO_EPOCH_MS_SQL = "CAST(ROUND((julianday(TIMESTAMP, 'utc') - 2440587.5)*86400000.0) AS INTEGER)"
+
+    def __init__(self, uio, options, config, chunk_size=100000):
+        """@brief Constructor
+           @param uio A UIO instance
+           @param options The command line options instance
+           @param config An AppConfig instance.
+           @param chunk_size The number of rows copied in each transaction."""
+        self._uio = uio
+        self._options = options
+        self._config = config
+        self._chunk_size = chunk_size
+        self._column_list = list(SQLite3DBClient.GetTableSchema(SQLite3DBClient.CT6_DB_TABLE_SCHEMA_SQLITE_V1).keys())
+
+    def migrate_all(self):
+        """@brief Migrate all the databases in the database storage folder."""
+        db_storage_folder = self._config.getAttr(AppConfig.DB_STORAGE_PATH)
+        db_file_list = SQLite3DBClient.GetDBFileList(db_storage_folder)
+        start_time = time()
+        for db_file in db_file_list:
+            self.migrate(db_file)
+        elapsed_seconds = int(time() - start_time)
+        self._uio.info(f"Took {elapsed_seconds} seconds to migrate {len(db_file_list)} database/s.")
+
+    def migrate(self, db_file):
+        """@brief Migrate a database to the current schema version. If the migration is interrupted
+                  calling this again will continue from where it stopped.
+           @param db_file The sqlite database file."""
+        sqlite_conn = None
+        try:
+            sqlite_conn = sqlite3.connect(db_file)
+            schema_version = SQLite3DBClient.GetSchemaVersion(sqlite_conn)
+            table_list = [row[0] for row in sqlite_conn.execute("SELECT name FROM sqlite_master WHERE type='table';")]
+            if schema_version >= SQLite3DBClient.SCHEMA_VERSION and DerivedTableBuilder.PROGRESS_TABLE_NAME not in table_list:
+                self._uio.info(f"{db_file}: Schema version {schema_version} is up to date.")
+                return
+
+            if schema_version < SQLite3DBClient.SCHEMA_VERSION:
+                self._uio.info(f"{db_file}: Migrating from schema version {schema_version} to {SQLite3DBClient.SCHEMA_VERSION}.")
+
+            if schema_version < SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+                for table_name in SchemaMigrator.DATA_TABLE_NAMES:
+                    if table_name in table_list or self._get_old_table_name(table_name) in table_list:
+                        self._migrate_table(sqlite_conn, table_name, table_list)
+                sqlite_conn.execute(f"PRAGMA user_version={SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP};")
+                sqlite_conn.commit()
+
+            if schema_version < SQLite3DBClient.SCHEMA_VERSION_ENERGY:
+                self._add_energy_columns(sqlite_conn, table_list)
+                # The derived table rebuild records it's progress so set the schema version now.
+                # If the rebuild is interrupted it continues when the migration is run again.
+                sqlite_conn.execute(f"PRAGMA user_version={SQLite3DBClient.SCHEMA_VERSION_ENERGY};")
+                sqlite_conn.commit()
+
+        finally:
+            if sqlite_conn:
+                sqlite_conn.close()
+
+        # Calculate the energy columns of the existing minute, hour and day rows.
+        DerivedTableBuilder(self._uio, self._options, self._config).rebuild(db_file)
+        self._uio.info(f"{db_file}: Migration complete.")
+
+    def _add_energy_columns(self, sqlite_conn, table_list):
+        """@brief Add the import and export energy columns to the minute, hour and day tables.
+           @param sqlite_conn The connection to the database.
+           @param table_list The names of the tables in the database."""
+        for table_name in SQLite3DBClient.LOW_RES_DATA_TABLE_LIST:
+            if table_name not in table_list:
+                continue
+            col_name_list = [row[1] for row in sqlite_conn.execute(f"PRAGMA table_info({table_name});")]
+            for _, import_col, export_col in SQLite3DBClient.CT_ENERGY_COLUMN_LIST:
+                for col_name in (import_col, export_col):
+                    if col_name not in col_name_list:
+                        sqlite_conn.execute(f"ALTER TABLE {table_name} ADD COLUMN `{col_name}` REAL;")
+        sqlite_conn.commit()
+
+    def _get_old_table_name(self, table_name):
+        """@return The name of the table holding the rows still to be migrated."""
+        return table_name + "_V0"
+
+    def _migrate_table(self, sqlite_conn, table_name, table_list):
+        """@brief Convert a table so that the TIMESTAMP column holds milliseconds since the epoch.
+           @param sqlite_conn The connection to the database.
+           @param table_name The name of the table to migrate.
+           @param table_list The names of the tables in the database before the migration started."""
+        old_table_name = self._get_old_table_name(table_name)
+        columns = ",\n".join([f"`{col_name}` {col_type}" for col_name, col_type in SQLite3DBClient.GetTableSchema(SQLite3DBClient.CT6_DB_TABLE_SCHEMA_SQLITE_V1).items()])
+        if old_table_name not in table_list:
+            # Move the existing table out of the way and create the new table in it's place. The python
+            # sqlite3 module commits each of these statements unless a transaction is started explicitly.
+            sqlite_conn.execute("BEGIN;")
+            sqlite_conn.execute(f"DROP INDEX IF EXISTS {table_name}_INDEX;")
+            sqlite_conn.execute(f"ALTER TABLE {table_name} RENAME TO {old_table_name};")
+            sqlite_conn.execute(f"CREATE TABLE {table_name} ({columns});")
+            sqlite_conn.commit()
+
+        else:
+            # A previous migration may have been interrupted after the table was renamed but before the new
+            # table was created.
+            sqlite_conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns});")
+            sqlite_conn.commit()
+
+        # Copy the rows in rowid order keeping the same rowid so that the copy can restart from the last row copied.
+        columns = ", ".join(self._column_list)
+        select_columns = ", ".join([SchemaMigrator.TEXT_TO_EPOCH_MS_SQL] + self._column_list[1:])
+        max_rowid = sqlite_conn.execute(f"SELECT MAX(rowid) FROM {old_table_name};").fetchone()[0]
+        last_rowid = sqlite_conn.execute(f"SELECT MAX(rowid) FROM {table_name};").fetchone()[0]
+        if last_rowid is None:
+            last_rowid = 0
+        start_time = time()
+        while max_rowid is not None and last_rowid < max_rowid:
+            next_rowid = last_rowid + self._chunk_size
+            sqlite_conn.execute(f"INSERT INTO {table_name} (rowid, {columns}) SELECT rowid, {select_columns} FROM {old_table_name} WHERE rowid > ? AND rowid <= ?;", (last_rowid, next_rowid))
+            sqlite_conn.commit()
+            last_rowid = next_rowid
+            self._uio.info(f"{table_name}: Migrated {min(last_rowid, max_rowid)} of {max_rowid} rows.")
+
+        sqlite_conn.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_INDEX ON {table_name} ({SQLite3DBClient.TIMESTAMP});")
+        sqlite_conn.execute(f"DROP TABLE {old_table_name};")
+        sqlite_conn.commit()
+        self._uio.info(f"{table_name}: Took {time()-start_time:.1f} seconds to migrate.")
+
+class DerivedTableBuilder(object):
+    """@brief Responsible for rebuilding the minute, hour and day tables of CT6 sqlite databases from
+              the CT6_SENSOR table. The rows are calculated by sqlite (INSERT ... SELECT ... GROUP BY),
+              one day at a time, using the same rules as the ct6_app uses when data is received.
+              - A minute row is the mean of the rows in a minute that has at least 3 rows.
+              - An hour row is the mean of the first row of each of these minutes.
+              - A day row is the mean of the first of these rows in each hour.
+              The CT6_SENSOR rows are read from the monthly partitions as well as the main database.
+              If the database holds the energy of each CT this is calculated from the rows in each minute,
+              hour or day. Each row holds the energy since the previous row.
+              The gaps in the CT6_SENSOR rows are recorded in the CT6_GAP table.
+              The last day rebuilt is saved in the database so that an interrupted rebuild continues
+              from where it stopped. The databases are rebuilt in parallel by separate processes."""
+
+    PROGRESS_TABLE_NAME = "CT6_REBUILD_PROGRESS"
+    MIN_MINUTE_ROW_COUNT = RollupAccumulator.MIN_MINUTE_RECORD_COUNT
+    LOCAL_HOUR_SQL = "strftime('%Y-%m-%d %H', {}/1000, 'unixepoch', 'localtime')"
+    LOCAL_DAY_SQL = "strftime('%Y-%m-%d', {}/1000, 'unixepoch', 'localtime')"
+
+    @staticmethod
+    def RebuildDB(options, db_file):
+        """@brief Rebuild the derived tables of a database. This is called in a separate process.
+           @param options The command line options instance.
+           @param db_file The sqlite database file.
+           @return The number of days rebuilt."""
+        uio = UIO()
+        uio.enableDebug(options.debug)
+        derived_table_builder = DerivedTableBuilder(uio, options, None)
+        return derived_table_builder.rebuild(db_file)
+
+    @staticmethod
+    def GetEpochMS(_datetime):
+        """@param _datetime A datetime instance holding the local time.
+           @return The milliseconds since the epoch."""
+        return int(mktime(_datetime.timetuple()))*1000
+
+    def __init__(self, uio, options, config):
+        """@brief Constructor
+           @param uio A UIO instance
+           @param options The command line options instance
+           @param config An AppConfig instance. This is only required by rebuild_all()."""
+        self._uio = uio
+        self._options = options
+        self._config = config
+        self._column_list = list(SQLite3DBClient.GetTableSchema(SQLite3DBClient.CT6_DB_TABLE_SCHEMA_SQLITE_V1).keys())
+
+    def rebuild_all(self):
+        """@brief Rebuild the derived tables of all the databases in the database storage folder."""
+        db_storage_folder = self._config.getAttr(AppConfig.DB_STORAGE_PATH)
+        db_file_list = SQLite3DBClient.GetDBFileList(db_storage_folder)
+        if not db_file_list:
+            return
+        start_time = time()
+        process_count = min(os.cpu_count(), len(db_file_list))
+        with ProcessPoolExecutor(max_workers=process_count) as executor:
+            future_dict = {executor.submit(DerivedTableBuilder.RebuildDB, self._options, db_file): db_file for db_file in db_file_list}
+            for future in as_completed(future_dict):
+                db_file = future_dict[future]
+                try:
+                    day_count = future.result()
+                    self._uio.info(f"{db_file}: Rebuilt the derived tables for {day_count} days.")
+
+                except Exception as ex:
+                    self._uio.error(f"{db_file}: Failed to rebuild the derived tables: {str(ex)}")
+
+        elapsed_seconds = int(time() - start_time)
+        self._uio.info(f"Took {elapsed_seconds} seconds to rebuild the derived tables of {len(db_file_list)} database/s using {process_count} processes.")
+
+    def rebuild(self, db_file):
+        """@brief Rebuild the minute, hour and day tables of a database. If the rebuild is interrupted
+                  calling this again will continue from where it stopped.
+           @param db_file The sqlite database file.
+           @return The number of days rebuilt."""
+        day_count = 0
+        sqlite_conn = None
+        try:
+            sqlite_conn = sqlite3.connect(db_file)
+            schema_version = SQLite3DBClient.GetSchemaVersion(sqlite_conn)
+            if schema_version < SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+                self._uio.warn(f"{db_file}: Schema version {schema_version} is out of date. Run 'ct6_app --migrate_schema' before rebuilding the derived tables.")
+                return day_count
+
+            self._create_tables(sqlite_conn, schema_version)
+            # The CT6_SENSOR rows may be held in monthly partitions.
+            partition_router = PartitionRouter(db_file)
+            range_list = partition_router.fetch_all(sqlite_conn,
+                                                    SQLite3DBClient.CT6_TABLE_NAME,
+                                                    f"MIN({SQLite3DBClient.TIMESTAMP}), MAX({SQLite3DBClient.TIMESTAMP})",
+                                                    "1",
+                                                    {},
+                                                    None,
+                                                    None,
+                                                    immutable=False)
+            range_list = [timestamp_range for timestamp_range in range_list if timestamp_range[0] is not None]
+            if not range_list:
+                return day_count
+            min_timestamp = min([timestamp_range[0] for timestamp_range in range_list])
+            max_timestamp = max([timestamp_range[1] for timestamp_range in range_list])
+
+            stop_list = self._get_stop_timestamps(sqlite_conn)
+            day = datetime.fromtimestamp(min_timestamp/1000).date()
+            if self._is_pruned(sqlite_conn, min_timestamp):
+                # The CT6_SENSOR rows of the first day have been partly deleted (by a ct6_app that did not prune
+                # whole days) so the minute, hour and day rows of it are kept rather than rebuilt from the remaining rows.
+                day += timedelta(days=1)
+                self._uio.info(f"{db_file}: The max resolution rows before {day} have been deleted. The derived tables are rebuilt from {day}.")
+            row = sqlite_conn.execute(f"SELECT LAST_DAY FROM {DerivedTableBuilder.PROGRESS_TABLE_NAME} WHERE ID=1;").fetchone()
+            if row:
+                day = max(day, datetime.fromtimestamp(row[0]/1000).date() + timedelta(days=1))
+                self._uio.info(f"{db_file}: Continuing the derived table rebuild from {day}.")
+
+            day_start = DerivedTableBuilder.GetEpochMS(day)
+            while day_start <= max_timestamp:
+                next_day = day + timedelta(days=1)
+                day_stop = DerivedTableBuilder.GetEpochMS(next_day)
+                # Attach the partitions holding the day and the previous day (the time since the last row of
+                # the previous day is required to calculate the energy).
+                partition_router.attach(sqlite_conn, partition_router.get_partition_list(day_start-86400000, day_stop), immutable=False)
+                try:
+                    self._rebuild_day(sqlite_conn, day_start, day_stop, stop_list, schema_version, partition_router)
+                    # Record the day rebuilt in the same transaction as the rows.
+                    sqlite_conn.execute(f"REPLACE INTO {DerivedTableBuilder.PROGRESS_TABLE_NAME} (ID, LAST_DAY) VALUES (1, ?);", (day_start,))
+                    sqlite_conn.commit()
+
+                finally:
+                    partition_router.detach(sqlite_conn)
+                self._uio.debug(f"{db_file}: Rebuilt the derived tables for {day}.")
+                day_count += 1
+                day = next_day
+                day_start = day_stop
+
+            sqlite_conn.execute(f"DROP TABLE {DerivedTableBuilder.PROGRESS_TABLE_NAME};")
+            sqlite_conn.commit()
+
+        finally:
+            if sqlite_conn:
+                sqlite_conn.close()
+
+        return day_count
+
+    def _create_tables(self, sqlite_conn, schema_version):
+        """@brief Create the derived tables if they are missing and the table that records the rebuild progress.
+           @param sqlite_conn The connection to the database.
+           @param schema_version The schema version of the database."""
+        table_schema = SQLite3DBClient.CT6_DB_TABLE_SCHEMA_SQLITE_V1
+        if schema_version >= SQLite3DBClient.SCHEMA_VERSION_ENERGY:
+            table_schema = SQLite3DBClient.CT6_DB_ROLLUP_TABLE_SCHEMA_SQLITE_V2
+        columns = ",\n".join([f"`{col_name}` {col_type}" for col_name, col_type in SQLite3DBClient.GetTableSchema(table_schema).items()])
+        for table_name in SQLite3DBClient.LOW_RES_DATA_TABLE_LIST:
+            sqlite_conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns});")
+            sqlite_conn.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_INDEX ON {table_name} ({SQLite3DBClient.TIMESTAMP});")
+        sqlite_conn.execute(f"CREATE TABLE IF NOT EXISTS {SQLite3DBClient.GAP_TABLE_NAME} ({SQLite3DBClient.CT6_DB_GAP_TABLE_SCHEMA_SQLITE});")
+        sqlite_conn.execute(f"CREATE TABLE IF NOT EXISTS {DerivedTableBuilder.PROGRESS_TABLE_NAME} (ID INTEGER PRIMARY KEY, LAST_DAY INTEGER);")
+        sqlite_conn.commit()
+
+    def _is_pruned(self, sqlite_conn, min_timestamp):
+        """@brief Determine if CT6_SENSOR rows of the first day have been deleted (and possibly archived) because
+                  they were older than the max resolution retention period. The hour rows are never deleted so if
+                  any of the first day are before the hour of the first CT6_SENSOR row, the rows they were
+                  calculated from have been deleted.
+           @param sqlite_conn The connection to the database.
+           @param min_timestamp The TIMESTAMP of the first CT6_SENSOR row.
+           @return True if CT6_SENSOR rows of the first day have been deleted."""
+        day_start = SQLite3DBClient.GetBucketStart(min_timestamp, RollupAccumulator.DAY_INDEX)
+        hour_start = SQLite3DBClient.GetBucketStart(min_timestamp, RollupAccumulator.HOUR_INDEX)
+        row = sqlite_conn.execute(f"SELECT COUNT(*) FROM {SQLite3DBClient.HOUR_RES_DB_DATA_TABLE_NAME} WHERE {SQLite3DBClient.TIMESTAMP} >= ? AND {SQLite3DBClient.TIMESTAMP} < ?;", (day_start, hour_start)).fetchone()
+        return row[0] > 0
+
+    def _get_stop_timestamps(self, sqlite_conn):
+        """@brief Get the time at which the rebuild of each derived table stops. The ct6_app holds the
+                  minute, hour and day that have not yet closed in the CT6_ROLLUP_STATE table. The rows
+                  for these are added by the ct6_app when they close so they are not rebuilt.
+           @param sqlite_conn The connection to the database.
+           @return A list of the milliseconds since the epoch at which the minute, hour and day table
+                   rebuilds stop (None if they are not limited)."""
+        stop_list = [None, None, None]
+        table_list = [row[0] for row in sqlite_conn.execute("SELECT name FROM sqlite_master WHERE type='table';")]
+        if SQLite3DBClient.ROLLUP_STATE_TABLE_NAME in table_list:
+            row = sqlite_conn.execute(f"SELECT STATE FROM {SQLite3DBClient.ROLLUP_STATE_TABLE_NAME} WHERE ID=1;").fetchone()
+            if row:
+                rollup_accumulator = RollupAccumulator()
+                rollup_accumulator.set_state(json.loads(row[0]))
+                for index in range(len(stop_list)):
+                    first_timestamp = rollup_accumulator.get_first_timestamp(index)
+                    if first_timestamp is not None:
+                        stop_list[index] = SQLite3DBClient.GetDBTimestamp(first_timestamp, SQLite3DBClient.SCHEMA_VERSION)
+        return stop_list
+
+    def _get_first_rows_sql(self, group_by, value_columns, timestamp_column, table_sql):
+        """@brief Get the SQL that selects the first row of each group.
+           @param group_by The SQL expression that the rows are grouped by.
+           @param value_columns The comma separated value columns.
+           @param timestamp_column The name of the TIMESTAMP column in table_sql.
+           @param table_sql The table or sub query to select from.
+           @return The SQL SELECT statement. The TIMESTAMP column of the rows selected is FIRST_TIMESTAMP."""
+        # sqlite takes the values of the other columns from the row containing the MIN() value.
+        return f"SELECT MIN({timestamp_column}) AS FIRST_TIMESTAMP, {value_columns} FROM {table_sql} GROUP BY {group_by}"
+
+    def _get_energy_sql(self):
+        """@return The comma separated SQL expressions that sum the import and export energy (Wh) of each CT.
+                   The rows must have an HOURS column holding the time since the previous row."""
+        energy_sql_list = []
+        for power_col, import_col, export_col in SQLite3DBClient.CT_ENERGY_COLUMN_LIST:
+            energy_sql_list.append(f"TOTAL(MAX({power_col}, 0)*HOURS) AS {import_col}")
+            energy_sql_list.append(f"TOTAL(MIN({power_col}, 0)*HOURS) AS {export_col}")
+        return ", ".join(energy_sql_list)
+
+    def _rebuild_day(self, sqlite_conn, day_start, day_stop, stop_list, schema_version, partition_router):
+        """@brief Rebuild the minute, hour and day tables and the gaps for a single day.
+           @param sqlite_conn The connection to the database.
+           @param day_start The start of the day (milliseconds since the epoch).
+           @param day_stop The start of the next day (milliseconds since the epoch).
+           @param stop_list The times at which the minute, hour and day table rebuilds stop.
+           @param schema_version The schema version of the database.
+           @param partition_router The PartitionRouter that has attached the partitions holding the day."""
+        energy = schema_version >= SQLite3DBClient.SCHEMA_VERSION_ENERGY
+        column_list = list(self._column_list)
+        if energy:
+            for _, import_col, export_col in SQLite3DBClient.CT_ENERGY_COLUMN_LIST:
+                column_list.extend((import_col, export_col))
+        columns = ", ".join(column_list)
+        value_columns = ", ".join(self._column_list[1:])
+        mean_columns = ", ".join([f"AVG({col_name})" for col_name in self._column_list[1:]])
+        timestamp = SQLite3DBClient.TIMESTAMP
+        minute = f"{timestamp}/60000"
+        sensor_table = f"({partition_router.get_select_sql(SQLite3DBClient.CT6_TABLE_NAME, '*', '1')})"
+        # The hours since the previous row. The first row of the day uses the last row of the previous day.
+        # As in the RollupAccumulator no energy is added across a gap as the power during it is unknown.
+        previous_timestamp = f"COALESCE(LAG({timestamp}) OVER (ORDER BY {timestamp}), (SELECT MAX({timestamp}) FROM {sensor_table} WHERE {timestamp} < :start))"
+        hours = f"(CASE WHEN {timestamp} - {previous_timestamp} > :gap_ms THEN 0 ELSE ({timestamp} - {previous_timestamp})/3600000.0 END) AS HOURS"
+        gap_ms = SQLite3DBClient.GAP_SECS*1000
+        for index, table_name in enumerate(SQLite3DBClient.LOW_RES_DATA_TABLE_LIST):
+            stop = day_stop
+            if stop_list[index] is not None:
+                stop = min(stop, stop_list[index])
+            if stop <= day_start:
+                continue
+
+            sqlite_conn.execute(f"DELETE FROM {table_name} WHERE {timestamp} >= ? AND {timestamp} < ?;", (day_start, stop))
+            if energy:
+                sensor_rows = f"(SELECT *, {hours} FROM {sensor_table} WHERE {timestamp} >= :start AND {timestamp} < :stop)"
+            else:
+                sensor_rows = f"(SELECT * FROM {sensor_table} WHERE {timestamp} >= :start AND {timestamp} < :stop)"
+            if index == RollupAccumulator.MINUTE_INDEX:
+                select_columns = mean_columns
+                if energy:
+                    select_columns += ", " + self._get_energy_sql()
+                select_sql = f"SELECT CAST(ROUND(AVG({timestamp})) AS INTEGER), {select_columns} FROM {sensor_rows} "\
+                             f"GROUP BY {minute} HAVING COUNT(*) >= {DerivedTableBuilder.MIN_MINUTE_ROW_COUNT}"
+
+            else:
+                first_rows = self._get_first_rows_sql(minute, value_columns, timestamp, sensor_rows)
+                first_rows += f" HAVING COUNT(*) >= {DerivedTableBuilder.MIN_MINUTE_ROW_COUNT}"
+                if index == RollupAccumulator.HOUR_INDEX:
+                    group_by = DerivedTableBuilder.LOCAL_HOUR_SQL.format("FIRST_TIMESTAMP")
+
+                else:
+                    first_rows = self._get_first_rows_sql(DerivedTableBuilder.LOCAL_HOUR_SQL.format("FIRST_TIMESTAMP"), value_columns, "FIRST_TIMESTAMP", f"({first_rows})")
+                    group_by = DerivedTableBuilder.LOCAL_DAY_SQL.format("FIRST_TIMESTAMP")
+
+                select_sql = f"SELECT CAST(ROUND(AVG(FIRST_TIMESTAMP)) AS INTEGER), {mean_columns} FROM ({first_rows}) GROUP BY {group_by}"
+                if energy:
+                    # Join the energy of all the rows in each hour or day to the mean rows.
+                    energy_group_by = group_by.replace("FIRST_TIMESTAMP", timestamp)
+                    named_mean_columns = ", ".join([f"AVG({col_name}) AS {col_name}" for col_name in self._column_list[1:]])
+                    mean_rows = f"SELECT CAST(ROUND(AVG(FIRST_TIMESTAMP)) AS INTEGER) AS {timestamp}, {named_mean_columns}, {group_by} AS GROUP_KEY FROM ({first_rows}) GROUP BY {group_by}"
+                    energy_rows = f"SELECT {energy_group_by} AS GROUP_KEY, {self._get_energy_sql()} FROM {sensor_rows} GROUP BY {energy_group_by}"
+                    select_sql = f"SELECT {columns} FROM ({mean_rows}) AS MEAN_ROWS LEFT JOIN ({energy_rows}) AS ENERGY_ROWS USING (GROUP_KEY)"
+
+            sqlite_conn.execute(f"INSERT INTO {table_name} ({columns}) {select_sql};", {"start": day_start, "stop": stop, "gap_ms": gap_ms})
+
+        # The gaps that end in the day.
+        sqlite_conn.execute(f"DELETE FROM {SQLite3DBClient.GAP_TABLE_NAME} WHERE GAP_STOP >= ? AND GAP_STOP < ?;", (day_start, day_stop))
+        sensor_rows = f"(SELECT {timestamp}, {previous_timestamp} AS PREVIOUS_TIMESTAMP FROM {sensor_table} WHERE {timestamp} >= :start AND {timestamp} < :stop)"
+        sqlite_conn.execute(f"REPLACE INTO {SQLite3DBClient.GAP_TABLE_NAME} (GAP_START, GAP_STOP) "\
+                            f"SELECT PREVIOUS_TIMESTAMP, {timestamp} FROM {sensor_rows} WHERE {timestamp} - PREVIOUS_TIMESTAMP > :gap_ms;",
+                            {"start": day_start, "stop": day_stop, "gap_ms": gap_ms})
+
+
+class SensorTableClusterer(object):
+    """@brief Responsible for converting the CT6_SENSOR table of CT6 sqlite databases to the clustered layout
+              in which the TIMESTAMP is the primary key. The rows are then held in TIMESTAMP order so a
+              range of rows is read without a separate TIMESTAMP index lookup for each row.
+              The rows are copied in TIMESTAMP order in chunks so that each transaction is short. The
+              last row copied is saved in the database so that an interrupted conversion continues from
+              where it stopped. As the ct6_app does, a row with the same TIMESTAMP as the previous row
+              is stored 1 ms after it. The open monthly partitions are converted but closed partitions
+              are read only so they keep their layout."""
+
+    NEW_TABLE_NAME = SQLite3DBClient.CT6_TABLE_NAME + "_CLUSTERED"
+    PROGRESS_TABLE_NAME = "CT6_CLUSTER_PROGRESS"
+
+    def __init__(self, uio, options, config, chunk_size=100000):
+        """@brief Constructor
+           @param uio A UIO instance
+           @param options The command line options instance
+           @param config An AppConfig instance.
+           @param chunk_size The number of rows copied in each transaction."""
+        self._uio = uio
+        self._options = options
+        self._config = config
+        self._chunk_size = chunk_size
+        self._table_schema = SQLite3DBClient.GetTableSchema(SQLite3DBClient.CT6_DB_TABLE_SCHEMA_SQLITE_V1)
+        self._column_list = list(self._table_schema.keys())
+
+    def cluster_all(self):
+        """@brief Convert all the databases in the database storage folder."""
+        db_storage_folder = self._config.getAttr(AppConfig.DB_STORAGE_PATH)
+        db_file_list = SQLite3DBClient.GetDBFileList(db_storage_folder)
+        start_time = time()
+        for db_file in db_file_list:
+            self.cluster(db_file)
+            partition_router = PartitionRouter(db_file)
+            for partition_name in partition_router.get_partition_list():
+                partition_file = PartitionRouter.GetPartitionFile(db_file, partition_name)
+                if PartitionRouter.IsClosed(partition_file):
+                    self._uio.info(f"{partition_file}: Closed partitions are not converted.")
+                else:
+                    self.cluster(partition_file)
+        elapsed_seconds = int(time() - start_time)
+        self._uio.info(f"Took {elapsed_seconds} seconds to convert {len(db_file_list)} database/s.")
+
+    def cluster(self, db_file):
+        """@brief Convert the CT6_SENSOR table of a database. If the conversion is interrupted calling
+                  this again will continue from where it stopped.
+           @param db_file The sqlite database file."""
+        sqlite_conn = None
+        try:
+            sqlite_conn = sqlite3.connect(db_file)
+            schema_version = SQLite3DBClient.GetSchemaVersion(sqlite_conn)
+            if schema_version < SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+                self._uio.warn(f"{db_file}: Schema version {schema_version} is out of date. Run 'ct6_app --migrate_schema' before converting the {SQLite3DBClient.CT6_TABLE_NAME} table.")
+                return
+
+            table_list = [row[0] for row in sqlite_conn.execute("SELECT name FROM sqlite_master WHERE type='table';")]
+            if SQLite3DBClient.IsClustered(sqlite_conn) or SQLite3DBClient.CT6_TABLE_NAME not in table_list:
+                self._uio.info(f"{db_file}: The {SQLite3DBClient.CT6_TABLE_NAME} table is already clustered.")
+                return
+
+            self._uio.info(f"{db_file}: Converting the {SQLite3DBClient.CT6_TABLE_NAME} table to the clustered layout.")
+            start_time = time()
+            columns = ",\n".join([f"`{col_name}` {col_type}" for col_name, col_type in SQLite3DBClient.GetClusteredTableSchema(self._table_schema).items()])
+            sqlite_conn.execute(f"CREATE TABLE IF NOT EXISTS {SensorTableClusterer.NEW_TABLE_NAME} ({columns});")
+            sqlite_conn.execute(f"CREATE TABLE IF NOT EXISTS {SensorTableClusterer.PROGRESS_TABLE_NAME} (ID INTEGER PRIMARY KEY, LAST_TIMESTAMP INTEGER, LAST_ROWID INTEGER);")
+            sqlite_conn.commit()
+            self._copy_rows(sqlite_conn, db_file)
+
+            sqlite_conn.execute(f"DROP INDEX IF EXISTS {SQLite3DBClient.CT6_TABLE_NAME}_INDEX;")
+            sqlite_conn.execute(f"DROP TABLE {SQLite3DBClient.CT6_TABLE_NAME};")
+            sqlite_conn.execute(f"ALTER TABLE {SensorTableClusterer.NEW_TABLE_NAME} RENAME TO {SQLite3DBClient.CT6_TABLE_NAME};")
+            sqlite_conn.execute(f"DROP TABLE {SensorTableClusterer.PROGRESS_TABLE_NAME};")
+            sqlite_conn.commit()
+            self._uio.info(f"{db_file}: Took {time()-start_time:.1f} seconds to convert. The space freed is reused but the file only shrinks if it is vacuumed.")
+
+        finally:
+            if sqlite_conn:
+                sqlite_conn.close()
+
+    def _copy_rows(self, sqlite_conn, db_file):
+        """@brief Copy the rows of the CT6_SENSOR table to the clustered table.
+           @param sqlite_conn The connection to the database.
+           @param db_file The sqlite database file."""
+        columns = ", ".join(self._column_list)
+        insert_sql = f"INSERT INTO {SensorTableClusterer.NEW_TABLE_NAME} ({columns}) VALUES ({', '.join(['?']*len(self._column_list))});"
+        row_count = sqlite_conn.execute(f"SELECT COUNT(*) FROM {SQLite3DBClient.CT6_TABLE_NAME};").fetchone()[0]
+        last_timestamp, last_rowid = -1, -1
+        row = sqlite_conn.execute(f"SELECT LAST_TIMESTAMP, LAST_ROWID FROM {SensorTableClusterer.PROGRESS_TABLE_NAME} WHERE ID=1;").fetchone()
+        if row:
+            last_timestamp, last_rowid = row
+        # The TIMESTAMP of the last row stored in the clustered table.
+        last_stored_timestamp = sqlite_conn.execute(f"SELECT MAX({SQLite3DBClient.TIMESTAMP}) FROM {SensorTableClusterer.NEW_TABLE_NAME};").fetchone()[0]
+        copied_row_count = sqlite_conn.execute(f"SELECT COUNT(*) FROM {SensorTableClusterer.NEW_TABLE_NAME};").fetchone()[0]
+        while True:
+            # The TIMESTAMP index holds the rows in TIMESTAMP, rowid order.
+            cmd = f"SELECT {SQLite3DBClient.TIMESTAMP}, rowid, {columns} FROM {SQLite3DBClient.CT6_TABLE_NAME} "\
+                  f"WHERE ({SQLite3DBClient.TIMESTAMP}, rowid) > (?, ?) ORDER BY {SQLite3DBClient.TIMESTAMP}, rowid LIMIT {self._chunk_size};"
+            row_list = sqlite_conn.execute(cmd, (last_timestamp, last_rowid)).fetchall()
+            if not row_list:
+                break
+
+            value_list = []
+            for row in row_list:
+                values = list(row[2:])
+                timestamp = values[SQLite3DBClient.TIMESTAMP_INDEX]
+                if last_stored_timestamp is not None and timestamp <= last_stored_timestamp:
+                    timestamp = last_stored_timestamp + 1
+                    values[SQLite3DBClient.TIMESTAMP_INDEX] = timestamp
+                last_stored_timestamp = timestamp
+                value_list.append(values)
+            sqlite_conn.executemany(insert_sql, value_list)
+            last_timestamp, last_rowid = row_list[-1][0], row_list[-1][1]
+            # Record the last row copied in the same transaction as the rows.
+            sqlite_conn.execute(f"REPLACE INTO {SensorTableClusterer.PROGRESS_TABLE_NAME} (ID, LAST_TIMESTAMP, LAST_ROWID) VALUES (1, ?, ?);", (last_timestamp, last_rowid))
+            sqlite_conn.commit()
+            copied_row_count += len(row_list)
+            self._uio.info(f"{db_file}: Converted {copied_row_count} of {row_count} rows.")
+
+
 class AppServer(object):
     """@brief Responsible for
         - Starting the YViewCollector.
@@ -395,11 +933,13 @@ class AppServer(object):
         collector_thread.daemon = True
         collector_thread.start()
 
-    def start(self, db_client):
+    def start(self, db_client, start_populating_database=True):
         """@Start the App server running.
-            @param db_client An instance of SQLite3DBClient."""
+            @param db_client An instance of SQLite3DBClient.
+            @param start_populating_database If False startPopulatingDatabase() has already been called."""
         try:
-            self.startPopulatingDatabase(db_client)
+            if start_populating_database:
+                self.startPopulatingDatabase(db_client)
 
             # Start a web UI to allow the user to view the data
             self._startGUI(db_client)
@@ -477,10 +1017,19 @@ def main():
         parser.add_argument("-e", "--exclude",      help="A comma separated list of IP addresses of CT6 units to exclude from data collection.  If omitted no CT6 units are excluded.")
 
         parser.add_argument("-n", "--no_gui",       action='store_true', help="Do not display the GUI. By default a local web browser is opend displaying the GUI. If this option is used the user will need to connect to the server using a web browser before the GUI is displayed.")
-        parser.add_argument("-m", "--maxpp",        help="The maximum number of plot points (default=86400).", type=int, default=86400)
+        parser.add_argument("-m", "--maxpp",        help="The maximum number of values read for a plot. If exceeded a lower resolution is read (default=86400).", type=int, default=86400)
         parser.add_argument("--negative",           action='store_true', help="Display imported electricity (kW) on plots as negative values.")
 
         parser.add_argument("--conv_dbs",           action='store_true', help="Convert MYSQL CT6 DB's into SQLITE DB's.")
+        parser.add_argument("--migrate_schema",     action='store_true', help="Migrate the CT6 SQLITE DB's to the latest schema version.")
+        parser.add_argument("--rebuild_derived",    action='store_true', help="Rebuild the minute, hour and day tables in the CT6 SQLITE DB's from the CT6_SENSOR table.")
+        parser.add_argument("--cluster_timestamp",  action='store_true', help="Convert the CT6_SENSOR table in the CT6 SQLITE DB's so that the rows are held in TIMESTAMP order (TIMESTAMP primary key).")
+        parser.add_argument("--export",             help="Export a table of the CT6 SQLITE DB's to Parquet or Arrow IPC files in this folder (one file per CT6 unit). pyarrow must be installed.")
+        parser.add_argument("--table",              help=f"The table to export (default={SQLite3DBClient.CT6_TABLE_NAME}).", choices=[SQLite3DBClient.CT6_TABLE_NAME] + SQLite3DBClient.LOW_RES_DATA_TABLE_LIST, default=SQLite3DBClient.CT6_TABLE_NAME)
+        parser.add_argument("--start",              help="The local date/time (YYYY-MM-DD or 'YYYY-MM-DD HH:MM:SS') of the first row to export. If omitted the export starts at the first row.")
+        parser.add_argument("--stop",               help="The local date/time (YYYY-MM-DD or 'YYYY-MM-DD HH:MM:SS') at which the export stops. If omitted the export stops after the last row.")
+        parser.add_argument("--format",             help=f"The format of the exported files (default={DBExporter.PARQUET}).", choices=DBExporter.FORMAT_LIST, default=DBExporter.PARQUET)
+        parser.add_argument("--batch_rows",         help=f"The number of rows in each record batch of the exported files (default={DBExporter.DEFAULT_BATCH_ROWS}).", type=int, default=DBExporter.DEFAULT_BATCH_ROWS)
 
         parser.add_argument("--syslog",             action='store_true', help="Enable syslog debug data.")
         BootManager.AddCmdArgs(parser)
@@ -501,9 +1050,14 @@ def main():
             if options.configure:
                 app_config.configure(editConfigMethod=app_config.edit)
 
+            elif options.export:
+                # The databases are read only so this may run while the ct6_app is storing data.
+                db_exporter = DBExporter(uio, options, app_config)
+                db_exporter.export_all()
+
             else:
                 start_db_update = True
-                if options.conv_dbs or options.show_tables:
+                if options.conv_dbs or options.migrate_schema or options.rebuild_derived or options.cluster_timestamp or options.show_tables:
                     start_db_update = False
 
                 db_client = SQLite3DBClient(uio,
@@ -528,6 +1082,42 @@ def main():
                     # Start the app server so we don't miss data
                     app_server.start(db_client)
 
+                elif options.migrate_schema:
+                    app_server.startPopulatingDatabase(db_client)
+                    schema_migrator = SchemaMigrator(uio, options, app_config)
+                    # This may take a while with large databases.
+                    schema_migrator.migrate_all()
+                    # Update the database/s with all the CT6 dev_dict's received
+                    # while the databases were being migrated.
+                    count = db_client.update_db_from_dev_dict_queue()
+                    uio.info(f"Updated databases with {count} CT6 messages received while migrating the databases.")
+                    db_client.start_db_update()
+                    app_server.start(db_client, start_populating_database=False)
+
+                elif options.rebuild_derived:
+                    app_server.startPopulatingDatabase(db_client)
+                    derived_table_builder = DerivedTableBuilder(uio, options, app_config)
+                    # This may take a while with large databases.
+                    derived_table_builder.rebuild_all()
+                    # Update the database/s with all the CT6 dev_dict's received
+                    # while the derived tables were being rebuilt.
+                    count = db_client.update_db_from_dev_dict_queue()
+                    uio.info(f"Updated databases with {count} CT6 messages received while rebuilding the derived tables.")
+                    db_client.start_db_update()
+                    app_server.start(db_client, start_populating_database=False)
+
+                elif options.cluster_timestamp:
+                    app_server.startPopulatingDatabase(db_client)
+                    sensor_table_clusterer = SensorTableClusterer(uio, options, app_config)
+                    # This may take a while with large databases.
+                    sensor_table_clusterer.cluster_all()
+                    # Update the database/s with all the CT6 dev_dict's received
+                    # while the databases were being converted.
+                    count = db_client.update_db_from_dev_dict_queue()
+                    uio.info(f"Updated databases with {count} CT6 messages received while converting the databases.")
+                    db_client.start_db_update()
+                    app_server.start(db_client, start_populating_database=False)
+
                 elif options.show_tables:
                     db_client.show_tables()
 
@@ -1,22 +1,20 @@
 import itertools
 import os
-import psutil
-import objgraph
+import zlib
 import inspect
-import copy
 import platform
 import rich
 import json
 import sys
 import threading
-from time import time, sleep
+from time import time, sleep, perf_counter, mktime
 
 import sqlite3
+import pathlib
+import numpy as np
 
-import pandas as pd
 
-from datetime import datetime
-from queue import Queue, Empty
+from datetime import datetime, timedelta
 
 from bokeh.layouts import column, row
 from bokeh.models import HoverTool
@@ -29,14 +27,41 @@ from lib.base_constants import BaseConstants
 from lib.config import ConfigBase
 
 from lib.yview import YView
+from lib.rollup import RollupAccumulator
+from lib.instrumentation import Instrumentation
 
 from ct6.gui_base import GUIBase
+from ct6.ingest_queue import IngestQueue
+from ct6.partition_router import PartitionRouter
+from ct6.cold_archive import ColdArchive
+from ct6.db_maintenance import DBMaintenance
+from ct6.downsampler import Downsampler
+from ct6.column_data import ColumnData
+from ct6.query_cache import QueryCache
+from ct6.live_feed import LiveFeed, LiveTail
 
 class GUI(GUIBase):
     """@brief Responsible for providing the GUI dashboard for viewing data from CT6 devices.
               This is provided over a Web interface."""
 
     META_DATA_ROW               = "META_DATA_ROW"
+    ENERGY_SUMS                 = "ENERGY_SUMS"
+    GAP_LIST                    = "GAP_LIST"
+    GAP_START                   = "GAP_START"
+    GAP_STOP                    = "GAP_STOP"
+    RESOLUTION                  = "RESOLUTION"
+    LIVE_TAIL                   = "LIVE_TAIL"
+
+    # The table read for each resolution.
+    RESOLUTION_TABLE_LIST       = (BaseConstants.MAX_RES_DB_DATA_TABLE_NAME,
+                                   BaseConstants.MINUTE_RES_DB_DATA_TABLE_NAME,
+                                   BaseConstants.HOUR_RES_DB_DATA_TABLE_NAME,
+                                   BaseConstants.DAY_RES_DB_DATA_TABLE_NAME)
+    # The max number of points plotted in each trace. This is about twice the width (pixels) of a large plot.
+    PLOT_POINT_COUNT            = 4000
+    # The number of points that may be added to each trace while the plot of the current period is extended
+    # with the rows received. Once exceeded the oldest points are removed.
+    LIVE_TAIL_POINT_COUNT       = 20000
 
     META_TABLE_ID_INDEX = 0
     META_TABLE_ASSY_INDEX = 1
@@ -65,6 +90,11 @@ class GUI(GUIBase):
 
         self._db_client = db_client
         self._db_dicts = {}
+        # Holds the results of recent database reads so that returning to a period is quick.
+        self._queryCache = QueryCache(config.getAttr(AppConfig.QUERY_CACHE_SIZE_MB)*1000000)
+        # The traces of the last plot that can be extended with the rows received (see _startLiveTail()).
+        self._liveTraceList = []
+        self._liveTail = None
 
     def _executeSQL(self, conn, cmd):
         """@brief Execute an SQL cmd.
@@ -86,7 +116,7 @@ class GUI(GUIBase):
             conn = None
             try:
                 # Connect to the database
-                conn = sqlite3.connect(db_file)
+                conn = SQLite3DBClient.ConnectReadOnly(db_file, self._config)
                 # We'll store parameters in this dict
                 db_dict = {}
                 self._db_dicts[db_file]=db_dict
@@ -206,8 +236,11 @@ class GUI(GUIBase):
 
         # Clear the queue once we have the lock to ensure it's
         # not being read inside the _update() method.
+        self._stopLiveTail()
         while not self._commsQueue.empty():
-            self._commsQueue.get(block=False)
+            rxDict = self._commsQueue.get(block=False)
+            if GUI.LIVE_TAIL in rxDict:
+                self._db_client.get_live_feed().unsubscribe(rxDict[GUI.LIVE_TAIL][0])
 
         doc.clear()
         self._doc = doc
@@ -222,6 +255,7 @@ class GUI(GUIBase):
 
         self._dbTableList = []
         self._cdsDict = {}
+        self._gapCDSDict = {}
         for dbName in self._db_dicts.keys():
             db_dict = self._db_dicts[dbName]
 
@@ -255,6 +289,10 @@ class GUI(GUIBase):
                     self._cdsDict[dbName + plotNames[i]] = cds
                     self._plotPanel.line(GUI.X_AXIS_NAME, GUI.DEFAULT_YAXIS_NAME, source=cds, name=plotNames[i], legend_label=plotNames[i], line_color=next(colors), line_width=3)
                     self._plotPanel.legend.click_policy="hide"
+            # Shade the periods in which no data was received.
+            gapCDS = ColumnDataSource({GUI.GAP_START: [], GUI.GAP_STOP: []})
+            self._gapCDSDict[dbName] = gapCDS
+            self._plotPanel.vstrip(x0=GUI.GAP_START, x1=GUI.GAP_STOP, source=gapCDS, fill_color="grey", fill_alpha=0.3, line_alpha=0.0, legend_label="No data")
             self._plotPanel.legend.location = 'bottom_left'
 
             self._tabList.append( TabPanel(child=self._plotPanel,  title=db_dict[GUI.META_DATA_ROW][GUI.META_TABLE_DEVNAME_INDEX]) )
@@ -298,10 +336,12 @@ class GUI(GUIBase):
            @param units The unit (Y axis label).
            @param appPlotIndex The index of the field on the row data.
            @param rxDict The dict containing the value/s to plot."""
+        plotSummary = ""
         try:
             self._showStatus(0, "Plotting Data...")
 
             self._plotPanel.legend.visible=False
+            resolution = rxDict.get(GUI.RESOLUTION, self._resRadioButtonGroup.active)
 
             for dbName in self._db_dicts.keys():
                 ct1Name, ct2Name, ct3Name, ct4Name, ct5Name, ct6Name = self._get_db_plot_names(dbName)
@@ -333,19 +373,23 @@ class GUI(GUIBase):
                     if ct6TraceKey in self._cdsDict:
                         self._cdsDict[ct6TraceKey].data = ct6Dict
 
-                    for recordDict in data:
-                        if appPlotIndex < len(recordDict):
-                            ts = datetime.fromisoformat(recordDict[BaseConstants.TIMESTAMP_INDEX])
-                            ct1Dict[GUI.X_AXIS_NAME].append(ts)
-                            ct1Dict[GUI.DEFAULT_YAXIS_NAME].append(recordDict[appPlotIndex])
+                    # These values change slowly so LTTB keeps the shape of the trace with fewer points.
+                    if appPlotIndex < data.get_column_count():
+                        ct1Dict, pointCount = self._getTraceData(data, data.get_column(appPlotIndex), None, Downsampler.LTTB)
+                    else:
+                        pointCount = 0
                     # Plot the value of interest using the ct1Dict trace
                     self._cdsDict[ct1TraceKey].data = ct1Dict
+                    if pointCount > 0:
+                        self._liveTraceList = [(ct1TraceKey, appPlotIndex, 1.0, None)]
+                    self._updateGaps(dbName, rxDict.get(GUI.GAP_LIST))
+                    plotSummary = self._getPlotSummary(resolution, len(data), pointCount, Downsampler.LTTB)
 
         finally:
             self._showStatus(0, "")
             self._enableReadDBButtons(True)
             exeTime = time()-self._startUpdateTime
-            msg = f"Took {exeTime:.1f} seconds to read and plot the data."
+            msg = f"Took {exeTime:.1f} seconds to read and plot the data.{plotSummary}"
             self._showStatus(0, msg)
 
     def _processRXDict(self, rxDict):
@@ -366,10 +410,15 @@ class GUI(GUIBase):
             enabled = rxDict[GUI.ENABLE_ACTION_BUTTONS]
             self._enableActionButtons(enabled)
 
-        elif GUI.SUMMARY_ROW in rxDict:
+        elif GUI.SUMMARY_ROW in rxDict or GUI.SUMMARY_ROW_LIST in rxDict:
             self._updateSummaryTable(rxDict)
 
+        elif GUI.PEAK_KWH_RESULT in rxDict:
+            self._peakKWHResultDiv.text = rxDict[GUI.PEAK_KWH_RESULT]
+
         else:
+            # The plot is replaced so it is no longer extended with the rows received.
+            self._stopLiveTail()
             if self._updatePlotType == GUI.PLOT_TYPE_AC_VOLTS:
                 appPlotIndex = BaseConstants.VOLTAGE_INDEX
                 plotName = "AC Voltage"
@@ -397,6 +446,8 @@ class GUI(GUIBase):
             else:
                 self._plotKWH(rxDict, self._updatePlotType)
 
+            self._startLiveTail(rxDict)
+
         exeTime = time()-startT
         self._uio.debug(f"{fName}: Execution time {exeTime:.1f} seconds.")
 
@@ -405,9 +456,11 @@ class GUI(GUIBase):
         """@brief Plot the measured powers from the CT sensors.
            @param rxDict The dict of values read from the database.
            @param plotType The type of data to plot."""
+        plotSummary = ""
         try:
             self._showStatus(0, "Plotting Data...")
 
+            resolution = rxDict.get(GUI.RESOLUTION, self._resRadioButtonGroup.active)
             fieldIndexList = None
             if plotType == GUI.PLOT_TYPE_POWER_ACTIVE:
                 fieldIndexList = (BaseConstants.CT1_ACT_WATTS_INDEX,
@@ -448,6 +501,8 @@ class GUI(GUIBase):
                 self._line1StatusDiv.text = ""
 
             self._plotPanel.legend.visible=True
+            # The energy read from the minute, hour and day tables if the database holds it.
+            energySums = rxDict.get(GUI.ENERGY_SUMS)
             for dbName in self._db_dicts.keys():
                 # This dict holds the values to be plotted
                 # key = The name of the trace
@@ -462,7 +517,7 @@ class GUI(GUIBase):
                     ct4TraceKey = None
                     ct5TraceKey = None
                     ct6TraceKey = None
-                    rowList = rxDict[dbName]
+                    columnData = rxDict[dbName]
                     ct1Name, ct2Name, ct3Name, ct4Name, ct5Name, ct6Name = self._get_db_plot_names(dbName)
 
                     #If CT1 is in use
@@ -489,116 +544,203 @@ class GUI(GUIBase):
                     if ct6Name and len(ct6Name) > 0:
                         ct6TraceKey=dbName+ct6Name
 
-                    #Replace the data set
-                    ct1Dict = {GUI.X_AXIS_NAME: [], GUI.DEFAULT_YAXIS_NAME: []}
-                    ct2Dict = {GUI.X_AXIS_NAME: [], GUI.DEFAULT_YAXIS_NAME: []}
-                    ct3Dict = {GUI.X_AXIS_NAME: [], GUI.DEFAULT_YAXIS_NAME: []}
-                    ct4Dict = {GUI.X_AXIS_NAME: [], GUI.DEFAULT_YAXIS_NAME: []}
-                    ct5Dict = {GUI.X_AXIS_NAME: [], GUI.DEFAULT_YAXIS_NAME: []}
-                    ct6Dict = {GUI.X_AXIS_NAME: [], GUI.DEFAULT_YAXIS_NAME: []}
-
-                    for _row in rowList:
-
-                        if ct1TraceKey:
-                            self._addToPlot(ct1Dict, _row, fieldIndexList[0], plotType)
-
-                        if ct2TraceKey:
-                            self._addToPlot(ct2Dict, _row, fieldIndexList[1], plotType)
-
-                        if ct3TraceKey:
-                            self._addToPlot(ct3Dict, _row, fieldIndexList[2], plotType)
-
-                        if ct4TraceKey:
-                            self._addToPlot(ct4Dict, _row, fieldIndexList[3], plotType)
-
-                        if ct5TraceKey:
-                            self._addToPlot(ct5Dict, _row, fieldIndexList[4], plotType)
-
-                        if ct6TraceKey:
-                            self._addToPlot(ct6Dict, _row, fieldIndexList[5], plotType)
-
-                    if ct1TraceKey:
-                        self._cdsDict[ct1TraceKey].data = ct1Dict
-                        # Start a thread to calculate the kWh for this sensor
-                        threading.Thread( target=self._calcKWH, args=(1, ct1Name, rowList, self._resRadioButtonGroup.active)).start()
-
-                    if ct2TraceKey:
-                        self._cdsDict[ct2TraceKey].data = ct2Dict
-                        # Start a thread to calculate the kWh for this sensor
-                        threading.Thread( target=self._calcKWH, args=(2, ct2Name, rowList, self._resRadioButtonGroup.active)).start()
-
-                    if ct3TraceKey:
-                        self._cdsDict[ct3TraceKey].data = ct3Dict
-                        # Start a thread to calculate the kWh for this sensor
-                        threading.Thread( target=self._calcKWH, args=(3, ct3Name, rowList, self._resRadioButtonGroup.active)).start()
-
-                    if ct4TraceKey:
-                        self._cdsDict[ct4TraceKey].data = ct4Dict
-                        # Start a thread to calculate the kWh for this sensor
-                        threading.Thread( target=self._calcKWH, args=(4, ct4Name, rowList, self._resRadioButtonGroup.active)).start()
-
-                    if ct5TraceKey:
-                        self._cdsDict[ct5TraceKey].data = ct5Dict
-                        # Start a thread to calculate the kWh for this sensor
-                        threading.Thread( target=self._calcKWH, args=(5, ct5Name, rowList, self._resRadioButtonGroup.active)).start()
-
-                    if ct6TraceKey:
-                        self._cdsDict[ct6TraceKey].data = ct6Dict
-                        # Start a thread to calculate the kWh for this sensor
-                        threading.Thread( target=self._calcKWH, args=(6, ct6Name, rowList, self._resRadioButtonGroup.active)).start()
+                    # The values of each trace are scaled using the columns read.
+                    if plotType == GUI.PLOT_TYPE_POWER_FACTOR:
+                        scale = None
+                    elif self._invertKW():
+                        scale = -1/1000.0
+                    else:
+                        scale = 1/1000.0
+                    # If plotting hourly or daily we add a plot point at the end of the hour/day so
+                    # the user sees a stepped chart
+                    stepUnit = None
+                    if resolution == GUI.HOUR_RESOLUTION:
+                        stepUnit = ColumnData.HOUR
+                    elif resolution == GUI.DAY_RESOLUTION:
+                        stepUnit = ColumnData.DAY
+
+                    # The min and max of each period are plotted so that the power peaks are not lost.
+                    pointCount = 0
+                    for traceKey, fieldIndex in ((ct1TraceKey, fieldIndexList[0]),
+                                                 (ct2TraceKey, fieldIndexList[1]),
+                                                 (ct3TraceKey, fieldIndexList[2]),
+                                                 (ct4TraceKey, fieldIndexList[3]),
+                                                 (ct5TraceKey, fieldIndexList[4]),
+                                                 (ct6TraceKey, fieldIndexList[5])):
+                        if traceKey:
+                            yValues = self._getScaledValues(columnData, fieldIndex, scale)
+                            plotDict, tracePointCount = self._getTraceData(columnData, yValues, stepUnit, Downsampler.MIN_MAX)
+                            self._cdsDict[traceKey].data = plotDict
+                            pointCount = max(pointCount, tracePointCount)
+                            self._liveTraceList.append((traceKey, fieldIndex, scale, stepUnit))
+                    plotSummary = self._getPlotSummary(resolution, len(columnData), pointCount, Downsampler.MIN_MAX)
+
+                    self._updateGaps(dbName, rxDict.get(GUI.GAP_LIST))
+
+                    sensorList = []
+                    for sensorID, traceKey, sensorName in ((1, ct1TraceKey, ct1Name),
+                                                           (2, ct2TraceKey, ct2Name),
+                                                           (3, ct3TraceKey, ct3Name),
+                                                           (4, ct4TraceKey, ct4Name),
+                                                           (5, ct5TraceKey, ct5Name),
+                                                           (6, ct6TraceKey, ct6Name)):
+                        if traceKey:
+                            sensorList.append((sensorID, sensorName))
+                    self._updateKWHSummary(sensorList, columnData, energySums)
 
         finally:
             self._showStatus(0, "")
             self._enableReadDBButtons(True)
             exeTime = time()-self._startUpdateTime
-            msg = f"Took {exeTime:.1f} seconds to read and plot the data."
+            msg = f"Took {exeTime:.1f} seconds to read and plot the data.{plotSummary}"
             self._showStatus(0, msg)
 
-    def _addToPlot(self, plotDict, rowData, index, plotType):
-        """@brief Add to plot dict for a single trace.
-           @param plotDict A dict containing x and Y values lists.
-           @param rowData The source data.
-           @param index The index to the field/column to be plotted.
-           @param plotType The type of data being plotted."""
-        invertKw = self._invertKW()
+    def _getScaledValues(self, columnData, fieldIndex, scale):
+        """@brief Get the values of a column to plot.
+           @param columnData The ColumnData instance holding the rows read from the database.
+           @param fieldIndex The index of the column.
+           @param scale The value each value is multiplied by or None to plot the absolute values.
+           @return A numpy array of the values to plot."""
+        yValues = columnData.get_column(fieldIndex)
+        if scale is None:
+            return np.abs(yValues)
+        return yValues*scale
+
+    def _startLiveTail(self, rxDict):
+        """@brief If the period plotted includes the current time start extending the plot with the
+                  rows received (see _updateLiveTail()).
+           @param rxDict The dict of values read from the database."""
+        if GUI.LIVE_TAIL in rxDict:
+            subscription, stopTS = rxDict[GUI.LIVE_TAIL]
+            columnData = rxDict.get(subscription.db_file)
+            if self._liveTraceList and columnData is not None:
+                lastTimestamp = 0
+                if len(columnData) > 0:
+                    lastTimestamp = int(columnData.timestamps[-1])
+                pointCount = max(len(self._cdsDict[traceKey].data[GUI.X_AXIS_NAME]) for traceKey, _, _, _ in self._liveTraceList)
+                self._liveTail = LiveTail(subscription,
+                                          GUI.RESOLUTION_TABLE_LIST[rxDict[GUI.RESOLUTION]],
+                                          stopTS,
+                                          lastTimestamp,
+                                          self._liveTraceList,
+                                          pointCount+GUI.LIVE_TAIL_POINT_COUNT)
+            else:
+                self._db_client.get_live_feed().unsubscribe(subscription)
+        self._liveTraceList = []
+
+    def _stopLiveTail(self):
+        """@brief Stop extending the plot with the rows received."""
+        if self._liveTail:
+            self._db_client.get_live_feed().unsubscribe(self._liveTail.subscription)
+            self._liveTail = None
+        self._liveTraceList = []
+
+    def _update(self, maxDwellMS=1000):
+        """@brief Called periodically to update the Web GUI."""
+        super()._update(maxDwellMS=maxDwellMS)
+        try:
+            self._updateLiveTail()
 
-        ts = datetime.fromisoformat(rowData[BaseConstants.TIMESTAMP_INDEX])
+        except Exception:
+            self._uio.errorException()
+
+    def _updateLiveTail(self):
+        """@brief Add the rows committed to the database since the plot was last updated to the end of
+                  each trace. Only the new points are sent to the browser."""
+        liveTail = self._liveTail
+        if liveTail is None:
+            return
+
+        rowList = [row for row in liveTail.subscription.get_rows(liveTail.table_name)
+                   if liveTail.last_timestamp < row[BaseConstants.TIMESTAMP_INDEX] <= liveTail.stop_timestamp]
+        if rowList:
+            columnData = ColumnData(rowList)
+            for traceKey, fieldIndex, scale, stepUnit in liveTail.trace_list:
+                xValues = columnData.x
+                yValues = self._getScaledValues(columnData, fieldIndex, scale)
+                if stepUnit:
+                    xValues, yValues = ColumnData.GetSteps(xValues, yValues, stepUnit)
+                self._cdsDict[traceKey].stream({GUI.X_AXIS_NAME: xValues, GUI.DEFAULT_YAXIS_NAME: yValues}, rollover=liveTail.rollover)
+            liveTail.last_timestamp = rowList[-1][BaseConstants.TIMESTAMP_INDEX]
+
+        if time()*1000 > liveTail.stop_timestamp:
+            # The period plotted has passed.
+            self._stopLiveTail()
+
+    def _getTraceData(self, columnData, yValues, stepUnit, method):
+        """@brief Get the data of a trace. If more than PLOT_POINT_COUNT rows were read they are downsampled.
+           @param columnData The ColumnData instance holding the rows read from the database.
+           @param yValues A numpy array of the values to plot.
+           @param stepUnit ColumnData.HOUR or ColumnData.DAY to plot a stepped chart or None.
+           @param method The Downsampler method used.
+           @return A tuple holding
+                   0 = The dict of the X and Y numpy arrays to be passed to the ColumnDataSource.
+                   1 = The number of rows plotted."""
+        xValues = columnData.x
+        if len(yValues) > GUI.PLOT_POINT_COUNT:
+            rowIndexes = Downsampler.GetIndexes(method, columnData.timestamps, yValues, GUI.PLOT_POINT_COUNT)
+            xValues = xValues[rowIndexes]
+            yValues = yValues[rowIndexes]
+        pointCount = len(yValues)
+        if stepUnit:
+            xValues, yValues = ColumnData.GetSteps(xValues, yValues, stepUnit)
+        return {GUI.X_AXIS_NAME: xValues, GUI.DEFAULT_YAXIS_NAME: yValues}, pointCount
+
+    def _getPlotSummary(self, resolution, rowCount, pointCount, method):
+        """@param resolution The resolution of the rows read.
+           @param rowCount The number of rows read.
+           @param pointCount The max number of rows plotted in a trace.
+           @param method The Downsampler method used.
+           @return The text shown in the status line describing the data plotted."""
+        summary = f" {GUI.RESOLUTION_NAME_LIST[resolution].capitalize()} resolution"
+        if resolution != self._resRadioButtonGroup.active:
+            summary += f" (selected as more than {self._options.maxpp} {GUI.RESOLUTION_NAME_LIST[self._resRadioButtonGroup.active]} resolution values were found)"
+        summary += f", {rowCount} values read"
+        if pointCount < rowCount:
+            summary += f", {pointCount} plotted ({method})"
+        return summary + "."
+
+    def _updateGaps(self, dbName, gapList):
+        """@brief Update the shaded periods of a plot in which no data was received.
+           @param dbName The database the plot shows.
+           @param gapList A list of (gap start, gap stop) tuples read by SQLite3DBClient.GetGapList() or None."""
+        gapDict = {GUI.GAP_START: [], GUI.GAP_STOP: []}
+        if gapList:
+            for gapStart, gapStop in gapList:
+                gapDict[GUI.GAP_START].append(SQLite3DBClient.GetDateTime(gapStart))
+                gapDict[GUI.GAP_STOP].append(SQLite3DBClient.GetDateTime(gapStop))
+        if dbName in self._gapCDSDict:
+            self._gapCDSDict[dbName].data = gapDict
+
+    def _updateKWHSummary(self, sensorList, columnData, energySums):
+        """@brief Update the kWh summary of the CT's plotted. A single message holding the summary
+                  of all the CT's is sent.
+           @param sensorList A list of (sensor ID (1-6), sensor name) tuples.
+           @param columnData The ColumnData instance holding the rows read from the database.
+           @param energySums The energy read by SQLite3DBClient.GetEnergySums() or None if the
+                             database does not hold the energy of each CT."""
+        if not sensorList:
+            return
+
+        if energySums is None:
+            summaryRowList = self._calcKWH(sensorList, columnData)
 
-        plotDict[GUI.X_AXIS_NAME].append(ts)
-        if plotType == GUI.PLOT_TYPE_POWER_FACTOR:
-            plotDict[GUI.DEFAULT_YAXIS_NAME].append(abs(rowData[index]))
         else:
-            if invertKw:
-                plotDict[GUI.DEFAULT_YAXIS_NAME].append(-rowData[index]/1000.0)
-            else:
-                plotDict[GUI.DEFAULT_YAXIS_NAME].append(rowData[index]/1000.0)
-
-        # If plotting hourly we add a plot point at the end of the hour so
-        # the user sees a stepped chart
-        if self._resRadioButtonGroup.active == GUI.HOUR_RESOLUTION:
-            ts=ts=ts.replace(minute=59, second=59, microsecond=999)
-            plotDict[GUI.X_AXIS_NAME].append(ts)
-            if plotType == GUI.PLOT_TYPE_POWER_FACTOR:
-                plotDict[GUI.DEFAULT_YAXIS_NAME].append(abs(rowData[index]))
-            else:
-                if invertKw:
-                    plotDict[GUI.DEFAULT_YAXIS_NAME].append(-rowData[index]/1000.0)
+            summaryRowList = []
+            for sensorID, sensorName in sensorList:
+                importkWh = energySums[(sensorID-1)*2]/1000.0
+                exportkWh = energySums[(sensorID-1)*2+1]/1000.0
+                if self._invertKW():
+                    pTotalkWh = -exportkWh
+                    nTotalkWh = -importkWh
                 else:
-                    plotDict[GUI.DEFAULT_YAXIS_NAME].append(rowData[index]/1000.0)
-
+                    pTotalkWh = importkWh
+                    nTotalkWh = exportkWh
+                summaryRowList.append([sensorID, sensorName, pTotalkWh+nTotalkWh, pTotalkWh, nTotalkWh])
 
-        # If plotting daily we add a plot point at the end of the day so
-        # the user sees a stepped chart
-        if self._resRadioButtonGroup.active == GUI.DAY_RESOLUTION:
-            ts=ts=ts.replace(hour=23, minute=59, second=59, microsecond=999)
-            plotDict[GUI.X_AXIS_NAME].append(ts)
-            if plotType == GUI.PLOT_TYPE_POWER_FACTOR:
-                plotDict[GUI.DEFAULT_YAXIS_NAME].append(abs(rowData[index]))
-            else:
-                if invertKw:
-                    plotDict[GUI.DEFAULT_YAXIS_NAME].append(-rowData[index]/1000.0)
-                else:
-                    plotDict[GUI.DEFAULT_YAXIS_NAME].append(rowData[index]/1000.0)
+        summaryDict = {}
+        summaryDict[GUI.SUMMARY_ROW_LIST]=summaryRowList
+        self._commsQueue.put(summaryDict)
 
     def _readDataBase(self, db_file, startDateTime, stopDateTime, resolution):
         """@brief Read data from the database.
@@ -619,8 +761,9 @@ class GUI(GUIBase):
             return results
 
         conn = None
+        liveSubscription = None
         try:
-            conn = sqlite3.connect(db_file)
+            conn = SQLite3DBClient.ConnectReadOnly(db_file, self._config)
 
             # Start and stop dates are in milliseconds since epoch time, convert to seconds since epoch time.
             startDT=datetime.fromtimestamp(startDateTime/1000)
@@ -635,56 +778,78 @@ class GUI(GUIBase):
             startHoursMins = startDT.strftime("%H:%M")
             stopHoursMins = stopDT.strftime("%H:%M")
 
+            # Select the whole of the start and stop minutes.
+            schemaVersion = SQLite3DBClient.GetSchemaVersion(conn)
+            if schemaVersion >= SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+                startTS = SQLite3DBClient.GetDBTimestamp(startDT.replace(second=0, microsecond=0), SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP)
+                stopTS = SQLite3DBClient.GetDBTimestamp(stopDT.replace(second=59, microsecond=999000), SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP)
+                timestampRange = f"TIMESTAMP BETWEEN {startTS} AND {stopTS}"
+            else:
+                startTS = None
+                stopTS = None
+                timestampRange = f"TIMESTAMP BETWEEN '{startDate} {startHoursMins}:00:000' AND '{stopDate} {stopHoursMins}:59:999'"
+
             dBName = self._getSelectedDataBase()
             startT = time()
             fName = inspect.currentframe().f_code.co_name
             self._uio.debug(f"{fName}: DB={db_file}, startDate={startDate}, stopDate={stopDate}, resolution={resolution}")
 
-            if resolution == GUI.MAX_RESOLUTION:
-                tableName = BaseConstants.MAX_RES_DB_DATA_TABLE_NAME
-
-            elif resolution == GUI.MINUTE_RESOLUTION:
-                tableName = BaseConstants.MINUTE_RES_DB_DATA_TABLE_NAME
-
-            elif resolution == GUI.HOUR_RESOLUTION:
-                tableName = BaseConstants.HOUR_RES_DB_DATA_TABLE_NAME
-
-            elif resolution == GUI.DAY_RESOLUTION:
-                tableName = BaseConstants.DAY_RES_DB_DATA_TABLE_NAME
+            cacheKey = None
+            if schemaVersion >= SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+                if startTS <= time()*1000 <= stopTS:
+                    # The period includes the current time so the plot is extended with the rows committed
+                    # from now on. Rows committed while the database is read are ignored if already read.
+                    liveSubscription = self._db_client.get_live_feed().subscribe(db_file)
+
+                cacheKey = (db_file, GUI.RESOLUTION_TABLE_LIST[resolution], startTS, stopTS, resolution)
+                watermark = self._db_client.get_ingest_watermark(db_file)
+                cachedResults = self._queryCache.get(cacheKey, watermark)
+                if cachedResults is not None:
+                    results = dict(cachedResults)
+                    if liveSubscription:
+                        results[GUI.LIVE_TAIL] = (liveSubscription, stopTS)
+                        liveSubscription = None
+                    self._commsQueue.put(results)
+                    self._uio.debug(f"{fName}: Cache hit. {self._queryCache.get_stats_text()}")
+                    return results
 
             maxRecordCount = self._options.maxpp
-            # We find how many records match the search before read every nth (stride value) record.
-            # This should allow resonable search times on large data sets.
-            cmd = f"SELECT COUNT(*) FROM {tableName} where TIMESTAMP BETWEEN '{startDate} {startHoursMins}:00:000' AND '{stopDate} {stopHoursMins}:59:999';"
-            responseTuple = self._executeSQL(conn, cmd)
+            # The selected resolution is the finest used. If more than the max number of rows are
+            # found the next coarser resolution table is read until the rows fit.
+            for resolution in range(resolution, GUI.DAY_RESOLUTION+1):
+                tableName = GUI.RESOLUTION_TABLE_LIST[resolution]
+                responseTuple = self._readRows(conn, db_file, tableName, schemaVersion, startTS, stopTS, timestampRange, maxRecordCount, resolution)
+                if responseTuple is not None:
+                    break
+                self._uio.debug(f"{fName}: More than {maxRecordCount} {tableName} rows found.")
             exeTime = time()-startT
             self._uio.debug(f"SQL command execution time {exeTime:.1f} seconds.")
-            recordCount = responseTuple[0][0]
-            self._uio.debug(f"recordCount = {recordCount}")
-
-# PJA
-            if recordCount > maxRecordCount:
-                # PJA: Wired this out as it's probably better to abort very large plots due to the time and memory it takes.
-                # The user can always use the '-m/--maxpp' command line argument to increase the default number of maximum
-                # plot points if they have fast machines with lots of memory.
-                pass
-                # If we will have more than the max number of plot points then reduce the number of points
-#                    stride = math.ceil( recordCount/maxRecordCount )
-#                    cmd = f' WITH ordering AS ( SELECT ROW_NUMBER() OVER (ORDER BY TIMESTAMP) AS n, {tableName}.*'\
-#                          f" FROM {tableName} where TIMESTAMP BETWEEN '{startDate} 00:00:00:000' AND '{stopDate} 23:59:59:999' ORDER BY TIMESTAMP"\
-#                          " )"\
-#                          f' SELECT * FROM ordering WHERE MOD(n, {stride}) = 0;'
-            else:
-                cmd = f"select * from {tableName} where TIMESTAMP BETWEEN '{startDate} {startHoursMins}:00:000' AND '{stopDate} {stopHoursMins}:59:999';"
 
-                responseTuple = self._executeSQL(conn, cmd)
+            if responseTuple is None:
+                # Only possible if the day table holds more than the max number of rows.
+                recordCount = maxRecordCount+1
+            else:
                 recordCount = len(responseTuple)
             self._uio.debug("Found {} records.".format( recordCount ))
             if recordCount > self._options.maxpp:
-                self._error(f"Reduce plot resolution ({recordCount} values read, max = {self._options.maxpp}).")
+                self._error(f"Reduce plot resolution (more than {self._options.maxpp} values found).")
                 self._sendEnableActionButtonsMsg(True)
             else:
-                results[dBName]=responseTuple
+                if schemaVersion < SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+                    # The TEXT timestamps are converted to milliseconds since the epoch.
+                    responseTuple = [(int(SQLite3DBClient.GetDateTime(_row[BaseConstants.TIMESTAMP_INDEX]).timestamp()*1000),) + tuple(_row[1:]) for _row in responseTuple]
+                results[dBName]=ColumnData(responseTuple)
+                results[GUI.RESOLUTION]=resolution
+                if schemaVersion >= SQLite3DBClient.SCHEMA_VERSION_ENERGY:
+                    # The kWh summary is read from the minute, hour and day tables rather than calculated from the rows read.
+                    results[GUI.ENERGY_SUMS]=SQLite3DBClient.GetEnergySums(conn, startTS, stopTS+1)
+                if schemaVersion >= SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+                    results[GUI.GAP_LIST]=SQLite3DBClient.GetGapList(conn, startTS, stopTS+1)
+                if cacheKey is not None:
+                    self._queryCache.put(cacheKey, dict(results), results[dBName].get_size(), watermark, self._isImmutable(stopTS, watermark))
+                if liveSubscription:
+                    results[GUI.LIVE_TAIL] = (liveSubscription, stopTS)
+                    liveSubscription = None
                 self._commsQueue.put(results)
 
             self._uio.debug(f"{fName}: Execution time {exeTime:.1f} seconds.")
@@ -692,71 +857,237 @@ class GUI(GUIBase):
             msgDict[GUI.STATUS_LINE_INDEX]=0
             msgDict[GUI.STATUS_MESSAGE]=f"Took {exeTime:.1f} seconds to read data from DB."
         finally:
+            if liveSubscription:
+                # The results were not sent to the GUI.
+                self._db_client.get_live_feed().unsubscribe(liveSubscription)
             if conn:
                 conn.close()
         return results
 
 
-    def _calcKWH(self, sensorID, sensorName, rowDictList, resolution):
-        """@brief Calculate the kWh usage for the CT data.
-           @param sensorID The ID of the sensor (0-3)
-           @param sensorName The name of the sensor.
-           @param rowDictList A list of dicts of each row in the database table."""
-        invertKw = self._invertKW()
+    def _isImmutable(self, stopTS, watermark):
+        """@brief Determine if the rows read from a database can no longer change. The minute, hour and day rows
+                  are written when each period closes so a period can only change until the day it is in has closed.
+           @param stopTS The last TIMESTAMP read.
+           @param watermark The ingest watermark of the database when it was read.
+           @return True if the rows up to stopTS can no longer change."""
+        if watermark is None or watermark[1] is None:
+            # No rows have been committed so the day that is open is not known.
+            return False
+        return stopTS < SQLite3DBClient.GetBucketStart(watermark[1], RollupAccumulator.DAY_INDEX)
+
+    def _readRows(self, conn, db_file, tableName, schemaVersion, startTS, stopTS, timestampRange, maxRecordCount, resolution):
+        """@brief Read the rows of a table in a period of time. The rows are fetched in chunks so
+                  the read stops as soon as more than the max number of rows are found. The progress
+                  is shown in the status line.
+           @param conn The read only connection to the database.
+           @param db_file The database file.
+           @param tableName The name of the table to read.
+           @param schemaVersion The schema version of the database.
+           @param startTS The first TIMESTAMP of interest (schema version 1 onwards).
+           @param stopTS The last TIMESTAMP of interest (schema version 1 onwards).
+           @param timestampRange The WHERE clause that selects the period.
+           @param maxRecordCount The max number of rows to read.
+           @param resolution The resolution of the table.
+           @return A list of the rows read or None if more than maxRecordCount rows were found."""
+        rowList = []
+        chunkIter = self._readRowChunks(conn, db_file, tableName, schemaVersion, startTS, stopTS, timestampRange)
+        progressTime = time()
+        try:
+            for rowChunk in chunkIter:
+                rowList.extend(rowChunk)
+                if len(rowList) > maxRecordCount:
+                    return None
+
+                if time() >= progressTime + GUI.READ_PROGRESS_SECS:
+                    progressTime = time()
+                    percent = None
+                    if schemaVersion >= SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP and stopTS > startTS:
+                        percent = 100.0*(rowList[-1][BaseConstants.TIMESTAMP_INDEX]-startTS)/(stopTS-startTS)
+                    self._sendReadProgress(resolution, len(rowList), percent)
+
+        finally:
+            # The partitions must be detached before the connection is closed.
+            chunkIter.close()
+        return rowList
+
+    def _readRowChunks(self, conn, db_file, tableName, schemaVersion, startTS, stopTS, timestampRange):
+        """@brief Read the rows of a table in a period of time in chunks. The max resolution rows may be held
+                  in the cold archive and monthly partitions.
+           @param conn The read only connection to the database.
+           @param db_file The database file.
+           @param tableName The name of the table to read.
+           @param schemaVersion The schema version of the database.
+           @param startTS The first TIMESTAMP of interest (schema version 1 onwards).
+           @param stopTS The last TIMESTAMP of interest (schema version 1 onwards).
+           @param timestampRange The WHERE clause that selects the period.
+           @return A generator of lists of rows in TIMESTAMP order."""
+        if tableName == BaseConstants.MAX_RES_DB_DATA_TABLE_NAME and schemaVersion >= SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+            timestampParams = {"start": startTS, "stop": stopTS}
+            # Rows that have been deleted from the database may be held in the archive. This is read a day at a time.
+            coldArchive = ColdArchive(db_file)
+            archiveStop = coldArchive.get_stop()
+            if archiveStop is not None and startTS < archiveStop:
+                columnList = list(SQLite3DBClient.GetTableSchema(SQLite3DBClient.CT6_DB_TABLE_SCHEMA_SQLITE_V1).keys())
+                for _date in coldArchive.get_day_list():
+                    dayStart = ColdArchive.GetEpochMS(_date)
+                    dayStop = ColdArchive.GetEpochMS(_date + timedelta(days=1))
+                    if dayStop > startTS and dayStart <= stopTS:
+                        yield coldArchive.read(columnList, max(startTS, dayStart), min(stopTS+1, dayStop))
+                # Only read the rows after the archive from the database.
+                timestampParams["start"] = max(startTS, archiveStop)
+            partitionRouter = PartitionRouter(db_file)
+            yield from partitionRouter.fetch_chunks(conn, tableName, "*", "TIMESTAMP BETWEEN :start AND :stop", timestampParams, timestampParams["start"], stopTS+1, GUI.READ_CHUNK_ROWS)
+
+        else:
+            cursor = conn.execute(f"select * from {tableName} where {timestampRange};")
+            try:
+                while True:
+                    rowList = cursor.fetchmany(GUI.READ_CHUNK_ROWS)
+                    if not rowList:
+                        break
+                    yield rowList
+
+            finally:
+                cursor.close()
+
+    def _calcKWH(self, sensorList, columnData):
+        """@brief Calculate the kWh usage of the CT's. The kWh of all the CT's are calculated in a
+                  single pass using the same time between each row.
+           @param sensorList A list of (sensor ID (1-6), sensor name) tuples.
+           @param columnData The ColumnData instance holding the rows read from the database table.
+           @return A list of the [sensor ID, sensor name, total kWh, positive kWh, negative kWh] summary rows."""
         startT = time()
         fName = inspect.currentframe().f_code.co_name
-        self._uio.debug(f"{fName}: sensorID={sensorID}, sensorName={sensorName}")
-        totalkWH = 0.0
-        if sensorID == 1:
-            key = BaseConstants.CT1_ACT_WATTS_INDEX
-        elif sensorID == 2:
-            key = BaseConstants.CT2_ACT_WATTS_INDEX
-        elif sensorID == 3:
-            key = BaseConstants.CT3_ACT_WATTS_INDEX
-        elif sensorID == 4:
-            key = BaseConstants.CT4_ACT_WATTS_INDEX
-        elif sensorID == 5:
-            key = BaseConstants.CT5_ACT_WATTS_INDEX
-        elif sensorID == 6:
-            key = BaseConstants.CT6_ACT_WATTS_INDEX
-
-        wattHoursList = []
-        pWattHoursList = []
-        nWattHoursList = []
-        lastTime = None
-        pTotalkWh = 0.0
-        nTotalkWh = 0.0
-        for rowDict in rowDictList:
-            thisTime = datetime.fromisoformat(rowDict[BaseConstants.TIMESTAMP_INDEX])
-            if invertKw:
-                watts = -rowDict[key]
-            else:
-                watts = rowDict[key]
-            if lastTime is not None:
-                elapsedHours = (thisTime-lastTime).total_seconds()/3600.0
-                wh = elapsedHours*watts
-                if wh >= 0.0:
-                    pWattHoursList.append(wh)
-                else:
-                    nWattHoursList.append(wh)
-                wattHoursList.append(wh)
+        self._uio.debug(f"{fName}: sensorList={sensorList}")
+        fieldIndexList = (BaseConstants.CT1_ACT_WATTS_INDEX,
+                          BaseConstants.CT2_ACT_WATTS_INDEX,
+                          BaseConstants.CT3_ACT_WATTS_INDEX,
+                          BaseConstants.CT4_ACT_WATTS_INDEX,
+                          BaseConstants.CT5_ACT_WATTS_INDEX,
+                          BaseConstants.CT6_ACT_WATTS_INDEX)
+        indexList = [fieldIndexList[sensorID-1] for sensorID, _ in sensorList]
+        totalkWhArray, pTotalkWhArray, nTotalkWhArray = columnData.get_kwh(indexList, self._invertKW())
+        summaryRowList = []
+        for (sensorID, sensorName), totalkWH, pTotalkWh, nTotalkWh in zip(sensorList,
+                                                                         totalkWhArray.tolist(),
+                                                                         pTotalkWhArray.tolist(),
+                                                                         nTotalkWhArray.tolist()):
+            summaryRowList.append([sensorID, sensorName, totalkWH, pTotalkWh, nTotalkWh])
+        self._uio.debug(f"{fName}: Execution time {time()-startT:.3f} seconds.")
+        return summaryRowList
+
+    def _findPeakDailyKWh(self, startDateTime, stopDateTime, ctName, ctField):
+        """@brief Worker method (runs in its own thread) that searches the database
+                  for the day with the largest absolute daily kWh value for the
+                  selected CT sensor, between the given start and stop date/times.
+                  The day table holds a row for each day. Days in which data was
+                  missing are found from the gaps recorded in the CT6_GAP table.
+           @param startDateTime The start of the search range as epoch time in milliseconds.
+           @param stopDateTime  The end of the search range as epoch time in milliseconds.
+           @param ctName        The name of the selected CT sensor (used in the result message).
+           @param ctField       The DB column (xxx_ACT_WATTS) holding the active power
+                                 reading for the selected CT sensor."""
+        fName = inspect.currentframe().f_code.co_name
+        conn = None
+        try:
+            if ctField is None:
+                self._error("No CT sensor is available to search.")
+                return
 
-            lastTime = thisTime
+            if startDateTime is None or stopDateTime is None:
+                self._error("The start/stop date/time is not correct.")
+                return
 
-        totalkWH = sum(wattHoursList)/1000.0
-        pTotalkWh = sum(pWattHoursList)/1000.0
-        nTotalkWh = sum(nWattHoursList)/1000.0
-        summaryDict = {}
-        summaryDict[GUI.SUMMARY_ROW]=[sensorID, sensorName, totalkWH, pTotalkWh, nTotalkWh]
-        self._commsQueue.put(summaryDict)
+            startDT = datetime.fromtimestamp(startDateTime/1000)
+            stopDT = datetime.fromtimestamp(stopDateTime/1000)
+            if startDT >= stopDT:
+                self._error("Stop must be after the start date.")
+                return
 
-        msgDict = {}
-        exeTime = time()-startT
-        msgDict[GUI.STATUS_LINE_INDEX]=0
-        msgDict[GUI.STATUS_MESSAGE]=f"Took {exeTime:.1f} seconds to read data from DB."
+            startDate = startDT.strftime("%Y-%m-%d")
+            stopDate = stopDT.strftime("%Y-%m-%d")
+            db_file = self._getSelectedDataBase()
+            self._uio.debug(f"{fName}: db_file={db_file}, ctName={ctName}, ctField={ctField}, "
+                            f"startDate={startDate}, stopDate={stopDate}")
+
+            conn = SQLite3DBClient.ConnectReadOnly(db_file, self._config)
+            schemaVersion = SQLite3DBClient.GetSchemaVersion(conn)
+            if schemaVersion < SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+                self._error("Run 'ct6_app --migrate_schema' to update the database before searching for the peak daily kWh.")
+                return
+
+            startTS = SQLite3DBClient.GetDBTimestamp(startDT.replace(second=0, microsecond=0), schemaVersion)
+            stopTS = SQLite3DBClient.GetDBTimestamp(stopDT.replace(second=59, microsecond=999000), schemaVersion)
+            # If the database holds the energy of each CT this is used. Otherwise the average power (Watts)
+            # of each day is used to estimate the energy (kWh = average Watts * 24 hours / 1000).
+            energyColumns = None
+            if schemaVersion >= SQLite3DBClient.SCHEMA_VERSION_ENERGY:
+                for powerCol, importCol, exportCol in SQLite3DBClient.CT_ENERGY_COLUMN_LIST:
+                    if powerCol == ctField:
+                        energyColumns = f"{importCol} + {exportCol}"
+            if energyColumns:
+                cmd = f"SELECT {BaseConstants.TIMESTAMP}, ({energyColumns})/1000.0 FROM {BaseConstants.DAY_RES_DB_DATA_TABLE_NAME} "
+            else:
+                cmd = f"SELECT {BaseConstants.TIMESTAMP}, {ctField}*24.0/1000.0 FROM {BaseConstants.DAY_RES_DB_DATA_TABLE_NAME} "
+            cmd += f"WHERE {BaseConstants.TIMESTAMP} BETWEEN ? AND ? ORDER BY {BaseConstants.TIMESTAMP};"
+            dayRows = conn.execute(cmd, (startTS, stopTS)).fetchall()
+
+            # As with the gaps in the data, the first day holding data is incomplete if the first hour row
+            # is not in the first hour of the day.
+            firstTS = conn.execute(f"SELECT MIN({BaseConstants.TIMESTAMP}) FROM {BaseConstants.HOUR_RES_DB_DATA_TABLE_NAME};").fetchone()[0]
+            gapList = []
+            if dayRows:
+                firstDay = SQLite3DBClient.GetDateTime(dayRows[0][0]).date()
+                lastDay = SQLite3DBClient.GetDateTime(dayRows[-1][0]).date()
+                gapList = SQLite3DBClient.GetGapList(conn,
+                                                     ColdArchive.GetEpochMS(firstDay),
+                                                     ColdArchive.GetEpochMS(lastDay + timedelta(days=1)))
+
+            peakDay = None
+            peakKWh = None
+            totalDayCount = 0
+            incompleteDayCount = 0
+            gapIndex = 0
+            for dayTS, dailyKWh in dayRows:
+                if dailyKWh is None:
+                    continue
+                totalDayCount += 1
+                day = SQLite3DBClient.GetDateTime(dayTS).date()
+                dayStart = ColdArchive.GetEpochMS(day)
+                dayStop = ColdArchive.GetEpochMS(day + timedelta(days=1))
+                # The gaps are in time order so skip those that ended before this day.
+                while gapIndex < len(gapList) and gapList[gapIndex][1] <= dayStart:
+                    gapIndex += 1
+                # Ignore days in which data is missing (e.g. due to data outages
+                # caused by networking issues), as these would skew the daily kWh.
+                if (gapIndex < len(gapList) and gapList[gapIndex][0] < dayStop) or \
+                   (firstTS is not None and dayStart + 3600000 <= firstTS < dayStop):
+                    incompleteDayCount += 1
+                    continue
+                if peakKWh is None or abs(dailyKWh) > abs(peakKWh):
+                    peakKWh = dailyKWh
+                    peakDay = day.isoformat()
+
+            if peakDay is None:
+                resultText = f"{ctName}: No complete days (24 hours of data) found between {startDate} and {stopDate}."
+            else:
+                resultText = f"{ctName}: Peak daily kWh = {abs(peakKWh):.2f} kWh on {peakDay}."
+                if incompleteDayCount > 0:
+                    resultText += f" ({incompleteDayCount} of {totalDayCount} day(s) ignored due to incomplete data)"
 
-        self._uio.debug(f"{fName}: Execution time {exeTime:.1f} seconds.")
+            self._uio.debug(f"{fName}: {resultText}")
+            msgDict = {GUI.PEAK_KWH_RESULT: resultText}
+            self._commsQueue.put(msgDict)
 
+        except Exception:
+            self._uio.errorException()
+            self._error("An error occurred while searching for the peak daily kWh value.")
+
+        finally:
+            if conn:
+                conn.close()
+            self._sendEnableActionButtonsMsg(True)
 
 
 class AppConfig(ConfigBase):
@@ -787,6 +1118,26 @@ class AppConfig(ConfigBase):
         return config_folder
 
     DB_STORAGE_PATH = "DB_STORAGE_PATH"
+    DB_COMMIT_ROW_COUNT = "DB_COMMIT_ROW_COUNT"
+    DB_COMMIT_INTERVAL_SECS = "DB_COMMIT_INTERVAL_SECS"
+    SQLITE_SYNCHRONOUS = "SQLITE_SYNCHRONOUS"
+    SQLITE_CACHE_SIZE = "SQLITE_CACHE_SIZE"
+    SQLITE_MMAP_SIZE = "SQLITE_MMAP_SIZE"
+    SQLITE_WAL_AUTOCHECKPOINT = "SQLITE_WAL_AUTOCHECKPOINT"
+    DB_WRITER_COUNT = "DB_WRITER_COUNT"
+    DB_QUEUE_SIZE = "DB_QUEUE_SIZE"
+    DB_QUEUE_FULL_POLICY = "DB_QUEUE_FULL_POLICY"
+    DB_MONTHLY_PARTITIONS = "DB_MONTHLY_PARTITIONS"
+    MAX_RES_RETENTION_DAYS = "MAX_RES_RETENTION_DAYS"
+    MINUTE_RES_RETENTION_DAYS = "MINUTE_RES_RETENTION_DAYS"
+    DB_COLD_ARCHIVE = "DB_COLD_ARCHIVE"
+    DB_CLUSTERED_TIMESTAMP = "DB_CLUSTERED_TIMESTAMP"
+    DB_MAINTENANCE_START_HOUR = "DB_MAINTENANCE_START_HOUR"
+    DB_MAINTENANCE_STOP_HOUR = "DB_MAINTENANCE_STOP_HOUR"
+    DB_MAINTENANCE_IO_LIMIT = "DB_MAINTENANCE_IO_LIMIT"
+    QUERY_CACHE_SIZE_MB = "QUERY_CACHE_SIZE_MB"
+
+    SQLITE_SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
 
     DEFAULT_CONFIG = {
         DB_STORAGE_PATH: GetAppConfigPath(), # By default the db's are stored in the same folder as the config files, but the user can re configure this.
@@ -794,7 +1145,25 @@ class AppConfig(ConfigBase):
         ConfigBase.LOCAL_GUI_SERVER_ADDRESS: "0.0.0.0",
         ConfigBase.LOCAL_GUI_SERVER_PORT: 10000,
         ConfigBase.SERVER_LOGIN: False,
-        ConfigBase.SERVER_ACCESS_LOG_FILE: ""
+        ConfigBase.SERVER_ACCESS_LOG_FILE: "",
+        DB_COMMIT_ROW_COUNT: 1000,     # Commit once this many CT6_SENSOR rows have been written ...
+        DB_COMMIT_INTERVAL_SECS: 5.0,  # ... or once the oldest uncommitted row is this old.
+        SQLITE_SYNCHRONOUS: "NORMAL",  # NORMAL is safe in WAL mode, a power loss may only lose the last commits.
+        SQLITE_CACHE_SIZE: -16000,     # Page cache size. A negative value is the size in KiB.
+        SQLITE_MMAP_SIZE: 268435456,   # Max number of bytes of each database file that is memory mapped.
+        SQLITE_WAL_AUTOCHECKPOINT: 1000, # The number of WAL pages written before the WAL is checkpointed.
+        DB_WRITER_COUNT: 1,            # The number of threads writing to the databases. Each CT6 unit is always written by the same thread.
+        DB_QUEUE_SIZE: 100000,         # The max number of received dev_dicts held in memory by each writer.
+        DB_QUEUE_FULL_POLICY: IngestQueue.SPILL, # What to do when the queue is full (block, coalesce or spill).
+        DB_MONTHLY_PARTITIONS: False,  # If True the CT6_SENSOR rows are stored in a separate database file for each month.
+        MAX_RES_RETENTION_DAYS: 0,     # The number of days the CT6_SENSOR rows are kept for (0 = forever).
+        MINUTE_RES_RETENTION_DAYS: 0,  # The number of days the minute table rows are kept for (0 = forever). The hour and day rows are kept forever.
+        DB_COLD_ARCHIVE: False,        # If True the CT6_SENSOR rows are archived before they are deleted (see MAX_RES_RETENTION_DAYS).
+        DB_CLUSTERED_TIMESTAMP: False, # If True new databases hold the CT6_SENSOR rows in TIMESTAMP order (TIMESTAMP is the primary key).
+        DB_MAINTENANCE_START_HOUR: 2,  # The databases are maintained (ANALYZE, optimize, checkpoint, vacuum) once a day between ...
+        DB_MAINTENANCE_STOP_HOUR: 5,   # ... these hours (local time). If they are the same the databases are not maintained.
+        DB_MAINTENANCE_IO_LIMIT: 5.0,  # The max rate (MB/second) at which the database maintenance writes data.
+        QUERY_CACHE_SIZE_MB: 100       # The max size of the database read results held by the GUI so they are not read again (0 = disabled).
     }
 
     def _enter_storage_path(self):
@@ -814,6 +1183,30 @@ class AppConfig(ConfigBase):
             else:
                 self._uio.error(f"{config_path} path not found.")
 
+    def _enter_sqlite_synchronous(self):
+        """@brief Allow the user to enter the sqlite synchronous mode."""
+        while True:
+            self.inputStr(AppConfig.SQLITE_SYNCHRONOUS, "Enter the sqlite synchronous mode ({})".format(", ".join(AppConfig.SQLITE_SYNCHRONOUS_MODES)), False)
+            mode = self.getAttr(AppConfig.SQLITE_SYNCHRONOUS).upper()
+            if mode in AppConfig.SQLITE_SYNCHRONOUS_MODES:
+                self.addAttr(AppConfig.SQLITE_SYNCHRONOUS, mode)
+                break
+
+            else:
+                self._uio.error(f"{mode} is not a valid sqlite synchronous mode.")
+
+    def _enter_queue_full_policy(self):
+        """@brief Allow the user to enter the policy applied when the queue of received dev_dicts is full."""
+        while True:
+            self.inputStr(AppConfig.DB_QUEUE_FULL_POLICY, "Enter the policy applied when the database queue is full ({})".format(", ".join(IngestQueue.POLICIES)), False)
+            policy = self.getAttr(AppConfig.DB_QUEUE_FULL_POLICY).lower()
+            if policy in IngestQueue.POLICIES:
+                self.addAttr(AppConfig.DB_QUEUE_FULL_POLICY, policy)
+                break
+
+            else:
+                self._uio.error(f"{policy} is not a valid database queue policy.")
+
     def edit(self, key):
         """@brief Provide the functionality to allow the user to enter any ct4 config parameter
                   regardless of the config type.
@@ -845,6 +1238,60 @@ class AppConfig(ConfigBase):
         elif key == AppConfig.DB_STORAGE_PATH:
             self._enter_storage_path()
 
+        elif key == AppConfig.DB_COMMIT_ROW_COUNT:
+            self.inputDecInt(AppConfig.DB_COMMIT_ROW_COUNT, "Enter the number of rows to write to the databases before they are committed", minValue=1, maxValue=100000)
+
+        elif key == AppConfig.DB_COMMIT_INTERVAL_SECS:
+            self.inputFloat(AppConfig.DB_COMMIT_INTERVAL_SECS, "Enter the maximum time (seconds) that written rows may remain uncommitted", minValue=0.0, maxValue=60.0)
+
+        elif key == AppConfig.SQLITE_SYNCHRONOUS:
+            self._enter_sqlite_synchronous()
+
+        elif key == AppConfig.SQLITE_CACHE_SIZE:
+            self.inputDecInt(AppConfig.SQLITE_CACHE_SIZE, "Enter the sqlite cache size (pages or -KiB if negative)", minValue=-4000000, maxValue=1000000)
+
+        elif key == AppConfig.SQLITE_MMAP_SIZE:
+            self.inputDecInt(AppConfig.SQLITE_MMAP_SIZE, "Enter the number of bytes of each database to memory map (0 = disabled)", minValue=0, maxValue=17179869184)
+
+        elif key == AppConfig.SQLITE_WAL_AUTOCHECKPOINT:
+            self.inputDecInt(AppConfig.SQLITE_WAL_AUTOCHECKPOINT, "Enter the number of pages written to the WAL file before it is checkpointed", minValue=0, maxValue=1000000)
+
+        elif key == AppConfig.DB_WRITER_COUNT:
+            self.inputDecInt(AppConfig.DB_WRITER_COUNT, "Enter the number of threads that write to the databases", minValue=1, maxValue=64)
+
+        elif key == AppConfig.DB_QUEUE_SIZE:
+            self.inputDecInt(AppConfig.DB_QUEUE_SIZE, "Enter the max number of received messages held in memory before they are stored in the databases", minValue=1, maxValue=10000000)
+
+        elif key == AppConfig.DB_QUEUE_FULL_POLICY:
+            self._enter_queue_full_policy()
+
+        elif key == AppConfig.DB_MONTHLY_PARTITIONS:
+            self.inputBool(AppConfig.DB_MONTHLY_PARTITIONS, "Store the max resolution data in a separate database file for each month")
+
+        elif key == AppConfig.MAX_RES_RETENTION_DAYS:
+            self.inputDecInt(AppConfig.MAX_RES_RETENTION_DAYS, "Enter the number of days to keep the max resolution data (0 = forever)", minValue=0, maxValue=100000)
+
+        elif key == AppConfig.MINUTE_RES_RETENTION_DAYS:
+            self.inputDecInt(AppConfig.MINUTE_RES_RETENTION_DAYS, "Enter the number of days to keep the minute resolution data (0 = forever)", minValue=0, maxValue=100000)
+
+        elif key == AppConfig.DB_COLD_ARCHIVE:
+            self.inputBool(AppConfig.DB_COLD_ARCHIVE, "Archive the max resolution data in compact daily files before it is deleted")
+
+        elif key == AppConfig.DB_CLUSTERED_TIMESTAMP:
+            self.inputBool(AppConfig.DB_CLUSTERED_TIMESTAMP, "Store the max resolution data of new databases in time order (TIMESTAMP primary key)")
+
+        elif key == AppConfig.DB_MAINTENANCE_START_HOUR:
+            self.inputDecInt(AppConfig.DB_MAINTENANCE_START_HOUR, "Enter the hour (0-23) at which the daily database maintenance starts", minValue=0, maxValue=23)
+
+        elif key == AppConfig.DB_MAINTENANCE_STOP_HOUR:
+            self.inputDecInt(AppConfig.DB_MAINTENANCE_STOP_HOUR, "Enter the hour (0-23) at which the daily database maintenance stops (the start hour = disabled)", minValue=0, maxValue=23)
+
+        elif key == AppConfig.DB_MAINTENANCE_IO_LIMIT:
+            self.inputFloat(AppConfig.DB_MAINTENANCE_IO_LIMIT, "Enter the max rate (MB/second) at which the database maintenance writes data", minValue=0.1, maxValue=10000)
+
+        elif key == AppConfig.QUERY_CACHE_SIZE_MB:
+            self.inputDecInt(AppConfig.QUERY_CACHE_SIZE_MB, "Enter the max size (MB) of the database read results held in memory (0 = disabled)", minValue=0, maxValue=100000)
+
         elif key == ConfigBase.DB_HOST:
             self.inputStr(ConfigBase.DB_HOST, "Enter the address of the MYSQL database server", False)
 
@@ -855,18 +1302,310 @@ class AppConfig(ConfigBase):
             self.inputStr(ConfigBase.DB_USERNAME, "Enter the database username", False)
 
 
+class IngestStats(object):
+    """@brief Responsible for recording the rate at which CT6 rows are written to the
+              databases and the time taken to commit them."""
+
+    ROWS_PER_SEC        = "ROWS_PER_SEC"
+    COMMIT_COUNT        = "COMMIT_COUNT"
+    ROWS_PER_COMMIT     = "ROWS_PER_COMMIT"
+    MEAN_COMMIT_MS      = "MEAN_COMMIT_MS"
+    MAX_COMMIT_MS       = "MAX_COMMIT_MS"
+
+    def __init__(self):
+        """@brief Constructor."""
+        self.reset()
+
+    def reset(self):
+        """@brief Reset the stats to start a new measurement period."""
+        self._start_time = time()
+        self._row_count = 0
+        self._commit_count = 0
+        self._commit_secs = 0.0
+        self._max_commit_secs = 0.0
+
+    def add_rows(self, row_count):
+        """@brief Record rows written to the databases.
+           @param row_count The number of rows written."""
+        self._row_count += row_count
+
+    def add_commit(self, elapsed_secs):
+        """@brief Record a commit of all the databases.
+           @param elapsed_secs The time taken to commit."""
+        self._commit_count += 1
+        self._commit_secs += elapsed_secs
+        if elapsed_secs > self._max_commit_secs:
+            self._max_commit_secs = elapsed_secs
+
+    def get_period(self):
+        """@return The number of seconds since the stats were reset."""
+        return time() - self._start_time
+
+    def get_stats_dict(self):
+        """@return A dict containing the stats recorded since the last reset."""
+        period = self.get_period()
+        stats_dict = {IngestStats.ROWS_PER_SEC: 0.0,
+                      IngestStats.COMMIT_COUNT: self._commit_count,
+                      IngestStats.ROWS_PER_COMMIT: 0.0,
+                      IngestStats.MEAN_COMMIT_MS: 0.0,
+                      IngestStats.MAX_COMMIT_MS: self._max_commit_secs*1000}
+        if period > 0:
+            stats_dict[IngestStats.ROWS_PER_SEC] = self._row_count/period
+        if self._commit_count > 0:
+            stats_dict[IngestStats.ROWS_PER_COMMIT] = self._row_count/self._commit_count
+            stats_dict[IngestStats.MEAN_COMMIT_MS] = (self._commit_secs/self._commit_count)*1000
+        return stats_dict
+
+    def __str__(self):
+        stats_dict = self.get_stats_dict()
+        return f"{stats_dict[IngestStats.ROWS_PER_SEC]:.1f} rows/sec, "\
+               f"{stats_dict[IngestStats.COMMIT_COUNT]} commits, "\
+               f"{stats_dict[IngestStats.ROWS_PER_COMMIT]:.1f} rows/commit, "\
+               f"commit latency mean/max = {stats_dict[IngestStats.MEAN_COMMIT_MS]:.1f}/{stats_dict[IngestStats.MAX_COMMIT_MS]:.1f} MS."
+
+
+class DeviceState(object):
+    """@brief Responsible for holding the state of the database of a single CT6 unit while
+              the ct6_app is storing the data received from it."""
+
+    __slots__ = ("db_file", "conn", "cursor", "schema_version", "rollup_accumulator", "meta_hash", "last_seen",
+                 "partition_name", "partition_conn", "partition_cursor", "partition_close_time", "clustered", "last_sensor_timestamp")
+
+    def __init__(self, db_file, conn, schema_version):
+        """@brief Constructor
+           @param db_file The database file (full path).
+           @param conn The connection to the database.
+           @param schema_version The schema version of the database."""
+        self.db_file = db_file
+        self.conn = conn
+        # All statements are executed using this cursor so sqlite only prepares each INSERT statement once.
+        self.cursor = conn.cursor()
+        self.schema_version = schema_version
+        # Used to update the min, hour and day tables.
+        # No energy is added across a gap in the rows as the power during it is unknown.
+        self.rollup_accumulator = RollupAccumulator(BaseConstants.CT_ENERGY_COLUMN_LIST, SQLite3DBClient.GAP_SECS)
+        # The hash of the meta data last written to the meta table.
+        self.meta_hash = None
+        # The time (seconds since the epoch) that the last dev_dict stored was received.
+        self.last_seen = None
+        # The monthly partition the CT6_SENSOR rows are written to, if partitions are enabled.
+        self.partition_name = None
+        self.partition_conn = None
+        self.partition_cursor = None
+        # The time (seconds since the epoch) at which to try again to close the previous partitions
+        # or None if they are closed.
+        self.partition_close_time = None
+        # True if the TIMESTAMP is the primary key of the CT6_SENSOR table.
+        self.clustered = False
+        # The TIMESTAMP of the last CT6_SENSOR row stored if clustered.
+        self.last_sensor_timestamp = None
+
+    def close_partition(self):
+        """@brief Close the connection to the monthly partition."""
+        if self.partition_conn:
+            self.partition_cursor.close()
+            self.partition_conn.close()
+        self.partition_conn = None
+        self.partition_cursor = None
+
+    def close(self):
+        """@brief Close the connection to the database."""
+        self.close_partition()
+        self.cursor.close()
+        self.conn.close()
+
+
 class SQLite3DBClient(BaseConstants):
     """@brief Responsible for interfacing with the sqlite3 database."""
 
-    DB_CONNECTION = "DB_CONNECTION"
-    META_TABLE_UPDATE_TIME = "META_TABLE_UPDATE_TIME"
-    HISTORY_RECORD_SET = "HISTORY_RECORD_SETS"
-    RUNNING_ATTR_DICT = {DB_CONNECTION: None,
-                         META_TABLE_UPDATE_TIME: None,
-                         HISTORY_RECORD_SET: []}
+    INGEST_STATS_REPORT_SECS = 60
+    # Old rows are deleted in small batches so that the ingest is not delayed.
+    PRUNE_INTERVAL_SECS = 10
+    PRUNE_BATCH_ROWS = 5000
+    INCREMENTAL_VACUUM_PAGES = 1000
+    # A time between consecutive rows from a CT6 unit longer than this is recorded in the CT6_GAP table.
+    GAP_SECS = 30
+    # A partition can't be closed while another process is reading it. If so closing it is retried after this time.
+    PARTITION_CLOSE_RETRY_SECS = 60
+    JOURNAL_FILENAME = "ct6_db_queue.journal"
+
+    # The database schema version is held in the sqlite user_version.
+    # 0 = TIMESTAMP column holds the local time as an ISO format string.
+    # 1 = TIMESTAMP column holds the time as an integer (milliseconds since the epoch).
+    # 2 = The minute, hour and day tables also hold the energy imported and exported by each CT.
+    SCHEMA_VERSION_TEXT_TIMESTAMP = 0
+    SCHEMA_VERSION_INT_TIMESTAMP = 1
+    SCHEMA_VERSION_ENERGY = 2
+    SCHEMA_VERSION = SCHEMA_VERSION_ENERGY
+
+
+    @staticmethod
+    def GetSchemaVersion(conn):
+        """@brief Get the schema version of a database.
+           @param conn The connection to the database.
+           @return The schema version."""
+        return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+    @staticmethod
+    def GetDBTimestamp(timestamp, schema_version):
+        """@brief Get the value stored in the TIMESTAMP column of a database.
+           @param timestamp A datetime instance holding the local time.
+           @param schema_version The schema version of the database.
+           @return The value to store in the database."""
+        if schema_version >= SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+            return int(mktime(timestamp.timetuple()))*1000 + (timestamp.microsecond+500)//1000
+        # Always store the us so that all timestamps have the same format.
+        return timestamp.isoformat(sep=' ', timespec='microseconds')
+
+    @staticmethod
+    def GetDateTime(db_timestamp):
+        """@brief Get a datetime instance from a value read from the TIMESTAMP column of a database.
+           @param db_timestamp Either an ISO format string or the milliseconds since the epoch.
+           @return A datetime instance holding the local time."""
+        if isinstance(db_timestamp, str):
+            return datetime.fromisoformat(db_timestamp)
+        return datetime.fromtimestamp(db_timestamp/1000)
+
+    @staticmethod
+    def GetBucketStart(db_timestamp, index):
+        """@brief Get the start of the minute, hour or day containing a time.
+           @param db_timestamp The time in milliseconds since the epoch.
+           @param index RollupAccumulator.MINUTE_INDEX, HOUR_INDEX or DAY_INDEX.
+           @return The start of the minute, hour or day in milliseconds since the epoch."""
+        _datetime = datetime.fromtimestamp(db_timestamp/1000).replace(second=0, microsecond=0)
+        if index >= RollupAccumulator.HOUR_INDEX:
+            _datetime = _datetime.replace(minute=0)
+        if index >= RollupAccumulator.DAY_INDEX:
+            _datetime = _datetime.replace(hour=0)
+        return SQLite3DBClient.GetDBTimestamp(_datetime, SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP)
+
+    @staticmethod
+    def GetNextBucketStart(db_timestamp, index):
+        """@brief Get the start of the minute, hour or day after the one containing a time.
+           @param db_timestamp The time in milliseconds since the epoch.
+           @param index RollupAccumulator.MINUTE_INDEX, HOUR_INDEX or DAY_INDEX.
+           @return The start of the next minute, hour or day in milliseconds since the epoch."""
+        bucket_start = datetime.fromtimestamp(SQLite3DBClient.GetBucketStart(db_timestamp, index)/1000)
+        if index == RollupAccumulator.MINUTE_INDEX:
+            bucket_start += timedelta(minutes=1)
+        elif index == RollupAccumulator.HOUR_INDEX:
+            bucket_start += timedelta(hours=1)
+        else:
+            bucket_start = datetime.combine(bucket_start.date() + timedelta(days=1), bucket_start.time())
+        return SQLite3DBClient.GetDBTimestamp(bucket_start, SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP)
+
+    @staticmethod
+    def GetEnergySums(conn, start, stop, index=RollupAccumulator.DAY_INDEX):
+        """@brief Get the energy imported and exported by each CT over a period of time. The energy
+                  of the whole days in the period is read from the day table, the energy of the
+                  whole hours either side of these from the hour table and the energy of the remaining
+                  minutes from the minute table. The database must have schema version SCHEMA_VERSION_ENERGY.
+           @param conn The connection to the database.
+           @param start The start of the period (milliseconds since the epoch).
+           @param stop The end of the period (milliseconds since the epoch, not included).
+           @param index The coarsest table (RollupAccumulator.MINUTE_INDEX, HOUR_INDEX or DAY_INDEX) to read.
+           @return A list of the import Wh followed by the export Wh (negative) of each CT."""
+        energy_sums = [0.0]*(len(SQLite3DBClient.CT_ENERGY_COLUMN_LIST)*2)
+        if start >= stop:
+            return energy_sums
+
+        if index == RollupAccumulator.MINUTE_INDEX:
+            inner_start = start
+            inner_stop = stop
+        else:
+            inner_start = SQLite3DBClient.GetBucketStart(start, index)
+            if inner_start < start:
+                inner_start = SQLite3DBClient.GetNextBucketStart(start, index)
+            inner_stop = SQLite3DBClient.GetBucketStart(stop, index)
+            # If the period does not include a whole hour or day
+            if inner_start >= inner_stop:
+                return SQLite3DBClient.GetEnergySums(conn, start, stop, index-1)
+
+        energy_columns = []
+        for _, import_col, export_col in SQLite3DBClient.CT_ENERGY_COLUMN_LIST:
+            energy_columns.append(f"TOTAL({import_col})")
+            energy_columns.append(f"TOTAL({export_col})")
+        table_name = SQLite3DBClient.LOW_RES_DATA_TABLE_LIST[index]
+        cmd = f"SELECT {', '.join(energy_columns)}, MAX({SQLite3DBClient.TIMESTAMP}) FROM {table_name} "\
+              f"WHERE {SQLite3DBClient.TIMESTAMP} >= ? AND {SQLite3DBClient.TIMESTAMP} < ?;"
+        row = conn.execute(cmd, (inner_start, inner_stop)).fetchone()
+        energy_sums = list(row[:-1])
+        if index > RollupAccumulator.MINUTE_INDEX:
+            # The last hour or day has no row until it has closed so the finer table is read after the last row.
+            last_timestamp = row[-1]
+            covered_stop = inner_start
+            if last_timestamp is not None:
+                covered_stop = SQLite3DBClient.GetNextBucketStart(last_timestamp, index)
+            for start, stop in ((start, inner_start), (covered_stop, stop)):
+                edge_energy_sums = SQLite3DBClient.GetEnergySums(conn, start, stop, index-1)
+                energy_sums = [total + edge for total, edge in zip(energy_sums, edge_energy_sums)]
+        return energy_sums
+
+    @staticmethod
+    def IsClustered(conn):
+        """@brief Determine if the CT6_SENSOR table is clustered on the TIMESTAMP. In this case the TIMESTAMP
+                  is the primary key (the rowid) so the rows are held in TIMESTAMP order and no separate
+                  TIMESTAMP index is required.
+           @param conn The connection to the database.
+           @return True if the TIMESTAMP is the primary key of the CT6_SENSOR table."""
+        for column_info in conn.execute(f"PRAGMA table_info({SQLite3DBClient.CT6_TABLE_NAME});"):
+            # The name and pk columns.
+            if column_info[1] == SQLite3DBClient.TIMESTAMP and column_info[5]:
+                return True
+        return False
+
+    @staticmethod
+    def GetTableList(conn):
+        """@param conn The connection to the database.
+           @return A list of the names of the tables in the database."""
+        return [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table';")]
+
+    @staticmethod
+    def GetGapList(conn, start, stop):
+        """@brief Get the gaps in the data received from a CT6 unit in a period of time.
+           @param conn The connection to the database.
+           @param start The start of the period (milliseconds since the epoch).
+           @param stop The end of the period (milliseconds since the epoch, not included).
+           @return A list of (gap start, gap stop) tuples (milliseconds since the epoch) in time order.
+                   The list is empty if the database does not hold the CT6_GAP table."""
+        if SQLite3DBClient.GAP_TABLE_NAME not in SQLite3DBClient.GetTableList(conn):
+            return []
+        cmd = f"SELECT GAP_START, GAP_STOP FROM {SQLite3DBClient.GAP_TABLE_NAME} WHERE GAP_START < ? AND GAP_STOP > ? ORDER BY GAP_START;"
+        return conn.execute(cmd, (stop, start)).fetchall()
+
+    @staticmethod
+    def GetClusteredTableSchema(tableSchema):
+        """@param tableSchema The CT6_SENSOR table schema dict.
+           @return The table schema dict with the TIMESTAMP as the primary key."""
+        clusteredTableSchema = dict(tableSchema)
+        clusteredTableSchema[SQLite3DBClient.TIMESTAMP] = "INTEGER PRIMARY KEY"
+        return clusteredTableSchema
+
+    @staticmethod
+    def SetPragmas(conn, app_config, writer):
+        """@brief Set the PRAGMA profile defined in the app config on a database connection.
+           @param conn The connection to the database.
+           @param app_config The AppConfig instance.
+           @param writer If True this connection is used to write to the database. The database is
+                  put into WAL mode so that readers and the writer don't block each other."""
+        if writer:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute(f"PRAGMA synchronous={app_config.getAttr(AppConfig.SQLITE_SYNCHRONOUS)};")
+            conn.execute(f"PRAGMA wal_autocheckpoint={int(app_config.getAttr(AppConfig.SQLITE_WAL_AUTOCHECKPOINT))};")
+        conn.execute(f"PRAGMA cache_size={int(app_config.getAttr(AppConfig.SQLITE_CACHE_SIZE))};")
+        conn.execute(f"PRAGMA mmap_size={int(app_config.getAttr(AppConfig.SQLITE_MMAP_SIZE))};")
+
     @staticmethod
-    def GetQuotedValue(value):
-        return '\"{}"'.format(str(value))
+    def ConnectReadOnly(db_file, app_config):
+        """@brief Connect to a database for reading only. In WAL mode a read only connection
+                  never blocks, or is blocked by, the connection used to write to the database.
+           @param db_file The database file.
+           @param app_config The AppConfig instance.
+           @return The connection to the database."""
+        uri = pathlib.Path(db_file).absolute().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True)
+        SQLite3DBClient.SetPragmas(conn, app_config, False)
+        return conn
 
     @staticmethod
     def GetConfigPathFile(filename):
@@ -912,26 +1651,160 @@ class SQLite3DBClient(BaseConstants):
                 db_file_list.append(abs_path)
         return db_file_list
 
-    def __init__(self, uio, options, app_config, start_db_update=True):
+    @staticmethod
+    def GetDBAssy(db_file):
+        """@param db_file The database file (full path).
+           @return The assembly label of the CT6 unit the database holds data from."""
+        return pathlib.Path(db_file).stem
+
+    @staticmethod
+    def GetWriterIndex(assy, writer_count):
+        """@brief Get the writer that stores the data from a CT6 unit. This does not change
+                  between runs so a CT6 unit is always written by the same writer.
+           @param assy The assembly label of the CT6 unit.
+           @param writer_count The number of writers.
+           @return The index of the writer."""
+        return zlib.crc32(assy.strip().encode()) % writer_count
+
+    def __init__(self, uio, options, app_config, start_db_update=True, instrumentation=None, writer_index=None, live_feed=None):
         """@brief Constructor
            @param uio A UIO instance.
            @param options The command line options instance.
-           @param config A ConfigBase instance."""
+           @param config A ConfigBase instance.
+           @param start_db_update If True start the thread/s that update the databases.
+           @param instrumentation The Instrumentation instance to use. If None one is created.
+           @param writer_index If None then AppConfig.DB_WRITER_COUNT writers are created if more
+                  than one writer is configured. Each writer is an SQLite3DBClient instance with it's
+                  own thread, connections and derived table state and this instance passes the
+                  dev_dicts received to them. Otherwise this is the index of the writer.
+           @param live_feed The LiveFeed instance that the rows committed are published to. If None one is created."""
         self._uio = uio
         self._options = options
         self._config = app_config
-        self._running_attr_dicts = {} # This dict contains RUNNING_ATTR_DICT's
+        self._device_dict = {} # Holds a DeviceState instance for each connected database, keyed by the CT6 assy.
         self._conn = None
-        self._last__record_device_time = None
+        self._writer_index = writer_index
+        if instrumentation is None:
+            # Spans, counters and CPU/memory usage are reported periodically when debugging.
+            instrumentation = Instrumentation.Create(uio, options.debug)
+            instrumentation.start()
+        self._instrumentation = instrumentation
+        if live_feed is None:
+            live_feed = LiveFeed()
+        self._live_feed = live_feed
+        self._writers = []
+        writer_count = self._config.getAttr(AppConfig.DB_WRITER_COUNT)
+        if writer_index is None:
+            self._move_journals(writer_count)
+        if writer_index is None and writer_count > 1:
+            for index in range(writer_count):
+                self._writers.append(SQLite3DBClient(uio,
+                                                     options,
+                                                     app_config,
+                                                     start_db_update=start_db_update,
+                                                     instrumentation=instrumentation,
+                                                     writer_index=index,
+                                                     live_feed=live_feed))
+            # The writers update the databases.
+            start_db_update = False
         self._dbLock = threading.Lock()
-        self._tableSchema = SQLite3DBClient.GetTableSchema(SQLite3DBClient.CT6_DB_TABLE_SCHEMA_SQLITE)
-        self._dev_dict_queue = Queue()
+        # New databases are created with the current schema version.
+        self._tableSchema = SQLite3DBClient.GetTableSchema(SQLite3DBClient.CT6_DB_TABLE_SCHEMA_SQLITE_V1)
+        # All the data tables share the same schema so rows are always inserted using this column order.
+        self._column_list = list(self._tableSchema.keys())
+        # The minute, hour and day tables also hold the energy columns.
+        self._rollupTableSchema = SQLite3DBClient.GetTableSchema(SQLite3DBClient.CT6_DB_ROLLUP_TABLE_SCHEMA_SQLITE_V2)
+        self._rollup_column_list = list(self._rollupTableSchema.keys())
+        self._insert_sql_dict = {} # Holds the INSERT statement for each table, keyed by table name and column count.
+        self._monthly_partitions = self._config.getAttr(AppConfig.DB_MONTHLY_PARTITIONS)
+        self._max_res_retention_days = self._config.getAttr(AppConfig.MAX_RES_RETENTION_DAYS)
+        self._minute_res_retention_days = self._config.getAttr(AppConfig.MINUTE_RES_RETENTION_DAYS)
+        self._cold_archive = self._config.getAttr(AppConfig.DB_COLD_ARCHIVE)
+        self._clustered_timestamp = self._config.getAttr(AppConfig.DB_CLUSTERED_TIMESTAMP)
+        self._clusteredTableSchema = SQLite3DBClient.GetClusteredTableSchema(self._tableSchema)
+        self._last_prune_time = time()
+        self._db_maintenance = DBMaintenance(self._uio,
+                                             self._config.getAttr(AppConfig.DB_MAINTENANCE_START_HOUR),
+                                             self._config.getAttr(AppConfig.DB_MAINTENANCE_STOP_HOUR),
+                                             self._config.getAttr(AppConfig.DB_MAINTENANCE_IO_LIMIT))
+        # The number of dev_dicts held in memory is limited in case the databases stall. Each writer
+        # has it's own journal file to hold the dev_dicts spilled when it's queue is full.
+        if writer_index is None:
+            journal_filename = SQLite3DBClient.JOURNAL_FILENAME
+        else:
+            journal_filename = f"{SQLite3DBClient.JOURNAL_FILENAME}.{writer_index}"
+        self._dev_dict_queue = IngestQueue(self._config.getAttr(AppConfig.DB_QUEUE_SIZE),
+                                           self._config.getAttr(AppConfig.DB_QUEUE_FULL_POLICY),
+                                           os.path.join(self._config.getAttr(AppConfig.DB_STORAGE_PATH), journal_filename),
+                                           SQLite3DBClient.ASSY,
+                                           uio=self._uio)
+        spill_bytes = self._dev_dict_queue.get_metrics()[IngestQueue.SPILL_BYTES]
+        if spill_bytes > 0:
+            self.info(f"Replaying {spill_bytes} bytes of received data from the database queue journal.")
+        # Rows are written to the databases as they are received but only committed once
+        # enough rows are present or the oldest uncommitted row is old enough.
+        self._commit_row_count = self._config.getAttr(AppConfig.DB_COMMIT_ROW_COUNT)
+        self._commit_interval_secs = self._config.getAttr(AppConfig.DB_COMMIT_INTERVAL_SECS)
+        self._uncommitted_row_count = 0
+        self._first_uncommitted_time = None
+        # The databases that rows have been written to since the last commit.
+        self._uncommitted_db_files = set()
+        # The ingest watermark of each database, keyed by database file (see get_ingest_watermark()).
+        self._ingest_watermark_dict = {}
+        # The (database file, table name, row list) tuples written since the last commit. These are
+        # published to the live feed once committed.
+        self._uncommitted_live_rows = []
+        self._ingest_stats = IngestStats()
+        self._read_thread_running = False
+        self._read_thread = None
         # Start the thread that reads from the queue containing the dev_dicts received from  CT6 units.
         if start_db_update:
-            # Thread to read data from the above queue
-            pthread = threading.Thread(target=self._process_dev_dict_queue)
-            pthread.daemon = True
-            pthread.start()
+            self.start_db_update()
+
+    def _move_journals(self, writer_count):
+        """@brief Move the dev_dicts left in the journals of a previous run with a different number of
+                  database writers to the journals of the writers that now store the data from each CT6 unit.
+                  Otherwise they would never be replayed.
+           @param writer_count The number of database writers."""
+        db_storage_folder = self._config.getAttr(AppConfig.DB_STORAGE_PATH)
+        if writer_count > 1:
+            journal_filename_list = [f"{SQLite3DBClient.JOURNAL_FILENAME}.{index}" for index in range(writer_count)]
+        else:
+            journal_filename_list = [SQLite3DBClient.JOURNAL_FILENAME]
+
+        def get_journal_file(dev_dict):
+            index = 0
+            if writer_count > 1 and SQLite3DBClient.ASSY in dev_dict:
+                index = SQLite3DBClient.GetWriterIndex(dev_dict[SQLite3DBClient.ASSY], writer_count)
+            return os.path.join(db_storage_folder, journal_filename_list[index])
+
+        if os.path.isdir(db_storage_folder):
+            for entry in sorted(os.listdir(db_storage_folder)):
+                writer_suffix = entry[len(SQLite3DBClient.JOURNAL_FILENAME)+1:]
+                if entry not in journal_filename_list and \
+                   (entry == SQLite3DBClient.JOURNAL_FILENAME or (entry.startswith(SQLite3DBClient.JOURNAL_FILENAME + ".") and writer_suffix.isdigit())):
+                    move_count = IngestQueue.MoveJournal(os.path.join(db_storage_folder, entry), get_journal_file, uio=self._uio)
+                    self.info(f"Moved {move_count} dev_dicts from the {entry} database queue journal of a previous run to the journals of {writer_count} database writer/s.")
+
+    def start_db_update(self):
+        """@brief Start the thread that reads the dev_dicts received from CT6 units and updates the databases."""
+        if self._writers:
+            for writer in self._writers:
+                writer.start_db_update()
+            return
+
+        # Thread to read data from the above queue
+        self._read_thread_running = True
+        self._read_thread = threading.Thread(target=self._process_dev_dict_queue)
+        self._read_thread.daemon = True
+        self._read_thread.start()
+
+    def stop_db_update(self):
+        """@brief Stop the thread that updates the databases. It stops once it has stored the dev_dicts it
+                  has read from the queue. disconnect() waits for it to stop."""
+        for writer in self._writers:
+            writer.stop_db_update()
+        self._read_thread_running = False
 
     def warn(self, msg):
         """@brief Show the user a warning level message.
@@ -958,8 +1831,7 @@ class SQLite3DBClient(BaseConstants):
             db_file_list = SQLite3DBClient.GetDBFileList(db_storage_folder)
             for db_file in db_file_list:
                 self._connect(db_file)
-                conn = self._running_attr_dicts[db_file][SQLite3DBClient.DB_CONNECTION]
-                cursor = conn.cursor()
+                cursor = self._device_dict[SQLite3DBClient.GetDBAssy(db_file)].cursor
                 # Execute query to get table names
                 cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
                 tables = cursor.fetchall()
@@ -972,20 +1844,6 @@ class SQLite3DBClient(BaseConstants):
         finally:
             self.disconnect()
 
-    def _report_memory_usage(self):
-        """@brief Report the memory usage while running. Useful when debugging."""
-        _, _, load15 = psutil.getloadavg()
-        loadAvg = (load15/os.cpu_count()) * 100
-        usedMB = psutil.virtual_memory()[3]/1000000
-        freeMB = psutil.virtual_memory()[4]/1000000
-        self.debug(f"CPU Load AVG: {loadAvg:.1f}, Used Mem (MB): {usedMB:.1f} Free Mem (MB): {freeMB:.1f}")
-
-        objList = objgraph.most_common_types()
-        for elemList in objList:
-            _type = elemList[0]
-            _count = elemList[1]
-            self.debug(f"Found {_count: <8.0f} object of type {_type}")
-
     def _showdev_dict(self, dev_dict):
         """@brief Show the JSON data to the user.
            @return True if the device was shown."""
@@ -1020,52 +1878,132 @@ class SQLite3DBClient(BaseConstants):
         """@brief Called when data is received from the device.
            @param dev_dict The CT6 device dict."""
 
-        # We add to a queue and process the response in another thread
-        # so as not to block the receipt of JSON messages from CT6 devices
-        self._dev_dict_queue.put(dev_dict)
+        if self._writers:
+            if SQLite3DBClient.ASSY in dev_dict:
+                writer_index = SQLite3DBClient.GetWriterIndex(dev_dict[SQLite3DBClient.ASSY], len(self._writers))
+                self._writers[writer_index].hear(dev_dict)
+            else:
+                # The database is selected using the ASSY so the dev_dict can't be stored. It is not
+                # added to this queue as only the writers read their queues.
+                self.debug(f"Discarded a dev_dict without an {SQLite3DBClient.ASSY} field.")
 
-    def update_db_from_dev_dict_queue(self):
+        else:
+            # We add to a queue and process the response in another thread
+            # so as not to block the receipt of JSON messages from CT6 devices
+            self._dev_dict_queue.put(dev_dict)
+
+    def get_queue_size(self):
+        """@return The number of dev_dicts waiting to be stored in the databases."""
+        queue_size = self._dev_dict_queue.qsize()
+        for writer in self._writers:
+            queue_size += writer.get_queue_size()
+        return queue_size
+
+    def get_ingest_watermark(self, db_file):
+        """@brief Get the ingest watermark of a database. This changes each time rows are committed to the database.
+           @param db_file The database file.
+           @return A tuple holding the number of commits that have written rows to the database and the
+                   TIMESTAMP of the last CT6_SENSOR row committed (None for schema version 0 databases)
+                   or None if no rows have been written to the database since the ct6_app started."""
+        for writer in self._writers:
+            watermark = writer.get_ingest_watermark(db_file)
+            if watermark is not None:
+                return watermark
+        return self._ingest_watermark_dict.get(db_file)
+
+    def get_live_feed(self):
+        """@return The LiveFeed instance that the rows are published to as they are committed."""
+        return self._live_feed
+
+    def update_db_from_dev_dict_queue(self, force_commit=True):
         """@brief Read all dev dicts from the queue and update db.
+           @param force_commit If True then all the rows written are committed before returning.
+                  If False the rows are only committed once the configured row count or
+                  time limit is reached.
            @return The number of dev_dicts received."""
-        msg_count = 0
+        # Process all available dev_dict's in the queue
+        dev_dict_list = []
         try:
-            # Process all available dev_dict's in the queue
-            while True:
-                dev_dict = self._dev_dict_queue.get_nowait()
-                if dev_dict:
-                    self._handle_dev_dict(dev_dict)
-                    msg_count += 1
-
-        except Empty:
-            pass
+            dev_dict_list = [dev_dict for dev_dict in self._dev_dict_queue.get_all() if dev_dict]
 
         except Exception:
+            # Don't stop the thread that stores the data if the journal could not be read.
             self._uio.errorException()
+        msg_count = len(dev_dict_list)
+
+        self._instrumentation.count("dev_dicts_received", msg_count)
+
+        # Group the dev_dicts by the CT6 unit they were received from so that each database
+        # is updated with a single batch of rows.
+        assy_dev_dicts = {}
+        for dev_dict in dev_dict_list:
+            if self._is_recordable(dev_dict):
+                assy = dev_dict[SQLite3DBClient.ASSY].strip()
+                if assy not in assy_dev_dicts:
+                    assy_dev_dicts[assy] = []
+                assy_dev_dicts[assy].append(dev_dict)
+
+        # We lock around each database store action as this may not always
+        # be called from the same thread.
+        with self._dbLock:
+            for assy in assy_dev_dicts:
+                try:
+                    with self._instrumentation.span("db_record"):
+                        self._record(assy, assy_dev_dicts[assy])
+
+                except Exception:
+                    self._uio.errorException()
+
+            try:
+                self._commit(force_commit)
+                if self._uncommitted_row_count == 0:
+                    # The dev_dicts replayed from the journal have been committed (or could not be stored).
+                    self._dev_dict_queue.commit_replay()
+                self._retry_close_partitions()
+                self._prune()
+                self._maintain()
+
+            except Exception:
+                self._uio.errorException()
+
+        if not self._writers and self._ingest_stats.get_period() >= SQLite3DBClient.INGEST_STATS_REPORT_SECS:
+            queue_metrics = self._dev_dict_queue.get_metrics()
+            queue_msg = f"queue depth = {queue_metrics[IngestQueue.DEPTH]}, "\
+                        f"coalesced = {queue_metrics[IngestQueue.COALESCED_COUNT]}, "\
+                        f"spilled = {queue_metrics[IngestQueue.SPILL_COUNT]}, "\
+                        f"spill size = {queue_metrics[IngestQueue.SPILL_BYTES]} bytes, "\
+                        f"replayed = {queue_metrics[IngestQueue.REPLAY_PER_SEC]:.1f}/sec."
+            if self._writer_index is None:
+                self.debug(f"DB ingest: {self._ingest_stats} {queue_msg}")
+            else:
+                self.debug(f"DB ingest (writer {self._writer_index}): {self._ingest_stats} {queue_msg}")
+            self._ingest_stats.reset()
+
+        for writer in self._writers:
+            msg_count += writer.update_db_from_dev_dict_queue(force_commit=force_commit)
 
         return msg_count
 
     def _process_dev_dict_queue(self):
         """@brief Called periodically to read dev_dict's received from CT6 devices from
                   the _dev_dict_queue."""
-        self._read_thread_running = True
         while self._read_thread_running:
 
-            self.update_db_from_dev_dict_queue()
+            self.update_db_from_dev_dict_queue(force_commit=False)
 
             sleep(0.25)
 
-    def _handle_dev_dict(self, dev_dict):
-        """@brief Called when data is received from the device.
-           @param dev_dict The CT6 device dict."""
-        self._record_device_timestamp(dev_dict, 1)
-        self._report_memory_usage()
-        process_dev_dict = True
+    def _is_recordable(self, dev_dict):
+        """@brief Determine if the data in a dev_dict should be stored in a database.
+           @param dev_dict The CT6 device dict.
+           @return True if the dev_dict should be recorded."""
+        recordable = False
         if SQLite3DBClient.IP_ADDRESS in dev_dict:
+            process_dev_dict = True
             if self._options.show:
                 process_dev_dict = self._showdev_dict(dev_dict)
 
             if process_dev_dict:
-                self._record_device_timestamp(dev_dict, 2)
                 if SQLite3DBClient.ACTIVE in dev_dict:
                     active = dev_dict[SQLite3DBClient.ACTIVE]
                     # We don't record data from units that are not active
@@ -1075,111 +2013,346 @@ class SQLite3DBClient(BaseConstants):
                             unit_name = unit_name.strip()
                             # We don't record data from units that don't have a name.
                             if len(unit_name) > 0:
-                                # We lock around each database store action as hear() may not always
-                                # be called from the same thread.
-                                with self._dbLock:
-                                    self._record_device_timestamp(dev_dict, 3)
-                                    self._record(dev_dict)
-                                    self._record_device_timestamp(dev_dict, 4)
+                                recordable = True
+        return recordable
+
+    def _get_db_file(self, dev_dict):
+        """@brief Get the database file that data from a CT6 device is stored in.
+           @param dev_dict The CT6 device dict.
+           @return The database file (full path)."""
+        assy_label = dev_dict[SQLite3DBClient.ASSY]
+        assy_label = assy_label.strip()
+        db_storage_folder = self._config.getAttr(AppConfig.DB_STORAGE_PATH)
+        return os.path.join(db_storage_folder, assy_label + '.db')
+
+    def _commit(self, force):
+        """@brief Commit the rows written to all the databases if the configured row count
+                  or time limit has been reached.
+           @param force If True commit regardless of the row count and time limits."""
+        if self._uncommitted_row_count > 0:
+            uncommitted_secs = time() - self._first_uncommitted_time
+            if force or \
+               self._uncommitted_row_count >= self._commit_row_count or \
+               uncommitted_secs >= self._commit_interval_secs:
+                start_time = perf_counter()
+                for device in self._device_dict.values():
+                    device.conn.commit()
+                    if device.partition_conn:
+                        device.partition_conn.commit()
+                    if device.db_file in self._uncommitted_db_files:
+                        commit_count = self._ingest_watermark_dict.get(device.db_file, (0, None))[0]
+                        self._ingest_watermark_dict[device.db_file] = (commit_count+1, device.last_sensor_timestamp)
+                self._uncommitted_db_files.clear()
+                for db_file, table_name, row_list in self._uncommitted_live_rows:
+                    self._live_feed.publish(db_file, table_name, row_list)
+                self._uncommitted_live_rows = []
+                elapsed_secs = perf_counter() - start_time
+                self._ingest_stats.add_commit(elapsed_secs)
+                self._instrumentation.observe("db_commit", elapsed_secs)
+                self._uncommitted_row_count = 0
+                self._first_uncommitted_time = None
 
     def _connect(self, db_file):
-        """@brief Connect to an sqlite3 database.
+        """@brief Connect to an sqlite3 database and add it's DeviceState to the device registry.
            @param db_file The file containing the database.
            return True If the database has juct been created."""
         self.info(f"Connecting to {db_file}")
         db_created = False
         if not os.path.isfile(db_file):
             db_created = True
-        # This will create the database if it is not present
-        conn = sqlite3.connect(db_file)
+        # This will create the database if it is not present.
+        # Access to the connection is serialised by self._dbLock so it may be
+        # used from the thread that calls disconnect().
+        conn = sqlite3.connect(db_file, check_same_thread=False)
+        if db_created:
+            # This must be set before the tables are created. It allows the space freed when old rows are
+            # deleted to be returned to the file system, see _prune().
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        SQLite3DBClient.SetPragmas(conn, self._config, True)
         self.info("Connected.")
-        # Create a RUNNING_ATTR_DICT for this db and add the database connection
-        # to the dict of connections.
-        self._running_attr_dicts[db_file] = copy.deepcopy(SQLite3DBClient.RUNNING_ATTR_DICT)
-        self._running_attr_dicts[db_file][SQLite3DBClient.DB_CONNECTION] = conn
+        schema_version = SQLite3DBClient.SCHEMA_VERSION
+        if not db_created:
+            # Existing databases are written using the schema they were created with
+            # until they are migrated (ct6_app --migrate_schema).
+            schema_version = SQLite3DBClient.GetSchemaVersion(conn)
+            if schema_version < SQLite3DBClient.SCHEMA_VERSION:
+                self.warn(f"{db_file}: Schema version {schema_version} is out of date. Run 'ct6_app --migrate_schema' to update it.")
+        device = DeviceState(db_file, conn, schema_version)
+        self._device_dict[SQLite3DBClient.GetDBAssy(db_file)] = device
+        self.create_table(device.cursor, SQLite3DBClient.ROLLUP_STATE_TABLE_NAME, SQLite3DBClient.CT6_DB_ROLLUP_STATE_TABLE_SCHEMA_SQLITE)
+        if schema_version >= SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+            if not db_created and SQLite3DBClient.GAP_TABLE_NAME not in SQLite3DBClient.GetTableList(conn):
+                self.info(f"{db_file}: Gaps in the data are recorded from now on. Run 'ct6_app --rebuild_derived' to record the gaps in the data already stored.")
+            self.create_table(device.cursor, SQLite3DBClient.GAP_TABLE_NAME, SQLite3DBClient.CT6_DB_GAP_TABLE_SCHEMA_SQLITE)
+        if db_created:
+            device.clustered = self._clustered_timestamp
+        else:
+            device.clustered = SQLite3DBClient.IsClustered(conn)
+            if schema_version >= SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+                device.last_sensor_timestamp = self._get_last_sensor_timestamp(device)
+            self._load_rollup_state(device)
         return db_created
 
-# PJA this must be called from the db thread !!!
-    def disconnect(self):
-        """@brief Disconnect from all the databases."""
-        db_files = list(self._running_attr_dicts.keys())
-        for db_file in db_files:
-            conn = self._running_attr_dicts[db_file][SQLite3DBClient.DB_CONNECTION]
-            if conn:
-                conn.close()
-            del self._running_attr_dicts[db_file]
+    def _get_last_sensor_timestamp(self, device):
+        """@param device The DeviceState of the database.
+           @return The TIMESTAMP of the last CT6_SENSOR row stored or None if no rows are stored."""
+        partition_router = PartitionRouter(device.db_file)
+        row_list = partition_router.fetch_all(device.conn,
+                                              SQLite3DBClient.CT6_TABLE_NAME,
+                                              f"MAX({SQLite3DBClient.TIMESTAMP})",
+                                              "1",
+                                              {},
+                                              None,
+                                              None,
+                                              immutable=False)
+        timestamp_list = [row[0] for row in row_list if row[0] is not None]
+        if timestamp_list:
+            return max(timestamp_list)
+        return None
+
+    def _load_rollup_state(self, device):
+        """@brief Restore the state of the minute, hour and day rollups saved when the ct6_app last
+                  stored data in the database so that the rollups resume where they left off.
+           @param device The DeviceState of the database."""
+        cursor = device.cursor
+        cursor.execute(f"SELECT STATE FROM {SQLite3DBClient.ROLLUP_STATE_TABLE_NAME} WHERE ID=1;")
+        row = cursor.fetchone()
+        if row:
+            rollup_accumulator = device.rollup_accumulator
+            rollup_accumulator.set_state(json.loads(row[0]))
+            # The state is saved when a minute closes. Add the rows stored after this
+            # (at most a few minutes of data) to complete the restored state.
+            last_timestamp = SQLite3DBClient.GetDBTimestamp(rollup_accumulator.last_timestamp, device.schema_version)
+            if device.schema_version >= SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+                # The rows may be in the monthly partitions.
+                partition_router = PartitionRouter(device.db_file)
+                row_list = partition_router.fetch_all(device.conn,
+                                                      SQLite3DBClient.CT6_TABLE_NAME,
+                                                      ', '.join(self._column_list),
+                                                      f"{SQLite3DBClient.TIMESTAMP} > :last_timestamp",
+                                                      {"last_timestamp": last_timestamp},
+                                                      last_timestamp,
+                                                      None,
+                                                      immutable=False)
+            else:
+                cmd = f"SELECT {', '.join(self._column_list)} FROM {SQLite3DBClient.CT6_TABLE_NAME} "\
+                      f"WHERE {SQLite3DBClient.TIMESTAMP} > ? ORDER BY {SQLite3DBClient.TIMESTAMP};"
+                cursor.execute(cmd, (last_timestamp,))
+                row_list = cursor.fetchall()
+            row_count = 0
+            for row in row_list:
+                record = dict(zip(self._column_list, row))
+                record[SQLite3DBClient.TIMESTAMP] = SQLite3DBClient.GetDateTime(record[SQLite3DBClient.TIMESTAMP])
+                # No minute closes here as the state would have been saved when it did.
+                rollup_accumulator.add(record)
+                row_count += 1
+            self.info(f"{device.db_file}: Resumed the minute, hour and day rollups from {rollup_accumulator.last_timestamp} ({row_count} rows added).")
+
+    def _save_rollup_state(self, device):
+        """@brief Save the state of the minute, hour and day rollups. This is written in the same
+                  transaction as the rows so the saved state is always consistent with the rows stored.
+           @param device The DeviceState of the database."""
+        cmd = f"REPLACE INTO {SQLite3DBClient.ROLLUP_STATE_TABLE_NAME} (ID, STATE) VALUES (1, ?);"
+        device.cursor.execute(cmd, (json.dumps(device.rollup_accumulator.get_state()),))
+
+    def _prune(self):
+        """@brief Delete the rows that are older than the configured retention periods. This is called
+                  periodically from the thread that updates the databases. At most PRUNE_BATCH_ROWS rows are
+                  deleted from each table on each call so the databases shrink gradually after the retention
+                  is reduced. The hour and day rows are never deleted. If monthly partitions are used
+                  the max resolution rows are deleted a month at a time by deleting closed partitions."""
+        if self._max_res_retention_days <= 0 and self._minute_res_retention_days <= 0:
+            return
 
-    def _get_db_conn(self, db_file, dev_dict):
-        """@brief Get the connection to the database.
-           @param db_file The database file (full path).
+        now = time()
+        if now - self._last_prune_time < SQLite3DBClient.PRUNE_INTERVAL_SECS:
+            return
+        self._last_prune_time = now
+
+        for device in self._device_dict.values():
+            if device.schema_version < SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+                continue
+
+            max_res_row_count = 0
+            minute_res_row_count = 0
+            if self._max_res_retention_days > 0:
+                # Rows are only deleted once they have been added to a closed day.
+                stop_timestamp = self._get_prune_timestamp(device, self._max_res_retention_days, RollupAccumulator.DAY_INDEX, now)
+                if stop_timestamp is not None and self._cold_archive:
+                    stop_timestamp = self._archive_day(device, stop_timestamp)
+                if stop_timestamp is not None:
+                    max_res_row_count = self._delete_rows(device.cursor, SQLite3DBClient.CT6_TABLE_NAME, stop_timestamp)
+                    self._delete_partitions(device, stop_timestamp)
+
+            if self._minute_res_retention_days > 0:
+                # Rows are only deleted once they have been added to a closed hour.
+                stop_timestamp = self._get_prune_timestamp(device, self._minute_res_retention_days, RollupAccumulator.HOUR_INDEX, now)
+                if stop_timestamp is not None:
+                    minute_res_row_count = self._delete_rows(device.cursor, SQLite3DBClient.MINUTE_RES_DB_DATA_TABLE_NAME, stop_timestamp)
+
+            deleted_row_count = max_res_row_count + minute_res_row_count
+            if deleted_row_count > 0:
+                device.conn.commit()
+                # Return some of the freed pages to the file system. This does nothing if the
+                # database was created before auto_vacuum was enabled but the free pages are
+                # still reused so the database does not grow. executescript() is used as
+                # execute() only steps the pragma once, which frees a single page.
+                device.conn.executescript(f"PRAGMA incremental_vacuum({SQLite3DBClient.INCREMENTAL_VACUUM_PAGES});")
+                self.debug(f"{device.db_file}: Deleted {max_res_row_count} max resolution and {minute_res_row_count} minute resolution rows.")
+
+    def _maintain(self):
+        """@brief Run the next step of the daily database maintenance if it is due. This is called from the
+                  thread that updates the databases. The maintenance yields to the ingest of received data so
+                  nothing is done while rows are uncommitted or dev_dicts are waiting to be stored."""
+        if self._uncommitted_row_count > 0 or self._dev_dict_queue.qsize() > 0:
+            return
+
+        db_list = []
+        for device in self._device_dict.values():
+            db_list.append((device.db_file, device.conn))
+            if device.partition_conn:
+                db_list.append((PartitionRouter.GetPartitionFile(device.db_file, device.partition_name), device.partition_conn))
+        self._db_maintenance.run(db_list)
+
+    def _get_prune_timestamp(self, device, retention_days, index, now):
+        """@brief Get the time before which rows are deleted.
+           @param device The DeviceState of the database.
+           @param retention_days The number of days the rows are kept for.
+           @param index The RollupAccumulator index of the bucket that the rows must have been added to.
+           @param now The time now (seconds since the epoch).
+           @return The time in milliseconds since the epoch or None if no rows can be deleted."""
+        first_timestamp = device.rollup_accumulator.get_first_timestamp(index)
+        if first_timestamp is None:
+            return None
+        stop_timestamp = int((now - retention_days*86400)*1000)
+        stop_timestamp = min(stop_timestamp, SQLite3DBClient.GetDBTimestamp(first_timestamp, device.schema_version))
+        # Whole days are deleted so that the first day left holds all it's rows.
+        return SQLite3DBClient.GetBucketStart(stop_timestamp, RollupAccumulator.DAY_INDEX)
+
+    def _archive_day(self, device, stop_timestamp):
+        """@brief Archive the next day of CT6_SENSOR rows if the whole day is before the time that rows
+                  are deleted. The days are archived in order, one day on each call.
+           @param device The DeviceState of the database.
+           @param stop_timestamp The time before which rows are to be deleted (milliseconds since the epoch).
+           @return The time before which rows may be deleted (milliseconds since the epoch) as they
+                   have been archived or None if no rows may be deleted."""
+        cold_archive = ColdArchive(device.db_file)
+        partition_router = PartitionRouter(device.db_file)
+        day_list = cold_archive.get_day_list()
+        if day_list:
+            day = day_list[-1] + timedelta(days=1)
+        else:
+            row_list = partition_router.fetch_all(device.conn,
+                                                  SQLite3DBClient.CT6_TABLE_NAME,
+                                                  f"MIN({SQLite3DBClient.TIMESTAMP})",
+                                                  "1",
+                                                  {},
+                                                  None,
+                                                  stop_timestamp,
+                                                  immutable=False)
+            timestamp_list = [row[0] for row in row_list if row[0] is not None]
+            if not timestamp_list:
+                return None
+            day = datetime.fromtimestamp(min(timestamp_list)/1000).date()
+
+        day_start = ColdArchive.GetEpochMS(day)
+        day_stop = ColdArchive.GetEpochMS(day + timedelta(days=1))
+        if day_stop <= stop_timestamp:
+            row_list = partition_router.fetch_all(device.conn,
+                                                  SQLite3DBClient.CT6_TABLE_NAME,
+                                                  ', '.join(self._column_list),
+                                                  f"{SQLite3DBClient.TIMESTAMP} >= :start AND {SQLite3DBClient.TIMESTAMP} < :stop",
+                                                  {"start": day_start, "stop": day_stop},
+                                                  day_start,
+                                                  day_stop,
+                                                  immutable=False)
+            cold_archive.write_day(day, self._column_list, row_list)
+            self.debug(f"{device.db_file}: Archived {len(row_list)} rows from {day}.")
+            return day_stop
+
+        if day_list:
+            return min(stop_timestamp, day_start)
+        return None
+
+    def _delete_rows(self, cursor, tableName, stop_timestamp):
+        """@brief Delete up to PRUNE_BATCH_ROWS of the oldest rows in a table.
+           @param cursor The cursor connected to the database.
+           @param tableName The name of the table.
+           @param stop_timestamp Rows before this time (milliseconds since the epoch) are deleted.
+           @return The number of rows deleted."""
+        cmd = f"DELETE FROM {tableName} WHERE rowid IN (SELECT rowid FROM {tableName} WHERE {SQLite3DBClient.TIMESTAMP} < ? LIMIT {SQLite3DBClient.PRUNE_BATCH_ROWS});"
+        cursor.execute(cmd, (stop_timestamp,))
+        return cursor.rowcount
+
+    def _close_partitions(self, device):
+        """@brief Close all the partitions before the one that rows are written to (normally only the last month).
+                  If a partition is open in another process (e.g. the GUI or an export) it is closed later
+                  (see _retry_close_partitions()) and the rows continue to be written to the new partition.
+           @param device The DeviceState of the database."""
+        device.partition_close_time = None
+        partition_router = PartitionRouter(device.db_file)
+        for previous_partition_name in partition_router.get_partition_list():
+            previous_partition_file = PartitionRouter.GetPartitionFile(device.db_file, previous_partition_name)
+            if previous_partition_name < device.partition_name and not PartitionRouter.IsClosed(previous_partition_file):
+                if PartitionRouter.Close(previous_partition_file):
+                    self.info(f"Closed the {previous_partition_file} partition.")
+                else:
+                    device.partition_close_time = time() + SQLite3DBClient.PARTITION_CLOSE_RETRY_SECS
+                    self.info(f"The {previous_partition_file} partition is in use. It will be closed later.")
+
+    def _retry_close_partitions(self):
+        """@brief Try again to close the partitions that were in use when the ct6_app moved on to the next month."""
+        now = time()
+        for device in self._device_dict.values():
+            if device.partition_close_time is not None and now >= device.partition_close_time and device.partition_name is not None:
+                self._close_partitions(device)
+
+    def _delete_partitions(self, device, stop_timestamp):
+        """@brief Delete the closed monthly partitions that only hold rows before a time.
+           @param device The DeviceState of the database.
+           @param stop_timestamp The time in milliseconds since the epoch."""
+        partition_router = PartitionRouter(device.db_file)
+        for partition_name in partition_router.get_partition_list(None, stop_timestamp):
+            partition_file = PartitionRouter.GetPartitionFile(device.db_file, partition_name)
+            _, month_stop = PartitionRouter.GetMonthRange(partition_name)
+            if month_stop <= stop_timestamp and PartitionRouter.IsClosed(partition_file):
+                os.remove(partition_file)
+                self.info(f"Deleted the {partition_file} partition.")
+
+    def disconnect(self):
+        """@brief Stop updating the databases, commit any uncommitted rows and disconnect from all the databases."""
+        # Stop all the writers before waiting for each to finish.
+        for writer in self._writers:
+            writer.stop_db_update()
+        for writer in self._writers:
+            writer.disconnect()
+
+        # Let the thread finish storing the dev_dicts it has read from the queue.
+        self._read_thread_running = False
+        if self._read_thread and self._read_thread is not threading.current_thread():
+            self._read_thread.join()
+        self._read_thread = None
+
+        with self._dbLock:
+            self._commit(True)
+            for device in self._device_dict.values():
+                device.close()
+            self._device_dict = {}
+
+    def _get_device(self, assy, dev_dict):
+        """@brief Get the state of the database that holds the data from a CT6 unit, connecting to
+                  (and creating if required) the database if we don't yet have a connection to it.
+           @param assy The CT6 assembly number (stripped of whitespace).
            @param dev_dict The CT6 device dict.
-           @return A connection to the database."""
-        # If we don't yet have a connection to the database file.
-        if db_file not in self._running_attr_dicts:
-            created_db = self._connect(db_file)
+           @return A DeviceState instance."""
+        device = self._device_dict.get(assy)
+        if device is None:
+            created_db = self._connect(self._get_db_file(dev_dict))
+            device = self._device_dict[assy]
             if created_db:
                 # If we've just created the database ensure it contains the required tables.
-                self._set_db_tables(dev_dict)
-        return self._running_attr_dicts[db_file][SQLite3DBClient.DB_CONNECTION]
-
-    def _get_running_attr_dict(self, assy):
-        """@brief Get the running attr dict for the given assy.
-           @param assy This may be the device assembly number as contained
-                       in a dev_dict or the db file (this contains the assy text).
-           @return A RUNNING_ATTR_DICT instance or None if not found"""
-        running_attr_dict = None
-        db_file_list = list(self._running_attr_dicts.keys())
-        for db_file in db_file_list:
-            if assy in db_file:
-                running_attr_dict = self._running_attr_dicts[db_file]
-        return running_attr_dict
-
-    def _get_db_meta_table_update_time(self, assy):
-        """@param assy This may be the device assembly number as contained
-                       in a dev_dict or the db file (this contains the assy text).
-           @return The time that the db meta table should be updated or None if it's never been updated."""
-        running_attr_dict = self._get_running_attr_dict(assy)
-        return running_attr_dict[SQLite3DBClient.META_TABLE_UPDATE_TIME]
-
-    def _set_db_meta_table_update_time(self, assy, next_update_time):
-        """@brief Set the time that the meta table data should be next updated.
-           @param assy This may be the device assembly number as contained
-                       in a dev_dict or the db file (this contains the assy text).
-           @param next_update_time The time it should be updated."""
-        running_attr_dict = self._get_running_attr_dict(assy)
-        running_attr_dict[SQLite3DBClient.META_TABLE_UPDATE_TIME] = next_update_time
-
-    def _get_db_history_record_sets(self, assy):
-        """@param assy This may be the device assembly number as contained
-                       in a dev_dict or the db file (this contains the assy text).
-           @return A list containing threee lists
-                   mins,
-                   hours,
-                   days
-                   These are used to update these derived tables."""
-        running_attr_dict = self._get_running_attr_dict(assy)
-        record_sets = running_attr_dict[SQLite3DBClient.HISTORY_RECORD_SET]
-        if len(record_sets) == 0:
-            # We need lists to hold the min, hour and day records
-            record_sets.append([])
-            record_sets.append([])
-            record_sets.append([])
-        return record_sets
-
-    def _get_db_cursor(self, dev_dict):
-        """@brief Get a cursor connected to the correct database.
-           @param dev_dict The CT6 device dict.
-           @param db_conn_dict A dictionary that holds connection to each
-                  database keyed by the database file.
-           @return The cursor instance or None if no connection found."""
-        cursor = None
-        if SQLite3DBClient.ASSY in dev_dict:
-            assy = dev_dict[SQLite3DBClient.ASSY]
-            running_attr_dict = self._get_running_attr_dict(assy)
-            conn = running_attr_dict[SQLite3DBClient.DB_CONNECTION]
-            if conn:
-                cursor = conn.cursor()
-        return cursor
+                self._set_db_tables(device, dev_dict)
+        return device
 
     def _execute_sql_cmd(self, cursor, cmd):
         """@brief Execute an SQL command."""
@@ -1195,7 +2368,7 @@ class SQLite3DBClient(BaseConstants):
                                    Each associated value is the SQL definition of the column type (E.G VARCHAR(64), FLOAT(5,2) etc).
                                    Alternatively this may be a SQL string to create the table."""
         if isinstance(tableSchemaDict, str):
-            cmd = f"CREATE TABLE {tableName} (" + tableSchemaDict + ");"
+            cmd = f"CREATE TABLE IF NOT EXISTS {tableName} (" + tableSchemaDict + ");"
             self._execute_sql_cmd(cursor, cmd)
         else:
             sqlCmd = 'CREATE TABLE IF NOT EXISTS `{}` ('.format(tableName)
@@ -1208,11 +2381,11 @@ class SQLite3DBClient(BaseConstants):
             sqlCmd = sqlCmd + ");"
             self._execute_sql_cmd(cursor, sqlCmd)
 
-    def _set_db_tables(self, dev_dict):
+    def _set_db_tables(self, device, dev_dict):
         """@brief Set the database tables. This is called after the database is created to
                   ensure the required tables are present.
+           @param device The DeviceState of the database.
            @param dev_dict The CT6 device dict."""
-        self._record_device_timestamp(dev_dict, 1)
         if SQLite3DBClient.UNIT_NAME in dev_dict and SQLite3DBClient.PRODUCT_ID in dev_dict :
             unit_name = dev_dict[SQLite3DBClient.UNIT_NAME]
             if len(unit_name) == 0:
@@ -1226,18 +2399,18 @@ class SQLite3DBClient(BaseConstants):
             # Don't record data unless the device name has been set.
             # The device name is used as the database name.
             else:
-                self._record_device_timestamp(dev_dict, 2)
-                cursor = self._get_db_cursor(dev_dict)
+                cursor = device.cursor
                 # Create the database tables
                 self.create_table(cursor, SQLite3DBClient.CT6_META_TABLE_NAME, SQLite3DBClient.CT6_DB_META_TABLE_SCHEMA_SQLITE)
-                self.create_table(cursor, SQLite3DBClient.CT6_TABLE_NAME, self._tableSchema)
-                self.create_table(cursor, SQLite3DBClient.MINUTE_RES_DB_DATA_TABLE_NAME, self._tableSchema)
-                self.create_table(cursor, SQLite3DBClient.HOUR_RES_DB_DATA_TABLE_NAME, self._tableSchema)
-                self.create_table(cursor, SQLite3DBClient.DAY_RES_DB_DATA_TABLE_NAME, self._tableSchema)
+                self.create_table(cursor, SQLite3DBClient.CT6_TABLE_NAME, self._get_sensor_table_schema(device))
+                self.create_table(cursor, SQLite3DBClient.MINUTE_RES_DB_DATA_TABLE_NAME, self._rollupTableSchema)
+                self.create_table(cursor, SQLite3DBClient.HOUR_RES_DB_DATA_TABLE_NAME, self._rollupTableSchema)
+                self.create_table(cursor, SQLite3DBClient.DAY_RES_DB_DATA_TABLE_NAME, self._rollupTableSchema)
                 try:
                     # Index on time stamp as most searches will be based around a date/time
-                    cmd = f"CREATE INDEX {SQLite3DBClient.CT6_TABLE_NAME}_INDEX ON {SQLite3DBClient.CT6_TABLE_NAME} ({SQLite3DBClient.TIMESTAMP})"
-                    self._execute_sql_cmd(cursor, cmd)
+                    if not device.clustered:
+                        cmd = f"CREATE INDEX {SQLite3DBClient.CT6_TABLE_NAME}_INDEX ON {SQLite3DBClient.CT6_TABLE_NAME} ({SQLite3DBClient.TIMESTAMP})"
+                        self._execute_sql_cmd(cursor, cmd)
                     cmd = f"CREATE INDEX {SQLite3DBClient.MINUTE_RES_DB_DATA_TABLE_NAME}_INDEX ON {SQLite3DBClient.MINUTE_RES_DB_DATA_TABLE_NAME} ({SQLite3DBClient.TIMESTAMP})"
                     self._execute_sql_cmd(cursor, cmd)
                     cmd = f"CREATE INDEX {SQLite3DBClient.HOUR_RES_DB_DATA_TABLE_NAME}_INDEX ON {SQLite3DBClient.HOUR_RES_DB_DATA_TABLE_NAME} ({SQLite3DBClient.TIMESTAMP})"
@@ -1246,53 +2419,144 @@ class SQLite3DBClient(BaseConstants):
                     self._execute_sql_cmd(cursor, cmd)
                 except:
                     pass
-
-        self._record_device_timestamp(dev_dict, 3)
-
-    def _record_device_timestamp(self, dev_dict, id):
-        """@brief Record the time since device data was received from the CT6 device. This is
-                  useful when debugging to see how long operations are taking.
-           @param dev_dict The device dict.
-           @param id A string identifying the call location."""
-        start_time = dev_dict[YView.RX_TIME_SECS] # This field is not added to the database. It holds the time
-                                                 # the CT6 dict was received on this machine.
-        callerRef = inspect.stack()[2][4][0]
-        callerRef = callerRef.strip()
-        now = time()
-        elapsed_ms =  int((now - start_time) * 1000)
-        ms_since_last_call = -1
-        if self._last__record_device_time is not None:
-            ms_since_last_call = int((now - self._last__record_device_time) * 1000)
-
-        self._uio.debug(f"DEVTS: {callerRef: >40} id={id} elapsed time = {elapsed_ms:d}/{ms_since_last_call:d} MS.")
-        self._last__record_device_time = now
-
-    def _record(self, dev_dict):
-        """@brief Save the dev_dict data to a database.
-           @param unit_name The name of the CT6 unit.
-           @param dev_dict The CT6 device dict."""
-        assy_label = dev_dict[SQLite3DBClient.ASSY]
-        assy_label = assy_label.strip()
-        db_storage_folder = self._config.getAttr(AppConfig.DB_STORAGE_PATH)
-        db_file = os.path.join(db_storage_folder, assy_label + '.db')
-        conn = self._get_db_conn(db_file, dev_dict)
-        cursor = conn.cursor()
-# PJA Handle exceptions adding to db ?
-        # We update the meta table every 60 seconds, so fairly low CPU cost
-        self._update_meta_table(cursor, dev_dict)
+                cmd = f"PRAGMA user_version={SQLite3DBClient.SCHEMA_VERSION}"
+                self._execute_sql_cmd(cursor, cmd)
+
+    def _record(self, assy, dev_dict_list):
+        """@brief Save the data from a batch of dev_dicts to a database. The rows are
+                  not committed here, see _commit().
+           @param assy The CT6 assembly number (stripped of whitespace) of the unit the dev_dicts were received from.
+           @param dev_dict_list A list of CT6 device dicts from the same CT6 unit."""
+        device = self._get_device(assy, dev_dict_list[0])
+        # The most recent dev_dict holds the current meta data.
+        self._update_meta_table(device, dev_dict_list[-1])
+        sensor_data_dict_list = []
+        for dev_dict in dev_dict_list:
+            sensor_data_dict_list.append( self._add_device(device, dev_dict) )
         # We update the CT6_SENSOR table for all CT6 stats/data received.
-        self._add_device(cursor, dev_dict)
-        cursor.close()
+        self._add_sensor_rows(device, sensor_data_dict_list)
+        device.last_seen = dev_dict_list[-1][YView.RX_TIME_SECS]
+        self._uncommitted_db_files.add(device.db_file)
+
+        row_count = len(sensor_data_dict_list)
+        if self._first_uncommitted_time is None:
+            self._first_uncommitted_time = time()
+        self._uncommitted_row_count += row_count
+        self._ingest_stats.add_rows(row_count)
+
+    def _add_sensor_rows(self, device, sensor_data_dict_list):
+        """@brief Add rows to the CT6_SENSOR table. If monthly partitions are enabled the rows are
+                  added to the partition of the month they were received in. Rows received in a month
+                  whose partition has closed are added to the main database.
+           @param device The DeviceState of the database.
+           @param sensor_data_dict_list A list of dicts holding the CT6_SENSOR table rows."""
+        if device.schema_version >= SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+            self._check_sensor_timestamps(device, sensor_data_dict_list)
+
+        if not self._monthly_partitions or device.schema_version < SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+            row_list = self._add_rows_to_table(device.cursor, SQLite3DBClient.CT6_TABLE_NAME, sensor_data_dict_list, device.schema_version)
+            self._add_live_rows(device, SQLite3DBClient.CT6_TABLE_NAME, row_list)
+            return
+
+        # Add each run of rows in the same month in one statement.
+        for partition_name, row_iter in itertools.groupby(sensor_data_dict_list, key=lambda sensor_data_dict: PartitionRouter.GetPartitionName(sensor_data_dict[SQLite3DBClient.TIMESTAMP])):
+            cursor = self._get_partition_cursor(device, partition_name)
+            if cursor is None:
+                cursor = device.cursor
+            row_list = self._add_rows_to_table(cursor, SQLite3DBClient.CT6_TABLE_NAME, list(row_iter), device.schema_version)
+            self._add_live_rows(device, SQLite3DBClient.CT6_TABLE_NAME, row_list)
+
+    def _add_live_rows(self, device, tableName, row_list):
+        """@brief Hold rows written to a table until they are committed and can be published to the live feed.
+           @param device The DeviceState of the database.
+           @param tableName The name of the table.
+           @param row_list A list of the rows written. Each row holds the values in the table column order."""
+        # The GUI only plots the live rows of databases that hold the TIMESTAMP as an integer.
+        if row_list and device.schema_version >= SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+            self._uncommitted_live_rows.append((device.db_file, tableName, row_list))
+
+    def _get_sensor_table_schema(self, device):
+        """@param device The DeviceState of the database.
+           @return The schema dict of the CT6_SENSOR table."""
+        if device.clustered:
+            return self._clusteredTableSchema
+        return self._tableSchema
+
+    def _check_sensor_timestamps(self, device, sensor_data_dict_list):
+        """@brief Check the TIMESTAMP of the rows to be added to the CT6_SENSOR table.
+                  - A time since the previous row longer than GAP_SECS is recorded in the CT6_GAP table.
+                  - The TIMESTAMP is the primary key of a clustered CT6_SENSOR table so each row must have a
+                    different TIMESTAMP. If a row has the same (or an earlier) TIMESTAMP as the previous row
+                    it is stored 1 ms after the previous row.
+           @param device The DeviceState of the database.
+           @param sensor_data_dict_list A list of dicts holding the CT6_SENSOR table rows."""
+        gap_ms = SQLite3DBClient.GAP_SECS*1000
+        gap_list = []
+        last_sensor_timestamp = device.last_sensor_timestamp
+        for sensor_data_dict in sensor_data_dict_list:
+            timestamp = SQLite3DBClient.GetDBTimestamp(sensor_data_dict[SQLite3DBClient.TIMESTAMP], device.schema_version)
+            if last_sensor_timestamp is not None:
+                if timestamp - last_sensor_timestamp > gap_ms:
+                    gap_list.append((last_sensor_timestamp, timestamp))
+
+                elif device.clustered and timestamp <= last_sensor_timestamp:
+                    timestamp = last_sensor_timestamp + 1
+                    sensor_data_dict[SQLite3DBClient.TIMESTAMP] = datetime.fromtimestamp(timestamp/1000)
+
+                # A row received out of order does not move the last TIMESTAMP back.
+                timestamp = max(timestamp, last_sensor_timestamp)
+            last_sensor_timestamp = timestamp
+        device.last_sensor_timestamp = last_sensor_timestamp
+        if gap_list:
+            device.cursor.executemany(f"REPLACE INTO {SQLite3DBClient.GAP_TABLE_NAME} (GAP_START, GAP_STOP) VALUES (?, ?);", gap_list)
+
+    def _get_partition_cursor(self, device, partition_name):
+        """@brief Get the cursor used to write rows to a monthly partition. When the first row of a
+                  new month is received the previous partitions are closed and the new partition is created.
+           @param device The DeviceState of the database.
+           @param partition_name The name of the partition.
+           @return The cursor or None if the partition has closed."""
+        if partition_name == device.partition_name:
+            return device.partition_cursor
+
+        if device.partition_name is not None and partition_name < device.partition_name:
+            return None
+
+        partition_file = PartitionRouter.GetPartitionFile(device.db_file, partition_name)
+        if os.path.isfile(partition_file) and PartitionRouter.IsClosed(partition_file):
+            return None
+
+        if device.partition_conn:
+            device.partition_conn.commit()
+            device.close_partition()
+
+        os.makedirs(PartitionRouter.GetPartitionFolder(device.db_file), exist_ok=True)
+        self.info(f"Connecting to the {partition_file} partition.")
+        conn = sqlite3.connect(partition_file, check_same_thread=False)
+        SQLite3DBClient.SetPragmas(conn, self._config, True)
+        cursor = conn.cursor()
+        self.create_table(cursor, SQLite3DBClient.CT6_TABLE_NAME, self._get_sensor_table_schema(device))
+        if not device.clustered:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {SQLite3DBClient.CT6_TABLE_NAME}_INDEX ON {SQLite3DBClient.CT6_TABLE_NAME} ({SQLite3DBClient.TIMESTAMP});")
+        cursor.execute(f"PRAGMA user_version={SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP};")
         conn.commit()
+        device.partition_name = partition_name
+        device.partition_conn = conn
+        device.partition_cursor = cursor
+        self._close_partitions(device)
+        return cursor
 
-    def _add_device(self, cursor, dev_dict):
-        """@brief Add device data to the database.
-           @param cursor The cursor to execute the sql command.
-           @param dev_dict The CT6 device dict."""
+    def _add_device(self, device, dev_dict):
+        """@brief Update the derived tables with device data and get the row to be
+                  added to the CT6_SENSOR table.
+           @param device The DeviceState of the database.
+           @param dev_dict The CT6 device dict.
+           @return A dict holding the CT6_SENSOR table row."""
         start_time = dev_dict[YView.RX_TIME_SECS] # This field is not added to the database. It holds the time
                                                   # the dict was received on this machine.
 
-        self._record_device_timestamp(dev_dict, 1)
+        # The time between the receipt of the message and it being stored.
+        self._instrumentation.observe("rx_to_db", time() - start_time)
         sensor_data_dict = {}
         # Record the time the message was received on the TCP socket rather than the time now
         # as CPU delays may cause dither in the time we get to this point.
@@ -1334,32 +2598,29 @@ class SQLite3DBClient(BaseConstants):
         sensor_data_dict[SQLite3DBClient.TEMPERATURE]=dev_dict[SQLite3DBClient.TEMPERATURE]
         sensor_data_dict[SQLite3DBClient.RSSI_DBM]=dev_dict[SQLite3DBClient.RSSI]
 
-        self._record_device_timestamp(dev_dict, 2)
-
-        # Add sensor data to the table containing all sensor data
-        self._add_to_table(cursor, SQLite3DBClient.CT6_TABLE_NAME, sensor_data_dict)
-
-        self._record_device_timestamp(dev_dict, 3)
-
-        assy = dev_dict[SQLite3DBClient.ASSY]
-
         # Update the mins, hours and days tables.
         # This may block for some time if the ct6 app is started with a large database
         # that needs mins, hours and days tables recreating. This is ok because we have
         # a queue between the receipt of CT6 JSON messages and this thread that processes them.
-        self._update_derived_tables(assy, sensor_data_dict, cursor)
+        self._update_derived_tables(device, sensor_data_dict)
+
+        return sensor_data_dict
 
-    def _update_meta_table(self, cursor, dev_dict):
-        """@brief Update the table containing meta data. This keeps the meta table up to date.
-           @param cursor A cursor for the db.
+    def _update_meta_table(self, device, dev_dict):
+        """@brief Update the table containing meta data. This is only written when the meta data
+                  (unit name, CT names etc) changes.
+           @param device The DeviceState of the database.
            @param devDict The device dict."""
-        assy = dev_dict[SQLite3DBClient.ASSY]
-        _time = self._get_db_meta_table_update_time(assy)
-        #If not set yet
-        if _time is None:
-            _time = time()
-        # If it's time to update the meta data for this CT6 unit/db
-        if time() >= _time:
+        meta_values = (dev_dict[SQLite3DBClient.ASSY],
+                       dev_dict[SQLite3DBClient.UNIT_NAME],
+                       dev_dict[SQLite3DBClient.CT1][SQLite3DBClient.NAME],
+                       dev_dict[SQLite3DBClient.CT2][SQLite3DBClient.NAME],
+                       dev_dict[SQLite3DBClient.CT3][SQLite3DBClient.NAME],
+                       dev_dict[SQLite3DBClient.CT4][SQLite3DBClient.NAME],
+                       dev_dict[SQLite3DBClient.CT5][SQLite3DBClient.NAME],
+                       dev_dict[SQLite3DBClient.CT6][SQLite3DBClient.NAME])
+        meta_hash = hash(meta_values)
+        if meta_hash != device.meta_hash:
             # We use replace into with an id (primary key) of 1 so that we only ever have one record in the table.
             cmd = 'REPLACE INTO {} (id,{},{},{},{},{},{},{},{}) VALUES("1","{}","{}","{}","{}","{}","{}","{}","{}");'.format(SQLite3DBClient.CT6_META_TABLE_NAME,
                                                                              SQLite3DBClient.HW_ASSY,
@@ -1370,103 +2631,86 @@ class SQLite3DBClient(BaseConstants):
                                                                              SQLite3DBClient.CT4_NAME,
                                                                              SQLite3DBClient.CT5_NAME,
                                                                              SQLite3DBClient.CT6_NAME,
-                                                                             dev_dict[SQLite3DBClient.ASSY],
-                                                                             dev_dict[SQLite3DBClient.UNIT_NAME],
-                                                                             dev_dict[SQLite3DBClient.CT1][SQLite3DBClient.NAME],
-                                                                             dev_dict[SQLite3DBClient.CT2][SQLite3DBClient.NAME],
-                                                                             dev_dict[SQLite3DBClient.CT3][SQLite3DBClient.NAME],
-                                                                             dev_dict[SQLite3DBClient.CT4][SQLite3DBClient.NAME],
-                                                                             dev_dict[SQLite3DBClient.CT5][SQLite3DBClient.NAME],
-                                                                             dev_dict[SQLite3DBClient.CT6][SQLite3DBClient.NAME])
-            self._execute_sql_cmd(cursor, cmd)
-            # We update the meta table every 60 seconds for each CT6 when we received the dev_dict
-            self._set_db_meta_table_update_time(assy, time() + 60)
+                                                                             *meta_values)
+            self._execute_sql_cmd(device.cursor, cmd)
+            device.meta_hash = meta_hash
 
-    def _update_derived_tables(self, db_file, sensor_data_dDict, cursor):
+    def _update_derived_tables(self, device, sensor_data_dict):
         """@brief Update the min, hour and day tables in the database with new data just read from a sensor.
-           @param db_file The db_file to be updated.
-           @param dev_dict The dict containing the device data to be added to the database.
-           @param cursor The cursor to execute the sql command."""
-        thisRecord = sensor_data_dDict
+           @param device The DeviceState of the database to be updated.
+           @param sensor_data_dict The dict containing the sensor data to be added to the database."""
         lowResTableList = SQLite3DBClient.LOW_RES_DATA_TABLE_LIST
-        recordSets = self._get_db_history_record_sets(db_file)
-
-        # First derived table (minute)
-        tableName = lowResTableList[0]
-        recordSet = recordSets[0]
-        # If we've moved into the next minute
-        if len(recordSet) > 0 and (thisRecord[BaseConstants.TIMESTAMP].minute != recordSet[0][BaseConstants.TIMESTAMP].minute):
-            # Ensure we have several records as we may get two readings in the same second (microseconds apart) but we don't want to add
-            # data to the database unless it's valid. We should have 60 second values in the list but will vary as
-            # poll/response and network delays to-from the CT6 device may move the sampling times.
-            if len(recordSet) >= 3:
-                # Use a pandas data frame to calculate the mean values for each column
-                df = pd.DataFrame(recordSet)
-                self._add_to_table(cursor, tableName, df.mean())
-                recordSet.clear() # Clear rather than creating a new list so we don't change it's reference
-                recordSet.append(thisRecord) # Add the new data to the next record set.
-                self._uio.debug(f"{db_file}: Record added to {tableName} table: {datetime.now()}")
-
-                # Second derived table (hour)
-                tableName = lowResTableList[1]
-                recordSet = recordSets[1]
-                # If we've moved into the next hour
-                if len(recordSet) > 0 and (thisRecord[BaseConstants.TIMESTAMP].hour != recordSet[0][BaseConstants.TIMESTAMP].hour):
-                    # Use a pandas data frame to calculate the mean values for each column
-                    df = pd.DataFrame(recordSet)
-                    self._add_to_table(cursor, tableName, df.mean())
-                    recordSet.clear() # Clear rather than creating a new list so we don't change it's reference
-                    recordSet.append(thisRecord) # Add the new data to the next record set.
-                    self._uio.debug(f"{db_file}: Record added to {tableName} table: {datetime.now()}")
-
-                    # Third derived table (day)
-                    tableName = lowResTableList[2]
-                    recordSet = recordSets[2]
-                    # If we've moved into the next day
-                    if len(recordSet) > 0 and (thisRecord[BaseConstants.TIMESTAMP].day != recordSet[0][BaseConstants.TIMESTAMP].day):
-                        # Use a pandas data frame to calculate the mean values for each column
-                        df = pd.DataFrame(recordSet)
-                        self._add_to_table(cursor, tableName, df.mean())
-                        recordSet.clear() # Clear rather than creating a new list so we don't change it's reference
-                        recordSet.append(thisRecord) # Add the new data to the next record set.
-
-                        self._uio.debug(f"{db_file}: Record added to {tableName} table: {datetime.now()}")
-
-                    else:
-                        # Add to the set of record to be averaged later
-                        recordSet.append(thisRecord)
-
-                else:
-                    # Add to the set of record to be averaged later
-                    recordSet.append(thisRecord)
-
-        else:
-            # Add to the set of record to be averaged later
-            recordSet.append(thisRecord)
-
-    def _add_to_table(self, cursor, tableName, dictData):
+        with self._instrumentation.span("rollup"):
+            closed_list = device.rollup_accumulator.add(sensor_data_dict)
+        for index, mean_record in closed_list:
+            tableName = lowResTableList[index]
+            row = self._add_to_table(device.cursor, tableName, mean_record, device.schema_version)
+            self._add_live_rows(device, tableName, [row])
+            self._uio.debug(f"{device.db_file}: Record added to {tableName} table: {datetime.now()}")
+        # Save the rollup state at each minute boundary.
+        if closed_list:
+            self._save_rollup_state(device)
+
+    def _get_column_list(self, tableName, schema_version):
+        """@brief Get the columns of a data table.
+           @param tableName The name of the table.
+           @param schema_version The schema version of the database.
+           @return A list of the column names."""
+        if schema_version >= SQLite3DBClient.SCHEMA_VERSION_ENERGY and tableName in SQLite3DBClient.LOW_RES_DATA_TABLE_LIST:
+            return self._rollup_column_list
+        return self._column_list
+
+    def _get_insert_sql(self, tableName, column_list):
+        """@brief Get the parameterised SQL statement used to insert a row into a data table.
+                  The statement is built once per table and then reused so that sqlite can
+                  use its cached prepared statement.
+           @param tableName The name of the table to add to.
+           @param column_list The columns of the table.
+           @return The SQL INSERT statement."""
+        key = (tableName, len(column_list))
+        sql = self._insert_sql_dict.get(key)
+        if sql is None:
+            sql = 'INSERT INTO `' + tableName
+            sql += '` ('
+            sql += ', '.join(column_list)
+            sql += ') VALUES ('
+            sql += ', '.join(['?']*len(column_list))
+            sql += ');'
+            self._insert_sql_dict[key] = sql
+        return sql
+
+    def _get_row_values(self, dictData, schema_version, column_list):
+        """@brief Get the values to be bound to the INSERT statement parameters.
+           @param dictData The dict (or pandas series) holding the data to be added to the table.
+           @param schema_version The schema version of the database.
+           @param column_list The columns of the table.
+           @return A list of values in the table column order."""
+        valueList = [dictData[col] for col in column_list]
+        valueList[SQLite3DBClient.TIMESTAMP_INDEX] = SQLite3DBClient.GetDBTimestamp(valueList[SQLite3DBClient.TIMESTAMP_INDEX], schema_version)
+        return valueList
+
+    def _add_to_table(self, cursor, tableName, dictData, schema_version):
         """@brief Add data to table. We assume this is in the currently selected database.
            @param cursor The cursor to execute the sql command.
-           @param tableName The name of the table to add to. If the table does not exist it will be created.
+           @param tableName The name of the table to add to.
            @param dictData The dict holding the data to be added to the table.
-           @param databaseIF The database interface instance."""
-        # Saw an issue on some platforms where the pandas dataframe returned the timestamp with 9 digits below the
-        # decimal point,(ns resolution). This caused problems later when datetime.fromisoformat() is called to
-        # read the data as it throws an exception. Therefore we convert the datetime instance to a string and
-        # chop it down if required.
-        dictDataCopy = copy.deepcopy(dictData)
-        tsStr = str(dictDataCopy[SQLite3DBClient.TIMESTAMP])
-        if len(tsStr) > 26:
-            dictDataCopy[SQLite3DBClient.TIMESTAMP] = tsStr[:26]
-
-        keyList = list(dictDataCopy.keys())
-        valueList = []
-        for key in keyList:
-            valueList.append(str(dictDataCopy[key]))
-        sql = 'INSERT INTO `' + tableName
-        sql += '` ('
-        sql += ', '.join(keyList)
-        sql += ') VALUES ('
-        sql += ', '.join(map(SQLite3DBClient.GetQuotedValue, valueList))
-        sql += ');'
-        self._execute_sql_cmd(cursor, sql)
\ No newline at end of file
+           @param schema_version The schema version of the database.
+           @return The list of values added in the table column order."""
+        column_list = self._get_column_list(tableName, schema_version)
+        valueList = self._get_row_values(dictData, schema_version, column_list)
+        cursor.execute(self._get_insert_sql(tableName, column_list), valueList)
+        return valueList
+
+    def _add_rows_to_table(self, cursor, tableName, dictDataList, schema_version):
+        """@brief Add several rows to a table in a single statement. We assume this is in the currently selected database.
+           @param cursor The cursor to execute the sql command.
+           @param tableName The name of the table to add to.
+           @param dictDataList A list of dicts holding the data to be added to the table.
+           @param schema_version The schema version of the database.
+           @return A list of the rows added. Each row holds the values in the table column order."""
+        rowList = []
+        if len(dictDataList) > 0:
+            column_list = self._get_column_list(tableName, schema_version)
+            rowList = [self._get_row_values(dictData, schema_version, column_list) for dictData in dictDataList]
+            cursor.executemany(self._get_insert_sql(tableName, column_list), rowList)
+        return rowList
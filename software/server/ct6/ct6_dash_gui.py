@@ -6,6 +6,8 @@ from time import time
 
 from datetime import datetime
 
+import MySQLdb
+
 from bokeh.layouts import column, row
 from bokeh.models import HoverTool
 from bokeh.models import TabPanel, Tabs
@@ -674,38 +676,17 @@ class GUI(GUIBase):
             tableName = BaseConstants.DAY_RES_DB_DATA_TABLE_NAME
 
         maxRecordCount = self._options.maxpp
-        # We find how many records match the search before read every nth (stride value) record.
-        # This should allow resonable search times on large data sets.
-        cmd = f"SELECT COUNT(*) FROM {tableName} where TIMESTAMP BETWEEN '{startDate} {startHoursMins}:00:000' AND '{stopDate} {stopHoursMins}:59:999';"
+        # The rows are read in a single pass. The LIMIT stops the read as soon as more
+        # than the max number of rows are found.
+        cmd = f"select * from {tableName} where TIMESTAMP BETWEEN '{startDate} {startHoursMins}:00:000' AND '{stopDate} {stopHoursMins}:59:999' ORDER BY TIMESTAMP LIMIT {maxRecordCount+1};"
         self._uio.debug(f"MYSQL CMD: {cmd}")
-        responseTuple = self._dbIF.executeSQL(cmd)
+        responseTuple = self._readRows(cmd, resolution)
         exeTime = time()-startT
         self._uio.debug(f"MYSQL command execution time {exeTime:.1f} seconds.")
-        key = "COUNT(*)"
-        if key in responseTuple[0]:
-            recordCount = responseTuple[0][key]
-            self._uio.debug(f"recordCount = {recordCount}")
-
-            if recordCount > maxRecordCount:
-                # PJA: Wired this out as it's probably better to abort very large plots due to the time and memory it takes.
-                # The user can always use the '-m/--maxpp' command line argument to increase the default number of maximum
-                # plot points if they have fast machines with lots of memory.
-                pass
-                # If we will have more than the max number of plot points then reduce the number of points
-#                    stride = math.ceil( recordCount/maxRecordCount )
-#                    cmd = f' WITH ordering AS ( SELECT ROW_NUMBER() OVER (ORDER BY TIMESTAMP) AS n, {tableName}.*'\
-#                          f" FROM {tableName} where TIMESTAMP BETWEEN '{startDate} 00:00:00:000' AND '{stopDate} 23:59:59:999' ORDER BY TIMESTAMP"\
-#                          " )"\
-#                          f' SELECT * FROM ordering WHERE MOD(n, {stride}) = 0;'
-            else:
-                cmd = f"select * from {tableName} where TIMESTAMP BETWEEN '{startDate} {startHoursMins}:00:000' AND '{stopDate} {stopHoursMins}:59:999';"
-
-                self._uio.debug(f"MYSQL CMD: {cmd}")
-                responseTuple = self._dbIF.executeSQL(cmd)
-                recordCount = len(responseTuple)
+        recordCount = len(responseTuple)
         self._uio.debug("Found {} records.".format( recordCount ))
         if recordCount > self._options.maxpp:
-            self._error(f"Reduce plot resolution ({recordCount} values read, max = {self._options.maxpp}).")
+            self._error(f"Reduce plot resolution (more than {self._options.maxpp} values found).")
             self._sendEnableActionButtonsMsg(True)
         else:
             results[dBName]=responseTuple
@@ -717,6 +698,47 @@ class GUI(GUIBase):
         msgDict[GUI.STATUS_MESSAGE]=f"Took {exeTime:.1f} seconds to read data from DB."
         return results
 
+    def _readRows(self, cmd, resolution):
+        """@brief Read the rows selected by an SQL command. An unbuffered (server side) cursor
+                  is used so the rows are fetched in chunks rather than all being held by the
+                  MySQL client before they are returned. The progress is shown in the status line.
+           @param cmd The SQL command.
+           @param resolution The resolution of the data being read.
+           @return A list of dicts of each row read."""
+        cursor = self._getUnbufferedCursor()
+        if cursor is None:
+            # The LIMIT of the command still bounds the rows held by the MySQL client.
+            return self._dbIF.executeSQL(cmd)
+
+        rowList = []
+        progressTime = time()
+        try:
+            cursor.execute(cmd)
+            while True:
+                rowChunk = cursor.fetchmany(GUI.READ_CHUNK_ROWS)
+                if not rowChunk:
+                    break
+                rowList.extend(rowChunk)
+                if time() >= progressTime + GUI.READ_PROGRESS_SECS:
+                    progressTime = time()
+                    self._sendReadProgress(resolution, len(rowList))
+
+        finally:
+            cursor.close()
+        return rowList
+
+    def _getUnbufferedCursor(self):
+        """@brief Get an unbuffered (server side) cursor. The p3lib DatabaseIF only provides buffered
+                  cursors and does not expose its MySQL connection so the connection is read from its
+                  private _dbCon attribute. All access to it is in this method so that if p3lib changes
+                  the rows are read through DatabaseIF.executeSQL() instead.
+           @return A MySQLdb SSDictCursor or None if the MySQL connection is not available."""
+        dbCon = getattr(self._dbIF, "_dbCon", None)
+        if dbCon is None:
+            self._uio.debug("The MySQL connection is not available. Reading the rows using a buffered cursor.")
+            return None
+        return dbCon.cursor(MySQLdb.cursors.SSDictCursor)
+
     def _calcKWH(self, sensorID, sensorName, rowDictList, resolution):
         """@brief Calculate the kWh usage for the CT data.
            @param sensorID The ID of the sensor (0-3)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+import os
+import argparse
+import tempfile
+import shutil
+import random
+import sqlite3
+import statistics
+
+from time import time, sleep, perf_counter
+
+from p3lib.uio import UIO
+from p3lib.helper import logTraceBack
+
+from lib.yview import YView
+
+from ct6.ct6_app_gui import AppConfig, SQLite3DBClient
+
+class IngestBenchmark(object):
+    """@brief Responsible for measuring the rate at which CT6 data can be stored in the sqlite databases
+              by the ct6_app as the number of CT6 units and database writers change.
+              Simulated CT6 data is stored in databases in a temporary folder."""
+
+    def __init__(self, uio, options):
+        """@brief Constructor
+           @param uio A UIO instance handling user input and output (E.G stdin/stdout or a GUI)
+           @param options An instance of the OptionParser command line options."""
+        self._uio = uio
+        self._options = options
+
+    def _get_dev_dict(self, unit, rx_time):
+        """@brief Get a simulated CT6 device dict.
+           @param unit The number of the CT6 unit.
+           @param rx_time The time the dict was received.
+           @return The CT6 device dict."""
+        dev_dict = {YView.RX_TIME_SECS: rx_time,
+                    SQLite3DBClient.IP_ADDRESS: f"10.0.0.{unit+1}",
+                    SQLite3DBClient.ACTIVE: True,
+                    SQLite3DBClient.UNIT_NAME: f"CT6_{unit+1}",
+                    SQLite3DBClient.PRODUCT_ID: "CT6",
+                    SQLite3DBClient.ASSY: f"ASY0398_V01.600_SN{unit+1:08d}",
+                    SQLite3DBClient.TEMPERATURE: 25.0,
+                    SQLite3DBClient.RSSI: -60.0}
+        for ct in (SQLite3DBClient.CT1, SQLite3DBClient.CT2, SQLite3DBClient.CT3, SQLite3DBClient.CT4, SQLite3DBClient.CT5, SQLite3DBClient.CT6):
+            dev_dict[ct] = {SQLite3DBClient.NAME: ct,
+                            SQLite3DBClient.PRMS: random.uniform(-3000.0, 3000.0),
+                            SQLite3DBClient.PREACT: random.uniform(0.0, 100.0),
+                            SQLite3DBClient.PAPPARENT: random.uniform(0.0, 3000.0),
+                            SQLite3DBClient.PF: random.uniform(-1.0, 1.0),
+                            SQLite3DBClient.VRMS: random.uniform(230.0, 250.0),
+                            SQLite3DBClient.FREQ: random.uniform(49.9, 50.1)}
+        return dev_dict
+
+    def _run(self, unit_count, writer_count):
+        """@brief Measure the time taken to store the data from CT6 units.
+           @param unit_count The number of CT6 units.
+           @param writer_count The number of database writers.
+           @return The number of rows stored per second."""
+        db_storage_folder = tempfile.mkdtemp(dir=self._options.folder)
+        try:
+            app_config = AppConfig(self._uio, os.path.join(db_storage_folder, "ct6_app.cfg"), AppConfig.DEFAULT_CONFIG)
+            app_config.addAttr(AppConfig.DB_STORAGE_PATH, db_storage_folder)
+            app_config.addAttr(AppConfig.DB_WRITER_COUNT, writer_count)
+            app_config.addAttr(AppConfig.SQLITE_SYNCHRONOUS, self._options.synchronous.upper())
+            app_config.addAttr(AppConfig.DB_COMMIT_ROW_COUNT, self._options.commit_rows)
+            db_client = SQLite3DBClient(self._uio, self._options, app_config, start_db_update=False)
+
+            # Queue the data received from the CT6 units (one message a second) before
+            # starting the writers so that we measure the rate at which it is stored.
+            start_rx_time = time() - self._options.seconds
+            for second in range(self._options.seconds):
+                for unit in range(unit_count):
+                    db_client.hear(self._get_dev_dict(unit, start_rx_time+second))
+
+            start_time = time()
+            db_client.start_db_update()
+            while db_client.get_queue_size() > 0:
+                sleep(0.01)
+            # This commits any uncommitted rows.
+            db_client.disconnect()
+            elapsed_secs = time() - start_time
+
+        finally:
+            shutil.rmtree(db_storage_folder)
+
+        return (unit_count*self._options.seconds)/elapsed_secs
+
+    def run(self):
+        """@brief Run the benchmark."""
+        unit_count_list = [int(value) for value in self._options.units.split(",")]
+        writer_count_list = [int(value) for value in self._options.writers.split(",")]
+        self._uio.info(f"Storing {self._options.seconds} seconds of data from each CT6 unit.")
+        self._uio.info(f"{'Units': >6} {'Writers': >8} {'Rows/sec': >10} {'Speedup': >8}")
+        for unit_count in unit_count_list:
+            base_rate = None
+            for writer_count in writer_count_list:
+                rate = self._run(unit_count, writer_count)
+                if base_rate is None:
+                    base_rate = rate
+                self._uio.info(f"{unit_count: >6} {writer_count: >8} {rate: >10.0f} {rate/base_rate: >8.2f}")
+
+class LayoutBenchmark(object):
+    """@brief Responsible for comparing the CT6_SENSOR table layouts. The current layout holds the rows
+              in rowid order with a separate TIMESTAMP index. The clustered layout holds the rows in
+              TIMESTAMP order (TIMESTAMP primary key). The file size and the time taken to read the rows
+              in day, week and month windows are measured. Simulated CT6 data (one row a second) is
+              stored in databases in a temporary folder. The reads are made with the databases in the
+              OS file cache."""
+
+    INDEXED = "indexed"
+    CLUSTERED = "clustered"
+    WINDOW_DAYS_DICT = {"Day": 1, "Week": 7, "Month": 30}
+
+    def __init__(self, uio, options):
+        """@brief Constructor
+           @param uio A UIO instance handling user input and output (E.G stdin/stdout or a GUI)
+           @param options An instance of the OptionParser command line options."""
+        self._uio = uio
+        self._options = options
+        self._table_schema = SQLite3DBClient.GetTableSchema(SQLite3DBClient.CT6_DB_TABLE_SCHEMA_SQLITE_V1)
+        self._column_list = list(self._table_schema.keys())
+
+    def _create_db(self, db_file, layout, start_timestamp):
+        """@brief Create a database holding the simulated CT6 data.
+           @param db_file The database file.
+           @param layout INDEXED or CLUSTERED.
+           @param start_timestamp The TIMESTAMP of the first row (milliseconds since the epoch)."""
+        table_schema = self._table_schema
+        if layout == LayoutBenchmark.CLUSTERED:
+            table_schema = SQLite3DBClient.GetClusteredTableSchema(table_schema)
+        columns = ",\n".join([f"`{col_name}` {col_type}" for col_name, col_type in table_schema.items()])
+        conn = sqlite3.connect(db_file)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute(f"CREATE TABLE {SQLite3DBClient.CT6_TABLE_NAME} ({columns});")
+            if layout == LayoutBenchmark.INDEXED:
+                conn.execute(f"CREATE INDEX {SQLite3DBClient.CT6_TABLE_NAME}_INDEX ON {SQLite3DBClient.CT6_TABLE_NAME} ({SQLite3DBClient.TIMESTAMP});")
+            insert_sql = f"INSERT INTO {SQLite3DBClient.CT6_TABLE_NAME} ({', '.join(self._column_list)}) VALUES ({', '.join(['?']*len(self._column_list))});"
+            # Use the same data for both layouts.
+            _random = random.Random(1)
+            value_count = len(self._column_list) - 1
+            for day in range(self._options.days):
+                day_timestamp = start_timestamp + day*86400000
+                row_list = [[day_timestamp + second*1000 + _random.randint(0, 20)] + [_random.uniform(-3000.0, 3000.0) for _ in range(value_count)] for second in range(86400)]
+                conn.executemany(insert_sql, row_list)
+                conn.commit()
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        finally:
+            conn.close()
+
+    def _read(self, db_file, start, stop):
+        """@brief Read the rows in a time window.
+           @param db_file The database file.
+           @param start The start of the window (milliseconds since the epoch).
+           @param stop The end of the window (milliseconds since the epoch).
+           @return The time taken in seconds."""
+        conn = sqlite3.connect(db_file)
+        try:
+            start_time = perf_counter()
+            conn.execute(f"SELECT * FROM {SQLite3DBClient.CT6_TABLE_NAME} WHERE {SQLite3DBClient.TIMESTAMP} BETWEEN ? AND ?;", (start, stop)).fetchall()
+            return perf_counter() - start_time
+        finally:
+            conn.close()
+
+    def run(self):
+        """@brief Run the benchmark."""
+        db_folder = tempfile.mkdtemp(dir=self._options.folder)
+        try:
+            start_timestamp = int(time() - self._options.days*86400)*1000
+            db_file_dict = {}
+            self._uio.info(f"Creating databases holding {self._options.days} days of data.")
+            for layout in (LayoutBenchmark.INDEXED, LayoutBenchmark.CLUSTERED):
+                db_file_dict[layout] = os.path.join(db_folder, f"{layout}.db")
+                self._create_db(db_file_dict[layout], layout, start_timestamp)
+                self._uio.info(f"{layout: >10} layout file size: {os.path.getsize(db_file_dict[layout])/1E6:.1f} MB")
+
+            self._uio.info(f"Median read time of {self._options.repeats} reads.")
+            self._uio.info(f"{'Window': >6} {'Rows': >8} {'Indexed (s)': >12} {'Clustered (s)': >14} {'Speedup': >8}")
+            _random = random.Random(2)
+            for window_name, window_days in LayoutBenchmark.WINDOW_DAYS_DICT.items():
+                if window_days > self._options.days:
+                    continue
+                window_ms = window_days*86400000
+                window_list = []
+                for _ in range(self._options.repeats):
+                    start = start_timestamp + _random.randint(0, self._options.days*86400000 - window_ms)
+                    window_list.append((start, start + window_ms - 1))
+                median_dict = {}
+                for layout, db_file in db_file_dict.items():
+                    median_dict[layout] = statistics.median([self._read(db_file, start, stop) for start, stop in window_list])
+                speedup = median_dict[LayoutBenchmark.INDEXED]/median_dict[LayoutBenchmark.CLUSTERED]
+                self._uio.info(f"{window_name: >6} {window_days*86400: >8} {median_dict[LayoutBenchmark.INDEXED]: >12.3f} {median_dict[LayoutBenchmark.CLUSTERED]: >14.3f} {speedup: >8.2f}")
+
+        finally:
+            shutil.rmtree(db_folder)
+
+def main():
+    """@brief Program entry point"""
+    uio = UIO()
+
+    try:
+        parser = argparse.ArgumentParser(description="Measure the rate at which the ct6_app can store CT6 data in sqlite databases.\n"\
+                                                     "If --layout is used compare the CT6_SENSOR table layouts instead.",
+                                         formatter_class=argparse.RawDescriptionHelpFormatter)
+        parser.add_argument("-d", "--debug",   action='store_true', help="Enable debugging.")
+        parser.add_argument("-u", "--units",   help="A comma separated list of the number of CT6 units to simulate (default=1,2,4,8).", default="1,2,4,8")
+        parser.add_argument("-w", "--writers", help="A comma separated list of the number of database writers (default=1,2,4,8).", default="1,2,4,8")
+        parser.add_argument("-s", "--seconds", help="The number of seconds of data to store from each CT6 unit (default=3600).", type=int, default=3600)
+        parser.add_argument("--synchronous",   help="The sqlite synchronous mode (default=NORMAL).", default="NORMAL")
+        parser.add_argument("--commit_rows",   help="The number of rows written before they are committed (default=1000).", type=int, default=1000)
+        parser.add_argument("-f", "--folder",  help="The folder in which to create the databases. By default the system temp folder is used. Set this to a folder on the disk the databases are normally stored on.", default=None)
+        parser.add_argument("--layout",        action='store_true', help="Compare the file size and range read time of the indexed and clustered (TIMESTAMP primary key) CT6_SENSOR table layouts.")
+        parser.add_argument("--days",          help="The number of days of data stored when comparing layouts (default=31).", type=int, default=31)
+        parser.add_argument("--repeats",       help="The number of reads of each window size when comparing layouts (default=5).", type=int, default=5)
+
+        options = parser.parse_args()
+        # Not used by the benchmark but required by SQLite3DBClient
+        options.show = False
+        options.include = None
+        options.exclude = None
+
+        uio.enableDebug(options.debug)
+        if options.layout:
+            layout_benchmark = LayoutBenchmark(uio, options)
+            layout_benchmark.run()
+
+        else:
+            ingest_benchmark = IngestBenchmark(uio, options)
+            ingest_benchmark.run()
+
+    # If the program throws a system exit exception
+    except SystemExit:
+        pass
+    # Don't print error information if CTRL C pressed
+    except KeyboardInterrupt:
+        pass
+    except Exception as ex:
+        logTraceBack(uio)
+
+        if options.debug:
+            raise
+        else:
+            uio.error(str(ex))
+
+
+if __name__ == '__main__':
+    main()
@@ -41,12 +41,9 @@ import sys
 import argparse
 import threading
 import traceback
-import inspect
 import os
-import psutil
 import pandas as pd
 import MySQLdb
-import objgraph
 import json
 
 import numpy as np
@@ -64,6 +61,8 @@ from lib.config import ConfigBase
 from lib.db_handler import DBHandler
 from lib.yview import YViewCollector, LocalYViewCollector, YView
 from lib.base_constants import BaseConstants
+from lib.rollup import RollupAccumulator
+from lib.instrumentation import Instrumentation
 
 class CTDBClientConfig(ConfigBase):
     DEFAULT_CONFIG = {
@@ -658,9 +657,11 @@ class CTDBClient(DBHandler):
         self._metaTableSchema = DBHandler.GetTableSchema( CTDBClient.CT6_DB_META_TABLE_SCHEMA )
         self._tableSchema = DBHandler.GetTableSchema( CTDBClient.CT6_DB_TABLE_SCHEMA )
         self._dbLock = threading.Lock()
-        self._historyDicts={}
-        self._hourRecordSets=[]
+        self._rollupAccumulators={}
         self._devDictList = []
+        # Spans, counters and CPU/memory usage are reported periodically when debugging.
+        self._instrumentation = Instrumentation.Create(uio, options.debug)
+        self._instrumentation.start()
         self._metaTableUpdateTime = time()
 
         #Create a list of CT6 unit addresses that the user does not wish to collect data from
@@ -695,8 +696,6 @@ class CTDBClient(DBHandler):
            @param devDict The device dictionary as received in response to the AYT message.
            @return The name of the database."""
 
-        startT = devDict[YView.RX_TIME_SECS]
-        self._recordDeviceTimestamp(startT, 1)
         dBName = None
         dbFound = False
         if CTDBClient.UNIT_NAME in devDict and CTDBClient.PRODUCT_ID in devDict :
@@ -717,9 +716,7 @@ class CTDBClient(DBHandler):
             if productID in CTDBClient.VALID_PRODUCT_ID_LIST:
                 dBName = unitName
                 self._dbConfig.dataBaseName = dBName
-                self._recordDeviceTimestamp(startT, 2)
                 recordTuple = self._dataBaseIF.executeSQL(DBHandler.SHOW_DATABASES_SQL_CMD)
-                self._recordDeviceTimestamp(startT, 3)
                 for record in recordTuple:
                     if DBHandler.DATABASE_KEY in record:
                         dbName = record[DBHandler.DATABASE_KEY]
@@ -744,7 +741,6 @@ class CTDBClient(DBHandler):
                 except:
                     pass
 
-        self._recordDeviceTimestamp(startT, 4)
         return dBName
 
     def _updateMetaTable(self, dbName, devDict):
@@ -779,81 +775,21 @@ class CTDBClient(DBHandler):
             self._devDictList = []
             self._metaTableUpdateTime = time()+60
 
-    def _updateDerivedTables(self, dbName, thisRecord, historyDicts, dataBaseIF, lowResTableList):
+    def _updateDerivedTables(self, dbName, thisRecord, rollupAccumulators, dataBaseIF, lowResTableList):
         """@brief Update the min, hour and day tables in the database with new data just read from a sensor.
            @param dbName The name of the database to update. We assume this has been selected previously (sql use DB command issued).
            @param thisRecord The dict containing the data to be added to the database.
-           @param historyDicts The dicts containing the reading history.
+           @param rollupAccumulators A dict holding the RollupAccumulator for each database.
            @param dataBaseIF The interface to the database.
-           @param lowResTableList The list of the NAMES OF THE databaSE TABLES (MIN, HOUR AND DAY).
-           @PARAM UIO A UIO instance (if defined) to record debug information as records are added to the database tables."""
-        if not dbName in historyDicts:
-            # We need lists to hold the min, hour and day records
-            historyDicts[dbName]=[[],[],[]]
-        # Get the record sets for this database
-        recordSets = historyDicts[dbName]
-
-        # First derived table (minute)
-        tableName = lowResTableList[0]
-        recordSet = recordSets[0]
-        # If we've moved into the next minute
-        if len(recordSet) > 0 and (thisRecord[BaseConstants.TIMESTAMP].minute != recordSet[0][BaseConstants.TIMESTAMP].minute):
-            # Ensure we have several records as we may get two readings in the same second (microseconds apart) but we don't want to add
-            # data to the database unless it's valid. We should have 60 second values in the list but will vary as
-            # poll/response and network delays to-from the CT6 device may move the sampling times.
-            if len(recordSet) >= 3:
-                # Use a pandas data frame to calculate the mean values for each column
-                df = pd.DataFrame(recordSet)
-                MySQLDBClient.AddToTable(tableName, df.mean(), dataBaseIF)
-                recordSet.clear() # Clear rather than creating a new list so we don't change it's reference
-                recordSet.append(thisRecord) # Add the new data to the next record set.
-                self._uio.debug(f"{dbName}: Record added to {tableName} table: {datetime.now()}")
-
-                # Second derived table (hour)
-                tableName = lowResTableList[1]
-                recordSet = recordSets[1]
-                # If we've moved into the next hour
-                if len(recordSet) > 0 and (thisRecord[BaseConstants.TIMESTAMP].hour != recordSet[0][BaseConstants.TIMESTAMP].hour):
-                    # Use a pandas data frame to calculate the mean values for each column
-                    df = pd.DataFrame(recordSet)
-                    MySQLDBClient.AddToTable(tableName, df.mean(), dataBaseIF)
-                    recordSet.clear() # Clear rather than creating a new list so we don't change it's reference
-                    recordSet.append(thisRecord) # Add the new data to the next record set.
-                    self._uio.debug(f"{dbName}: Record added to {tableName} table: {datetime.now()}")
-
-                    # Third derived table (day)
-                    tableName = lowResTableList[2]
-                    recordSet = recordSets[2]
-                    # If we've moved into the next day
-                    if len(recordSet) > 0 and (thisRecord[BaseConstants.TIMESTAMP].day != recordSet[0][BaseConstants.TIMESTAMP].day):
-                        # Use a pandas data frame to calculate the mean values for each column
-                        df = pd.DataFrame(recordSet)
-                        MySQLDBClient.AddToTable(tableName, df.mean(), dataBaseIF)
-                        recordSet.clear() # Clear rather than creating a new list so we don't change it's reference
-                        recordSet.append(thisRecord) # Add the new data to the next record set.
-
-                        self._uio.debug(f"{dbName}: Record added to {tableName} table: {datetime.now()}")
-
-                    else:
-                        # Add to the set of record to be averaged later
-                        recordSet.append(thisRecord)
+           @param lowResTableList The list of the NAMES OF THE databaSE TABLES (MIN, HOUR AND DAY)."""
+        if not dbName in rollupAccumulators:
+            rollupAccumulators[dbName]=RollupAccumulator()
+        rollupAccumulator = rollupAccumulators[dbName]
 
-                else:
-                    # Add to the set of record to be averaged later
-                    recordSet.append(thisRecord)
-
-        else:
-            # Add to the set of record to be averaged later
-            recordSet.append(thisRecord)
-
-    def _recordDeviceTimestamp(self, startT, id):
-        """@brief Record the time since device data was received from the CT6 device.
-           @param startT The time in seconds when the message was received from the CT6 unit.
-           @param id A string identifying the call location."""
-        callerRef = inspect.stack()[2][4][0]
-        callerRef = callerRef.strip()
-        elapsedT = time() - startT
-        self._uio.debug(f"DEVTS: {callerRef: >40} id={id} elapsed time = {elapsedT:.6f} seconds.")
+        for index, meanRecord in rollupAccumulator.add(thisRecord):
+            tableName = lowResTableList[index]
+            MySQLDBClient.AddToTable(tableName, meanRecord, dataBaseIF)
+            self._uio.debug(f"{dbName}: Record added to {tableName} table: {datetime.now()}")
 
     def _addDevice(self, dbName, devDict):
         """@brief Add device data to the database.
@@ -861,8 +797,9 @@ class CTDBClient(DBHandler):
            @param devDict The device dict."""
         startT = devDict[YView.RX_TIME_SECS] # This field is not added to the database. It holds the time
                                              # the dict was received on this machine.
+        # The time between the receipt of the message and it being stored.
+        self._instrumentation.observe("rx_to_db", time() - startT)
         self._dataBaseIF.executeSQL("USE {};".format(dbName))
-        self._recordDeviceTimestamp(startT, 1)
 
         sensorDataDict = {}
         # Record the time the message was received on the TCP socket rather than the time now
@@ -905,36 +842,19 @@ class CTDBClient(DBHandler):
         sensorDataDict[CTDBClient.RSSI_DBM]=devDict[CTDBClient.RSSI]
 
         self._updateMetaTable(dbName, devDict)
-        self._recordDeviceTimestamp(startT, 2)
 
         # Add sensor data to the table containing all sensor data
-        MySQLDBClient.AddToTable( CTDBClient.CT6_TABLE_NAME, sensorDataDict, self._dataBaseIF)
-
-        self._recordDeviceTimestamp(startT, 3)
+        with self._instrumentation.span("db_insert"):
+            MySQLDBClient.AddToTable( CTDBClient.CT6_TABLE_NAME, sensorDataDict, self._dataBaseIF)
 
         # If the user does not have another instance running deleting and creating the low resolution data tables.
         if not self._mySQLDBClient.isCreatingLowResTables():
             # Update these tables with new data we have just received.
-            self._updateDerivedTables(dbName, sensorDataDict, self._historyDicts, self._dataBaseIF, CTDBClient.LOW_RES_DATA_TABLE_LIST)
+            with self._instrumentation.span("derived_tables"):
+                self._updateDerivedTables(dbName, sensorDataDict, self._rollupAccumulators, self._dataBaseIF, CTDBClient.LOW_RES_DATA_TABLE_LIST)
         else:
             self._uio.info("Not updating low resolution data tables as they are currently being re created.")
 
-        self._recordDeviceTimestamp(startT, 4)
-
-    def _reportMemoryUsage(self):
-        """@brief Report the memory usage while running."""
-        _, _, load15 = psutil.getloadavg()
-        loadAvg = (load15/os.cpu_count()) * 100
-        usedMB = psutil.virtual_memory()[3]/1000000
-        freeMB = psutil.virtual_memory()[4]/1000000
-        self._uio.debug(f"CPU Load AVG: {loadAvg:.1f}, Used Mem (MB): {usedMB:.1f} Free Mem (MB): {freeMB:.1f}")
-
-        objList = objgraph.most_common_types()
-        for elemList in objList:
-            _type = elemList[0]
-            _count = elemList[1]
-            self._uio.debug(f"Found {_count: <8.0f} object of type {_type}")
-
     def hear(self, devDict):
         """@brief Called when data is received from the device.
            @param devDict The device dict."""
@@ -942,8 +862,7 @@ class CTDBClient(DBHandler):
             pretty = json.dumps(devDict, indent=4)
             self._uio.info(f"JSON DATA START <\n{pretty}\n>JSON DATA STOP")
 
-        self._reportMemoryUsage()
-        startT = devDict[YView.RX_TIME_SECS]
+        self._instrumentation.count("dev_dicts_received")
         try:
             ipAddress = self._getDeviceIPAddress(devDict)
             # If the address of this CT6 unit is in the exclude list
@@ -960,10 +879,8 @@ class CTDBClient(DBHandler):
                     self._uio.info(f"{ipAddress}: Is not active.")
                     devActive = False
 
-            self._recordDeviceTimestamp(startT, 1)
             if devActive:
-                with self._dbLock:
-                    self._recordDeviceTimestamp(startT, 2)
+                with self._dbLock, self._instrumentation.span("db_record"):
                     dbName = self._getDatabaseName(devDict)
                     if dbName:
                         try:
@@ -972,7 +889,6 @@ class CTDBClient(DBHandler):
                             # If database not found, attempt to create them.
                             self._ensureDBTables(devDict)
                             self._addDevice(dbName, devDict)
-                    self._recordDeviceTimestamp(startT, 3)
 
         except Exception as ex:
             self._uio.error( str(ex) )
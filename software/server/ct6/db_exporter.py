@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import pathlib
+
+from time import time, mktime
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from p3lib.uio import UIO
+
+from ct6.ct6_app_gui import AppConfig, SQLite3DBClient
+from ct6.partition_router import PartitionRouter
+from ct6.cold_archive import ColdArchive
+
+class DBExporter(object):
+    """@brief Responsible for exporting a table of CT6 sqlite databases to Parquet or Arrow IPC files
+              for offline analysis (E.G pandas or polars). The rows are read and written in fixed size
+              record batches so the memory used does not depend on the time range exported.
+              The databases are opened read only so the ct6_app may continue to store data.
+              The CT6_SENSOR rows are read from the cold archive, the monthly partitions and the main
+              database. The rows of each database are written in TIMESTAMP order to
+              <ASSY>_<TABLE>.parquet or <ASSY>_<TABLE>.arrow. The databases are exported in parallel
+              by separate processes.
+              pyarrow is required but is not a dependency of the ct6 package. Install it using
+              'pip install pyarrow' if required."""
+
+    PARQUET = "parquet"
+    ARROW = "arrow"
+    FORMAT_LIST = (PARQUET, ARROW)
+    DEFAULT_BATCH_ROWS = 65536
+    TIMESTAMP_TYPE_UNIT = "ms"
+
+    @staticmethod
+    def ExportDB(options, db_file):
+        """@brief Export a database. This is called in a separate process.
+           @param options The command line options instance.
+           @param db_file The sqlite database file.
+           @return The number of rows exported."""
+        uio = UIO()
+        uio.enableDebug(options.debug)
+        db_exporter = DBExporter(uio, options, None)
+        return db_exporter.export(db_file)
+
+    @staticmethod
+    def GetEpochMS(datetime_str):
+        """@param datetime_str A local date/time string (YYYY-MM-DD or YYYY-MM-DD HH:MM:SS) or None.
+           @return The milliseconds since the epoch or None if datetime_str is None."""
+        if datetime_str is None:
+            return None
+        return int(mktime(datetime.fromisoformat(datetime_str).timetuple()))*1000
+
+    def __init__(self, uio, options, config):
+        """@brief Constructor
+           @param uio A UIO instance
+           @param options The command line options instance
+           @param config An AppConfig instance. This is only required by export_all()."""
+        self._uio = uio
+        self._options = options
+        self._config = config
+        self._table_name = options.table
+        self._file_format = options.format
+        self._batch_rows = options.batch_rows
+        self._start = DBExporter.GetEpochMS(options.start)
+        self._stop = DBExporter.GetEpochMS(options.stop)
+
+    def export_all(self):
+        """@brief Export all the databases in the database storage folder."""
+        # Check that pyarrow is available before starting the processes.
+        self._import_pyarrow()
+        os.makedirs(self._options.export, exist_ok=True)
+        db_storage_folder = self._config.getAttr(AppConfig.DB_STORAGE_PATH)
+        db_file_list = SQLite3DBClient.GetDBFileList(db_storage_folder)
+        if not db_file_list:
+            return
+        start_time = time()
+        process_count = min(os.cpu_count(), len(db_file_list))
+        with ProcessPoolExecutor(max_workers=process_count) as executor:
+            future_dict = {executor.submit(DBExporter.ExportDB, self._options, db_file): db_file for db_file in db_file_list}
+            for future in as_completed(future_dict):
+                db_file = future_dict[future]
+                try:
+                    row_count = future.result()
+                    self._uio.info(f"{db_file}: Exported {row_count} {self._table_name} rows.")
+
+                except Exception as ex:
+                    self._uio.error(f"{db_file}: Failed to export the {self._table_name} table: {str(ex)}")
+
+        elapsed_seconds = int(time() - start_time)
+        self._uio.info(f"Took {elapsed_seconds} seconds to export the {self._table_name} table of {len(db_file_list)} database/s to {self._options.export}.")
+
+    def _import_pyarrow(self):
+        """@return A tuple holding the pyarrow, pyarrow.parquet and pyarrow.ipc modules."""
+        try:
+            import pyarrow
+            import pyarrow.parquet
+            import pyarrow.ipc
+        except ImportError:
+            raise Exception("pyarrow is required to export the databases. Install it using 'pip install pyarrow'.")
+        return pyarrow, pyarrow.parquet, pyarrow.ipc
+
+    def get_export_file(self, db_file):
+        """@param db_file The sqlite database file.
+           @return The file the table of the database is exported to."""
+        return os.path.join(self._options.export, f"{pathlib.Path(db_file).stem}_{self._table_name}.{self._file_format}")
+
+    def export(self, db_file):
+        """@brief Export the table of a database. The file is written to a temporary file first so that a
+                  partially written file is never present.
+           @param db_file The sqlite database file.
+           @return The number of rows exported."""
+        pyarrow, parquet, ipc = self._import_pyarrow()
+        row_count = 0
+        sqlite_conn = None
+        writer = None
+        export_file = self.get_export_file(db_file)
+        tmp_file = export_file + ".tmp"
+        try:
+            sqlite_conn = sqlite3.connect(pathlib.Path(db_file).absolute().as_uri() + "?mode=ro", uri=True)
+            schema_version = SQLite3DBClient.GetSchemaVersion(sqlite_conn)
+            if schema_version < SQLite3DBClient.SCHEMA_VERSION_INT_TIMESTAMP:
+                raise Exception(f"Schema version {schema_version} is out of date. Run 'ct6_app --migrate_schema' before exporting.")
+
+            column_list = [row[1] for row in sqlite_conn.execute(f"PRAGMA table_info({self._table_name});")]
+            if not column_list:
+                raise Exception(f"The {self._table_name} table was not found.")
+            schema = self._get_schema(pyarrow, column_list)
+            if self._file_format == DBExporter.PARQUET:
+                writer = parquet.ParquetWriter(tmp_file, schema, compression="zstd")
+            else:
+                writer = ipc.new_file(tmp_file, schema)
+
+            for column_dict in self._read_batches(sqlite_conn, db_file, column_list):
+                batch = pyarrow.RecordBatch.from_arrays([pyarrow.array(column_dict[col_name], type=schema.field(col_name).type) for col_name in column_list], schema=schema)
+                writer.write_batch(batch)
+                row_count += batch.num_rows
+                self._uio.debug(f"{db_file}: Exported {row_count} rows.")
+
+            writer.close()
+            writer = None
+            os.replace(tmp_file, export_file)
+
+        finally:
+            if writer:
+                writer.close()
+            if sqlite_conn:
+                sqlite_conn.close()
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+
+        return row_count
+
+    def _get_schema(self, pyarrow, column_list):
+        """@param pyarrow The pyarrow module.
+           @param column_list The names of the columns of the table.
+           @return The pyarrow schema of the exported table. The TIMESTAMP is held as a UTC timestamp."""
+        field_list = []
+        for col_name in column_list:
+            if col_name == SQLite3DBClient.TIMESTAMP:
+                field_list.append(pyarrow.field(col_name, pyarrow.timestamp(DBExporter.TIMESTAMP_TYPE_UNIT, tz="UTC")))
+            else:
+                field_list.append(pyarrow.field(col_name, pyarrow.float64()))
+        return pyarrow.schema(field_list)
+
+    def _read_batches(self, sqlite_conn, db_file, column_list):
+        """@brief Read the rows of the table in TIMESTAMP order.
+           @param sqlite_conn The read only connection to the database.
+           @param db_file The sqlite database file.
+           @param column_list The names of the columns to read.
+           @return A generator of dicts holding a list or numpy array of each column (up to batch_rows rows), keyed by column name."""
+        start = self._start
+        if self._table_name == SQLite3DBClient.CT6_TABLE_NAME:
+            # The oldest rows may have been moved to the cold archive. These are not held in the database.
+            cold_archive = ColdArchive(db_file)
+            archive_stop = cold_archive.get_stop()
+            if archive_stop is not None:
+                for _date in cold_archive.get_day_list():
+                    day_start = ColdArchive.GetEpochMS(_date)
+                    if (self._stop is not None and day_start >= self._stop) or (start is not None and ColdArchive.GetEpochMS(_date + timedelta(days=1)) <= start):
+                        continue
+                    yield from self._read_archive_batches(cold_archive.get_day_file(_date), column_list)
+                start = archive_stop if start is None else max(start, archive_stop)
+
+            partition_router = PartitionRouter(db_file)
+            partition_list = partition_router.get_partition_list(start, self._stop)
+            # Rows received for a closed month are held in the main database so each partition is read
+            # with the rows of the main database up to the start of the next partition. The first read
+            # also includes the main database rows before the first partition.
+            boundary_list = [None] + [PartitionRouter.GetMonthRange(partition_name)[0] for partition_name in partition_list[1:]] + [None]
+            for index in range(max(len(partition_list), 1)):
+                if partition_list:
+                    partition_router.attach(sqlite_conn, [partition_list[index]])
+                try:
+                    yield from self._read_db_batches(sqlite_conn, partition_router, column_list, self._max(start, boundary_list[index]), self._min(self._stop, boundary_list[index+1]))
+
+                finally:
+                    partition_router.detach(sqlite_conn)
+
+        else:
+            yield from self._read_db_batches(sqlite_conn, None, column_list, start, self._stop)
+
+    def _max(self, value_a, value_b):
+        """@return The greater value, ignoring values that are None."""
+        if value_a is None:
+            return value_b
+        if value_b is None:
+            return value_a
+        return max(value_a, value_b)
+
+    def _min(self, value_a, value_b):
+        """@return The lesser value, ignoring values that are None."""
+        if value_a is None:
+            return value_b
+        if value_b is None:
+            return value_a
+        return min(value_a, value_b)
+
+    def _read_db_batches(self, sqlite_conn, partition_router, column_list, start, stop):
+        """@brief Read rows from the database in TIMESTAMP order.
+           @param sqlite_conn The read only connection to the database.
+           @param partition_router The PartitionRouter that has attached the partitions to read or None to
+                                   read the main database.
+           @param column_list The names of the columns to read.
+           @param start The start of the period (milliseconds since the epoch) or None if unlimited.
+           @param stop The end of the period (milliseconds since the epoch, not included) or None if unlimited.
+           @return A generator of dicts holding a list of each column (up to batch_rows rows), keyed by column name."""
+        where_list = ["1"]
+        if start is not None:
+            where_list.append(f"{SQLite3DBClient.TIMESTAMP} >= :start")
+        if stop is not None:
+            where_list.append(f"{SQLite3DBClient.TIMESTAMP} < :stop")
+        where = " AND ".join(where_list)
+        columns = ", ".join(column_list)
+        if partition_router:
+            select_sql = partition_router.get_select_sql(self._table_name, columns, where)
+        else:
+            select_sql = f"SELECT {columns} FROM {self._table_name} WHERE {where}"
+        # Each table is read using the TIMESTAMP index (or primary key) and sqlite merges them in order.
+        cursor = sqlite_conn.execute(f"{select_sql} ORDER BY 1;", {"start": start, "stop": stop})
+        while True:
+            row_list = cursor.fetchmany(self._batch_rows)
+            if not row_list:
+                break
+            yield dict(zip(column_list, zip(*row_list)))
+
+    def _read_archive_batches(self, archive_file, column_list):
+        """@brief Read the rows of a day from the cold archive.
+           @param archive_file The archive file.
+           @param column_list The names of the columns to read.
+           @return A generator of dicts holding a numpy array of each column (up to batch_rows rows), keyed by column name.
+                   Columns that are not in the archive are None."""
+        column_dict = ColdArchive.Read(archive_file, self._start, self._stop)
+        row_count = len(column_dict[ColdArchive.TIMESTAMP])
+        for index in range(0, row_count, self._batch_rows):
+            batch_dict = {}
+            for col_name in column_list:
+                if col_name in column_dict:
+                    batch_dict[col_name] = column_dict[col_name][index:index+self._batch_rows]
+                else:
+                    batch_dict[col_name] = [None]*len(batch_dict[ColdArchive.TIMESTAMP])
+            yield batch_dict
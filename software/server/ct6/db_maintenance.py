@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import os
+
+from time import time
+from datetime import datetime, timedelta
+
+class MaintenanceState(object):
+    """@brief Holds the progress of the maintenance of a single database file."""
+
+    __slots__ = ("day", "step_list", "start_time", "start_stats")
+
+    def __init__(self, day, step_list):
+        """@brief Constructor.
+           @param day The date on which the quiet hours in which the maintenance was started began.
+           @param step_list A list of the (task, table name) tuples to run."""
+        self.day = day
+        self.step_list = step_list
+        self.start_time = None
+        self.start_stats = None
+
+
+class DBMaintenance(object):
+    """@brief Responsible for the maintenance of the CT6 sqlite databases. Once a day, during the configured
+              quiet hours, each database file is
+              - Checkpointed so that the WAL file is truncated.
+              - Analysed (ANALYZE) one table at a time so that the query planner has up to date statistics.
+                analysis_limit is set so that this completes quickly on very large tables.
+              - Optimised (PRAGMA optimize).
+              - Vacuumed (incremental_vacuum) so that the free pages are returned to the file system.
+                Databases created before auto_vacuum was enabled can only be vacuumed with the
+                ct6_app stopped so they are not vacuumed.
+              - Checkpointed again.
+              run() is called by the thread that writes to the databases once the rows received have
+              been committed. It runs at most one step so that the ingest is only delayed briefly. The
+              time until the next step is set so that the rate at which data is written does not exceed
+              the configured limit."""
+
+    CHECKPOINT = "checkpoint"
+    ANALYZE = "analyze"
+    OPTIMIZE = "optimize"
+    VACUUM = "vacuum"
+    # The approximate number of rows of each index that ANALYZE examines.
+    ANALYSIS_LIMIT = 1000
+    # The number of free pages returned to the file system in each vacuum step.
+    VACUUM_PAGES = 1000
+    # The minimum time between steps.
+    MIN_STEP_INTERVAL_SECS = 1.0
+    AUTO_VACUUM_INCREMENTAL = 2
+
+    @staticmethod
+    def GetStats(db_file, conn):
+        """@param db_file The database file.
+           @param conn The connection to the database.
+           @return A dict holding the size of the database and WAL files (bytes), the page count, the
+                   free page count and the planner statistics (the sqlite_stat1 rows)."""
+        wal_file = db_file + "-wal"
+        wal_size = 0
+        if os.path.isfile(wal_file):
+            wal_size = os.path.getsize(wal_file)
+        stat_list = []
+        if conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='sqlite_stat1';").fetchone():
+            stat_list = conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1 ORDER BY tbl, idx;").fetchall()
+        return {"FILE_SIZE": os.path.getsize(db_file),
+                "WAL_SIZE": wal_size,
+                "PAGE_COUNT": conn.execute("PRAGMA page_count;").fetchone()[0],
+                "FREELIST_COUNT": conn.execute("PRAGMA freelist_count;").fetchone()[0],
+                "STAT_LIST": stat_list}
+
+    def __init__(self, uio, start_hour, stop_hour, io_limit_mb_per_sec):
+        """@brief Constructor
+           @param uio A UIO instance.
+           @param start_hour The hour (0-23) at which the quiet hours start.
+           @param stop_hour The hour (0-23) at which the quiet hours stop. If this is the same as the
+                            start hour maintenance is disabled.
+           @param io_limit_mb_per_sec The max rate (MB/second) at which data is written by the maintenance."""
+        self._uio = uio
+        self._start_hour = start_hour
+        self._stop_hour = stop_hour
+        self._io_limit_bytes_per_sec = io_limit_mb_per_sec*1E6
+        self._state_dict = {}
+        self._next_step_time = 0
+
+    def is_quiet_time(self, _datetime):
+        """@param _datetime A datetime instance holding the local time.
+           @return True if the time is in the quiet hours."""
+        if self._start_hour == self._stop_hour:
+            return False
+        if self._start_hour < self._stop_hour:
+            return self._start_hour <= _datetime.hour < self._stop_hour
+        # The quiet hours span midnight.
+        return _datetime.hour >= self._start_hour or _datetime.hour < self._stop_hour
+
+    def get_quiet_day(self, _datetime):
+        """@param _datetime A datetime instance holding the local time.
+           @return The date on which the quiet hours containing the time began. This does not change at
+                   midnight if the quiet hours span midnight so the maintenance only runs once."""
+        return (_datetime - timedelta(hours=self._start_hour)).date()
+
+    def run(self, db_list):
+        """@brief Run the next maintenance step if it is due. All the rows written must have been committed.
+           @param db_list A list of (database file, connection) tuples. The connections must be able to
+                          write to the databases.
+           @return True if a step was run."""
+        now = datetime.now()
+        if not self.is_quiet_time(now) or time() < self._next_step_time:
+            return False
+
+        for db_file, conn in db_list:
+            state = self._state_dict.get(db_file)
+            quiet_day = self.get_quiet_day(now)
+            if state is None or state.day != quiet_day:
+                state = MaintenanceState(quiet_day, self._get_step_list(conn))
+                self._state_dict[db_file] = state
+            if state.step_list:
+                self._run_step(db_file, conn, state)
+                return True
+        return False
+
+    def _get_step_list(self, conn):
+        """@param conn The connection to the database.
+           @return A list of the (task, table name) tuples that maintain the database."""
+        table_list = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name;")]
+        step_list = [(DBMaintenance.CHECKPOINT, None)]
+        step_list += [(DBMaintenance.ANALYZE, table_name) for table_name in table_list]
+        step_list += [(DBMaintenance.OPTIMIZE, None), (DBMaintenance.VACUUM, None), (DBMaintenance.CHECKPOINT, None)]
+        return step_list
+
+    def _run_step(self, db_file, conn, state):
+        """@brief Run the next maintenance step of a database.
+           @param db_file The database file.
+           @param conn The connection to the database.
+           @param state The MaintenanceState of the database."""
+        if state.start_time is None:
+            state.start_time = time()
+            state.start_stats = DBMaintenance.GetStats(db_file, conn)
+            self._uio.info(f"{db_file}: Maintenance started. {self._get_stats_text(state.start_stats)}")
+
+        task, table_name = state.step_list.pop(0)
+        start_time = time()
+        page_size = conn.execute("PRAGMA page_size;").fetchone()[0]
+        written_bytes = 0
+        try:
+            if task == DBMaintenance.CHECKPOINT:
+                written_bytes = DBMaintenance.GetStats(db_file, conn)["WAL_SIZE"]
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+
+            elif task == DBMaintenance.ANALYZE:
+                conn.execute(f"PRAGMA analysis_limit={DBMaintenance.ANALYSIS_LIMIT};")
+                conn.execute(f"ANALYZE `{table_name}`;")
+                conn.commit()
+
+            elif task == DBMaintenance.OPTIMIZE:
+                conn.execute("PRAGMA optimize;")
+                conn.commit()
+
+            elif task == DBMaintenance.VACUUM:
+                freelist_count = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+                if freelist_count > 0:
+                    if conn.execute("PRAGMA auto_vacuum;").fetchone()[0] == DBMaintenance.AUTO_VACUUM_INCREMENTAL:
+                        # As in SQLite3DBClient._prune() executescript() is required to free more than one page.
+                        conn.executescript(f"PRAGMA incremental_vacuum({DBMaintenance.VACUUM_PAGES});")
+                        written_bytes = min(freelist_count, DBMaintenance.VACUUM_PAGES)*page_size
+                        # Continue until all the free pages have been returned to the file system.
+                        state.step_list.insert(0, (DBMaintenance.VACUUM, None))
+                    else:
+                        self._uio.info(f"{db_file}: {freelist_count} free pages are reused but the file only shrinks if it is vacuumed with the ct6_app stopped.")
+
+        except Exception as ex:
+            # E.G a checkpoint may not complete while the GUI is reading the database. The next day's maintenance retries.
+            self._uio.warn(f"{db_file}: Maintenance {task} failed: {str(ex)}")
+
+        elapsed_secs = time() - start_time
+        self._next_step_time = time() + max(DBMaintenance.MIN_STEP_INTERVAL_SECS, elapsed_secs, written_bytes/self._io_limit_bytes_per_sec)
+        if not state.step_list:
+            stats = DBMaintenance.GetStats(db_file, conn)
+            self._uio.info(f"{db_file}: Maintenance took {time()-state.start_time:.1f} seconds. {self._get_stats_text(stats)}")
+            for tbl, idx, stat in stats["STAT_LIST"]:
+                self._uio.info(f"{db_file}: Planner stats {tbl} {idx}: {stat}")
+
+    def _get_stats_text(self, stats):
+        """@param stats A dict returned by GetStats().
+           @return A description of the stats."""
+        return f"File size = {stats['FILE_SIZE']/1E6:.1f} MB, WAL size = {stats['WAL_SIZE']/1E6:.1f} MB, "\
+               f"free pages = {stats['FREELIST_COUNT']} of {stats['PAGE_COUNT']}, planner stats = {len(stats['STAT_LIST'])} indexes."
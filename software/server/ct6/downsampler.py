@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+class Downsampler(object):
+    """@brief Responsible for reducing the number of points in a plot trace so that large data sets are
+              plotted quickly while keeping the shape of the trace. The indexes of the points to plot are
+              returned so that the caller can select the rows to plot.
+              - min/max keeps the lowest and highest value in each bucket of points so peaks are never lost.
+              - LTTB (Largest Triangle Three Buckets) keeps the point in each bucket that forms the largest
+                triangle with the point kept from the previous bucket and the average of the next bucket.
+                This keeps the shape of slowly changing values using a single point per bucket."""
+
+    MIN_MAX = "min/max"
+    LTTB = "LTTB"
+
+    @staticmethod
+    def GetIndexes(method, x_values, y_values, point_count):
+        """@brief Get the indexes of the points to plot.
+           @param method Downsampler.MIN_MAX or Downsampler.LTTB.
+           @param x_values The X values (E.G milliseconds since the epoch) in ascending order.
+           @param y_values The Y values. None values are allowed.
+           @param point_count The max number of points to plot.
+           @return A numpy array of the indexes of the points to plot in ascending order."""
+        y_array = np.array(y_values, dtype=np.float64)
+        if len(y_array) <= point_count:
+            return np.arange(len(y_array))
+        if method == Downsampler.LTTB:
+            return Downsampler.GetLTTBIndexes(np.array(x_values, dtype=np.float64), y_array, point_count)
+        return Downsampler.GetMinMaxIndexes(y_array, point_count)
+
+    @staticmethod
+    def GetMinMaxIndexes(y_array, point_count):
+        """@brief Get the indexes of the lowest and highest value in each bucket.
+           @param y_array A numpy array of the Y values.
+           @param point_count The max number of points to plot. Two points are kept from each bucket.
+           @return A numpy array of the indexes of the points to plot in ascending order."""
+        bucket_count = max(point_count // 2, 1)
+        bucket_size = -(-len(y_array) // bucket_count)
+        bucket_count = -(-len(y_array) // bucket_size)
+        # The buckets are held in the rows of a 2D array. NaN values (and the padding of the last
+        # bucket) are never selected unless the whole bucket is NaN.
+        padded_array = np.full(bucket_count*bucket_size, np.nan)
+        padded_array[:len(y_array)] = y_array
+        nan_mask = np.isnan(padded_array)
+        min_array = np.where(nan_mask, np.inf, padded_array).reshape(bucket_count, bucket_size)
+        max_array = np.where(nan_mask, -np.inf, padded_array).reshape(bucket_count, bucket_size)
+        bucket_start_array = np.arange(bucket_count)*bucket_size
+        index_array = np.concatenate((bucket_start_array + np.argmin(min_array, axis=1),
+                                      bucket_start_array + np.argmax(max_array, axis=1)))
+        return np.unique(np.minimum(index_array, len(y_array) - 1))
+
+    @staticmethod
+    def GetLTTBIndexes(x_array, y_array, point_count):
+        """@brief Get the indexes of the points selected by the LTTB algorithm. The first and last points
+                  are always kept.
+           @param x_array A numpy array of the X values.
+           @param y_array A numpy array of the Y values.
+           @param point_count The max number of points to plot.
+           @return A numpy array of the indexes of the points to plot in ascending order."""
+        point_count = max(point_count, 3)
+        y_array = np.nan_to_num(y_array)
+        # The first and last points are held in their own buckets.
+        edges = np.linspace(1, len(y_array) - 1, point_count - 1).astype(np.int64)
+        index_array = np.empty(point_count, dtype=np.int64)
+        index_array[0] = 0
+        index_array[-1] = len(y_array) - 1
+        selected = 0
+        for bucket in range(point_count - 2):
+            start, stop = edges[bucket], edges[bucket + 1]
+            if bucket + 2 < len(edges):
+                next_start, next_stop = edges[bucket + 1], edges[bucket + 2]
+            else:
+                next_start, next_stop = len(y_array) - 1, len(y_array)
+            avg_x = x_array[next_start:next_stop].mean()
+            avg_y = y_array[next_start:next_stop].mean()
+            # Twice the area of each triangle formed with the selected point and the next bucket average.
+            area_array = np.abs((x_array[selected] - avg_x) * (y_array[start:stop] - y_array[selected]) -
+                                (x_array[selected] - x_array[start:stop]) * (avg_y - y_array[selected]))
+            selected = start + np.argmax(area_array)
+            index_array[bucket + 1] = selected
+        return index_array
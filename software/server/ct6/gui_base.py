@@ -42,6 +42,7 @@ class GUIBase(MultiAppServer):
     CMD_COMPLETE                = "CMD_COMPLETE"
     ENABLE_ACTION_BUTTONS       = "ENABLE_ACTION_BUTTONS"
     SUMMARY_ROW                 = "SUMMARY_ROW"
+    SUMMARY_ROW_LIST            = "SUMMARY_ROW_LIST"
     PEAK_KWH_RESULT             = "PEAK_KWH_RESULT"
 
     X_AXIS_NAME                 = "date"
@@ -55,6 +56,12 @@ class GUIBase(MultiAppServer):
     MINUTE_RESOLUTION           = 1
     HOUR_RESOLUTION             = 2
     DAY_RESOLUTION              = 3
+    RESOLUTION_NAME_LIST        = ("max", "minute", "hour", "day")
+
+    # The number of rows fetched from the database at a time.
+    READ_CHUNK_ROWS             = 10000
+    # The time between the read progress messages shown in the status line.
+    READ_PROGRESS_SECS          = 0.5
 
     TOOLS                       = "crosshair,pan,wheel_zoom,zoom_in,zoom_out,box_zoom,undo,redo,reset,tap,save,box_select,poly_select,lasso_select"
     TOOLBAR_LOCATION            = "below"
@@ -756,26 +763,30 @@ class GUIBase(MultiAppServer):
         self._replaceSummaryTableData(data)
 
     def _updateSummaryTable(self, rxDict):
-        """@brief Update a single row of the sensor summary table.
-           @brief rxDict The dict received from the _calcKWH() method"""
+        """@brief Update rows of the sensor summary table.
+           @brief rxDict The dict received from the _calcKWH() method. This holds a single row (SUMMARY_ROW)
+                         or a list of rows (SUMMARY_ROW_LIST)."""
         invertKw = self._invertKW()
+        rowList = list(rxDict.get(GUIBase.SUMMARY_ROW_LIST, []))
         if GUIBase.SUMMARY_ROW in rxDict:
-            row = rxDict[GUIBase.SUMMARY_ROW]
-            if len(row) == 5:
-                rowIndex = row[0]-1 # Row index is one less than the CT number
-                # Copy the existing columns so that we can replace the
-                # ColumnDataSource wholesale (see _replaceSummaryTableData).
-                data = {key: list(values) for key, values in self._summaryTableSource.data.items()}
-                data["sensor"][rowIndex] = f"{row[1]}"
-                data["total"][rowIndex]  = f"{row[2]:.2f}"
+            rowList.append(rxDict[GUIBase.SUMMARY_ROW])
+        rowList = [summaryRow for summaryRow in rowList if len(summaryRow) == 5]
+        if rowList:
+            # Copy the existing columns so that we can replace the
+            # ColumnDataSource wholesale (see _replaceSummaryTableData).
+            data = {key: list(values) for key, values in self._summaryTableSource.data.items()}
+            for summaryRow in rowList:
+                rowIndex = summaryRow[0]-1 # Row index is one less than the CT number
+                data["sensor"][rowIndex] = f"{summaryRow[1]}"
+                data["total"][rowIndex]  = f"{summaryRow[2]:.2f}"
                 if invertKw:
-                    data["negative"][rowIndex] = f"{row[3]:.2f}"
-                    data["positive"][rowIndex] = f"{row[4]:.2f}"
+                    data["negative"][rowIndex] = f"{summaryRow[3]:.2f}"
+                    data["positive"][rowIndex] = f"{summaryRow[4]:.2f}"
                 else:
-                    data["positive"][rowIndex] = f"{row[3]:.2f}"
-                    data["negative"][rowIndex] = f"{row[4]:.2f}"
+                    data["positive"][rowIndex] = f"{summaryRow[3]:.2f}"
+                    data["negative"][rowIndex] = f"{summaryRow[4]:.2f}"
 
-                self._replaceSummaryTableData(data)
+            self._replaceSummaryTableData(data)
 
     def _showStatus(self, statusID, line):
         """@brief Show Status messages
@@ -923,6 +934,19 @@ class GUIBase(MultiAppServer):
         msgDict[GUIBase.STATUS_MESSAGE]=msg
         self._commsQueue.put(msgDict)
 
+    def _sendReadProgress(self, resolution, rowCount, percent=None):
+        """@brief Show the progress of a database read in the status line.
+           @param resolution The resolution of the data being read.
+           @param rowCount The number of rows read.
+           @param percent The percentage of the time period read or None if not known."""
+        msg = f"Reading {GUIBase.RESOLUTION_NAME_LIST[resolution]} resolution data: {rowCount} values read"
+        if percent is not None:
+            msg += f" ({percent:.0f}%)"
+        msgDict = {}
+        msgDict[GUIBase.STATUS_LINE_INDEX]=0
+        msgDict[GUIBase.STATUS_MESSAGE]=msg + "..."
+        self._commsQueue.put(msgDict)
+
     def _sendEnableActionButtonsMsg(self, enabled):
         """@brief Send an enable update button message through the Queue into the GUI thread.
            @param enabled If True the button is enabled."""
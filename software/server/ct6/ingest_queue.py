@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import threading
+
+from time import time
+from collections import deque
+
+class IngestQueue(object):
+    """@brief Responsible for holding the dev_dicts received from CT6 units until they are stored
+              in the databases. The number of dev_dicts held in memory is limited. When the queue
+              is full one of the following policies is applied.
+              - BLOCK     The caller of put() blocks until there is space in the queue.
+              - COALESCE  Only the most recent dev_dict from each CT6 unit is kept.
+              - SPILL     dev_dicts are appended to a journal file. The journal is read back
+                          (replayed) once the dev_dicts in memory have been stored. The journal
+                          is also replayed at startup if it was not empty when the app stopped.
+              The dev_dicts replayed from the journal are only removed from it once commit_replay() is
+              called after they have been committed to the databases. Until the whole journal has been
+              committed the offset of the dev_dicts committed is saved in the <journal file>.offset file
+              so that they are not replayed again if the app stops."""
+
+    BLOCK = "block"
+    COALESCE = "coalesce"
+    SPILL = "spill"
+    POLICIES = (BLOCK, COALESCE, SPILL)
+
+    DEPTH = "DEPTH"
+    COALESCED_DEVICES = "COALESCED_DEVICES"
+    COALESCED_COUNT = "COALESCED_COUNT"
+    SPILL_COUNT = "SPILL_COUNT"
+    SPILL_BYTES = "SPILL_BYTES"
+    REPLAY_COUNT = "REPLAY_COUNT"
+    REPLAY_PER_SEC = "REPLAY_PER_SEC"
+
+    OFFSET_FILE_SUFFIX = ".offset"
+
+    def __init__(self, max_size, policy, journal_file, device_key, uio=None):
+        """@brief Constructor
+           @param max_size The max number of dev_dicts held in memory.
+           @param policy One of POLICIES. Applied when the queue is full.
+           @param journal_file The file used to hold spilled dev_dicts.
+           @param device_key The dev_dict key that identifies the CT6 unit (used to coalesce dev_dicts).
+           @param uio A UIO instance used to report problems with the journal or None."""
+        if policy not in IngestQueue.POLICIES:
+            raise Exception(f"{policy} is an invalid queue policy ({', '.join(IngestQueue.POLICIES)}).")
+        self._max_size = max_size
+        self._policy = policy
+        self._journal_file = journal_file
+        self._device_key = device_key
+        self._uio = uio
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._queue = deque()
+        self._coalesced_dict = {}
+        self._offset_file = journal_file + IngestQueue.OFFSET_FILE_SUFFIX
+        self._journal_writer = None
+        self._journal_read_offset = 0
+        # The offset of the end of the dev_dicts replayed that have been committed to the databases.
+        self._journal_commit_offset = 0
+        # True once all the dev_dicts in the journal have been replayed.
+        self._journal_replayed = False
+        # The number of dev_dicts spilled to the journal that have not been replayed. The journal is
+        # not read to count the dev_dicts left in it by a previous run.
+        self._journal_count = 0
+        # If the journal holds dev_dicts from a previous run they will be replayed.
+        self._journal_pending = False
+        if os.path.isfile(self._journal_file):
+            IngestQueue._RepairJournal(self._journal_file, self._uio)
+            self._journal_read_offset = IngestQueue._ReadCommitOffset(self._journal_file, self._uio)
+            self._journal_commit_offset = self._journal_read_offset
+            self._journal_pending = os.path.getsize(self._journal_file) > self._journal_read_offset
+            if not self._journal_pending:
+                self._remove_journal()
+        # The metrics are reset each time they are read.
+        self._metrics_start_time = time()
+        self._coalesced_count = 0
+        self._spill_count = 0
+        self._replay_count = 0
+
+    @staticmethod
+    def _Warn(uio, msg):
+        """@brief Report a problem with a journal.
+           @param uio A UIO instance or None.
+           @param msg The message text."""
+        if uio:
+            uio.warn(msg)
+
+    @staticmethod
+    def _RepairJournal(journal_file, uio):
+        """@brief Remove an incomplete dev_dict from the end of a journal file. This is left if the
+                  app stopped while it was being written. If it were left the next dev_dict spilled
+                  would be appended to it.
+           @param journal_file The journal file.
+           @param uio A UIO instance or None."""
+        with open(journal_file, 'rb+') as fd:
+            journal_size = fd.seek(0, os.SEEK_END)
+            # Search back from the end of the file for the end of the last complete line.
+            end = journal_size
+            while end > 0:
+                block_size = min(4096, end)
+                fd.seek(end - block_size)
+                index = fd.read(block_size).rfind(b"\n")
+                if index >= 0:
+                    end = end - block_size + index + 1
+                    break
+                end -= block_size
+            if end < journal_size:
+                fd.truncate(end)
+                IngestQueue._Warn(uio, f"Removed an incomplete line ({journal_size-end} bytes) from the end of {journal_file}")
+
+    @staticmethod
+    def _ReadCommitOffset(journal_file, uio):
+        """@param journal_file The journal file.
+           @param uio A UIO instance or None.
+           @return The offset of the end of the dev_dicts in the journal that were committed to the
+                   databases before the app stopped."""
+        offset_file = journal_file + IngestQueue.OFFSET_FILE_SUFFIX
+        commit_offset = 0
+        if os.path.isfile(offset_file):
+            try:
+                with open(offset_file, 'r') as fd:
+                    commit_offset = int(fd.read())
+            except (OSError, ValueError):
+                commit_offset = -1
+            if commit_offset < 0 or commit_offset > os.path.getsize(journal_file):
+                IngestQueue._Warn(uio, f"{offset_file} is invalid. {journal_file} will be replayed from the start.")
+                commit_offset = 0
+        return commit_offset
+
+    @staticmethod
+    def MoveJournal(journal_file, get_journal_file, uio=None):
+        """@brief Move the dev_dicts in a journal left by a previous run that have not been committed
+                  to the databases to other journals. The journal is then removed. This is required
+                  when the number of database writers (each of which has it's own journal) changes.
+                  This must be called before the IngestQueue instances of the other journals are created.
+           @param journal_file The journal file.
+           @param get_journal_file A function that is passed a dev_dict and returns the journal file
+                  it is moved to.
+           @param uio A UIO instance used to report problems with the journal or None.
+           @return The number of dev_dicts moved."""
+        move_count = 0
+        writer_dict = {}
+        try:
+            with open(journal_file, 'r') as fd:
+                fd.seek(IngestQueue._ReadCommitOffset(journal_file, uio))
+                for line in fd:
+                    # Skip an incomplete line (the app stopped while writing it).
+                    if not line.endswith("\n"):
+                        break
+                    try:
+                        dev_dict = json.loads(line)
+                    except ValueError:
+                        IngestQueue._Warn(uio, f"Skipped an invalid line in {journal_file}: {line.strip()[:80]}")
+                        continue
+                    _journal_file = get_journal_file(dev_dict)
+                    if _journal_file not in writer_dict:
+                        if os.path.isfile(_journal_file):
+                            IngestQueue._RepairJournal(_journal_file, uio)
+                        writer_dict[_journal_file] = open(_journal_file, 'a')
+                    writer_dict[_journal_file].write(line)
+                    move_count += 1
+
+        finally:
+            for writer in writer_dict.values():
+                writer.flush()
+                # Ensure the dev_dicts are held in the other journals before this one is removed.
+                os.fsync(writer.fileno())
+                writer.close()
+
+        for _file in (journal_file, journal_file + IngestQueue.OFFSET_FILE_SUFFIX):
+            if os.path.isfile(_file):
+                os.remove(_file)
+        return move_count
+
+    def _write_commit_offset(self):
+        """@brief Save the offset of the end of the dev_dicts replayed that have been committed to the databases.
+                  Called with the lock held."""
+        tmp_file = self._offset_file + ".tmp"
+        with open(tmp_file, 'w') as fd:
+            fd.write(str(self._journal_read_offset))
+        # Replace the file so that a partially written offset is never present.
+        os.replace(tmp_file, self._offset_file)
+        self._journal_commit_offset = self._journal_read_offset
+
+    def _remove_journal(self):
+        """@brief Remove the journal once all of it has been replayed and committed to the databases.
+                  Called with the lock held."""
+        if self._journal_writer:
+            self._journal_writer.close()
+            self._journal_writer = None
+        for _file in (self._journal_file, self._offset_file):
+            if os.path.isfile(_file):
+                os.remove(_file)
+        self._journal_read_offset = 0
+        self._journal_commit_offset = 0
+        self._journal_replayed = False
+        self._journal_pending = False
+        self._journal_count = 0
+
+    def put(self, dev_dict):
+        """@brief Add a dev_dict to the queue.
+           @param dev_dict The CT6 device dict."""
+        with self._lock:
+            # Once spilling has started dev_dicts are added to the journal until it has been
+            # replayed so that they are stored in the order they were received.
+            if self._journal_pending:
+                self._spill(dev_dict)
+
+            elif len(self._queue) < self._max_size:
+                self._queue.append(dev_dict)
+
+            elif self._policy == IngestQueue.BLOCK:
+                while len(self._queue) >= self._max_size:
+                    self._not_full.wait()
+                self._queue.append(dev_dict)
+
+            elif self._policy == IngestQueue.COALESCE:
+                if self._device_key in dev_dict:
+                    if dev_dict[self._device_key] in self._coalesced_dict:
+                        self._coalesced_count += 1
+                    self._coalesced_dict[dev_dict[self._device_key]] = dev_dict
+                else:
+                    self._coalesced_count += 1
+
+            else:
+                self._spill(dev_dict)
+
+    def _spill(self, dev_dict):
+        """@brief Append a dev_dict to the journal file. Called with the lock held.
+           @param dev_dict The CT6 device dict."""
+        if self._journal_writer is None:
+            self._journal_writer = open(self._journal_file, 'a')
+        self._journal_writer.write(json.dumps(dev_dict) + "\n")
+        # Flush so that the dev_dict is not lost if the app stops.
+        self._journal_writer.flush()
+        self._journal_pending = True
+        self._journal_replayed = False
+        self._journal_count += 1
+        self._spill_count += 1
+
+    def _replay(self, max_count):
+        """@brief Read dev_dicts from the journal file. Called with the lock held.
+           @param max_count The max number of dev_dicts to read.
+           @return A list of dev_dicts."""
+        dev_dict_list = []
+        if self._journal_writer:
+            self._journal_writer.flush()
+        with open(self._journal_file, 'r') as fd:
+            fd.seek(self._journal_read_offset)
+            while len(dev_dict_list) < max_count:
+                line = fd.readline()
+                # Stop at the end of the file or an incomplete line (the app stopped while writing it).
+                if not line.endswith("\n"):
+                    break
+                self._journal_read_offset = fd.tell()
+                try:
+                    dev_dict_list.append(json.loads(line))
+                except ValueError:
+                    IngestQueue._Warn(self._uio, f"Skipped an invalid line in {self._journal_file}: {line.strip()[:80]}")
+
+            journal_size = os.path.getsize(self._journal_file)
+
+        # The journal is removed by commit_replay() once the dev_dicts replayed have been committed.
+        self._journal_replayed = self._journal_read_offset >= journal_size
+        self._journal_count = max(self._journal_count - len(dev_dict_list), 0)
+        self._replay_count += len(dev_dict_list)
+        return dev_dict_list
+
+    def get_all(self):
+        """@brief Remove dev_dicts from the queue. If dev_dicts have been spilled then once those held
+                  in memory have been removed up to max_size dev_dicts are replayed from the journal.
+           @return A list of dev_dicts in the order they were received."""
+        with self._lock:
+            dev_dict_list = list(self._queue)
+            self._queue.clear()
+            if self._coalesced_dict:
+                dev_dict_list.extend(self._coalesced_dict.values())
+                self._coalesced_dict.clear()
+            if not dev_dict_list and self._journal_pending and not self._journal_replayed:
+                dev_dict_list = self._replay(self._max_size)
+            self._not_full.notify_all()
+        return dev_dict_list
+
+    def commit_replay(self):
+        """@brief Called once all the dev_dicts returned by get_all() have been committed to the databases.
+                  The dev_dicts replayed from the journal are then not replayed again if the app stops.
+                  Once the whole journal has been replayed and committed it is removed and the
+                  dev_dicts are held in memory again."""
+        with self._lock:
+            if self._journal_pending and self._journal_read_offset != self._journal_commit_offset:
+                if self._journal_replayed:
+                    self._remove_journal()
+                else:
+                    self._write_commit_offset()
+
+    def qsize(self):
+        """@return The number of dev_dicts in the queue, including those in the journal."""
+        with self._lock:
+            size = len(self._queue) + len(self._coalesced_dict)
+            if self._journal_pending and not self._journal_replayed:
+                # Don't read the journal to count the dev_dicts held in it.
+                size += max(self._journal_count, 1)
+            return size
+
+    def get_metrics(self):
+        """@brief Get the queue metrics recorded since this was last called.
+           @return A dict containing the metrics."""
+        with self._lock:
+            now = time()
+            period = now - self._metrics_start_time
+            spill_bytes = 0
+            if self._journal_pending:
+                spill_bytes = os.path.getsize(self._journal_file) - self._journal_read_offset
+            metrics_dict = {IngestQueue.DEPTH: len(self._queue),
+                            IngestQueue.COALESCED_DEVICES: len(self._coalesced_dict),
+                            IngestQueue.COALESCED_COUNT: self._coalesced_count,
+                            IngestQueue.SPILL_COUNT: self._spill_count,
+                            IngestQueue.SPILL_BYTES: spill_bytes,
+                            IngestQueue.REPLAY_COUNT: self._replay_count,
+                            IngestQueue.REPLAY_PER_SEC: 0.0}
+            if period > 0:
+                metrics_dict[IngestQueue.REPLAY_PER_SEC] = self._replay_count/period
+            self._metrics_start_time = now
+            self._coalesced_count = 0
+            self._spill_count = 0
+            self._replay_count = 0
+        return metrics_dict
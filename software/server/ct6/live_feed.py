@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import threading
+
+from collections import deque
+
+class LiveSubscription(object):
+    """@brief Holds the rows published to a subscriber of the LiveFeed until they are read."""
+
+    # The max number of rows held. If the rows are not read the oldest are discarded.
+    MAX_ROWS = 100000
+
+    def __init__(self, db_file):
+        """@brief Constructor.
+           @param db_file The database file subscribed to."""
+        self.db_file = db_file
+        self._row_deque = deque(maxlen=LiveSubscription.MAX_ROWS)
+
+    def add(self, table_name, row_list):
+        """@brief Add rows. Called from the thread that writes to the database.
+           @param table_name The table the rows were committed to.
+           @param row_list A list of the rows committed."""
+        self._row_deque.extend((table_name, row) for row in row_list)
+
+    def get_rows(self, table_name):
+        """@brief Get the rows added since the last call.
+           @param table_name The table of interest. Rows committed to other tables are discarded.
+           @return A list of the rows in the order they were committed."""
+        row_list = []
+        while self._row_deque:
+            _table_name, row = self._row_deque.popleft()
+            if _table_name == table_name:
+                row_list.append(row)
+        return row_list
+
+
+class LiveFeed(object):
+    """@brief Responsible for passing the rows committed to the databases to the GUI as they are
+              committed so that a plot of the current period can be extended without reading the
+              database again."""
+
+    def __init__(self):
+        """@brief Constructor."""
+        self._subscription_dict = {} # Holds a list of the LiveSubscription instances of each database file.
+        self._lock = threading.Lock()
+
+    def subscribe(self, db_file):
+        """@brief Subscribe to the rows committed to a database.
+           @param db_file The database file.
+           @return A LiveSubscription instance. unsubscribe() must be called when it is no longer required."""
+        subscription = LiveSubscription(db_file)
+        with self._lock:
+            self._subscription_dict.setdefault(db_file, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """@brief Stop the rows committed to a database being added to a subscription.
+           @param subscription The LiveSubscription returned by subscribe()."""
+        with self._lock:
+            subscription_list = self._subscription_dict.get(subscription.db_file, [])
+            if subscription in subscription_list:
+                subscription_list.remove(subscription)
+            if not subscription_list:
+                self._subscription_dict.pop(subscription.db_file, None)
+
+    def publish(self, db_file, table_name, row_list):
+        """@brief Pass rows that have been committed to the subscribers of a database.
+           @param db_file The database file.
+           @param table_name The table the rows were committed to.
+           @param row_list A list of the rows committed. Each row holds the values in the table column order."""
+        with self._lock:
+            for subscription in self._subscription_dict.get(db_file, []):
+                subscription.add(table_name, row_list)
+
+
+class LiveTail(object):
+    """@brief Holds the state of a plot that is extended with the rows received from the LiveFeed."""
+
+    __slots__ = ("subscription", "table_name", "stop_timestamp", "last_timestamp", "trace_list", "rollover")
+
+    def __init__(self, subscription, table_name, stop_timestamp, last_timestamp, trace_list, rollover):
+        """@brief Constructor.
+           @param subscription The LiveSubscription of the database plotted.
+           @param table_name The table plotted.
+           @param stop_timestamp The end of the period plotted (milliseconds since the epoch).
+           @param last_timestamp The TIMESTAMP of the last row plotted. Rows up to this time are not added.
+           @param trace_list A list of the (trace key, column index, scale, step unit) tuples of the traces plotted.
+           @param rollover The max number of points in each trace."""
+        self.subscription = subscription
+        self.table_name = table_name
+        self.stop_timestamp = stop_timestamp
+        self.last_timestamp = last_timestamp
+        self.trace_list = trace_list
+        self.rollover = rollover
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+import os
+import stat
+import sqlite3
+import pathlib
+
+from time import mktime
+from datetime import datetime
+
+class PartitionRouter(object):
+    """@brief Responsible for locating the monthly partition files that hold the max resolution rows
+              (CT6_SENSOR table) of a CT6 database and attaching those that a query needs.
+              The partitions of <ASSY>.db are held in the <ASSY>_partitions folder, one file per
+              month (YYYY_MM.db). Rows received for a month whose partition has closed are stored in
+              the CT6_SENSOR table of the main database, which is always included in a query.
+              Once the ct6_app has moved on to the next month a partition is closed. It is checkpointed,
+              taken out of WAL mode and made read only. Closed partitions are attached with immutable=1
+              so sqlite does not lock them. They may be moved to slower storage (leaving a symlink)
+              without affecting the ct6_app."""
+
+    FOLDER_SUFFIX = "_partitions"
+    SCHEMA_PREFIX = "P_"
+    # sqlite limits the number of attached databases (10 by default). Queries that span more
+    # partitions than this are executed in several steps.
+    MAX_ATTACHED = 8
+
+    @staticmethod
+    def GetPartitionFolder(db_file):
+        """@param db_file The main database file.
+           @return The folder holding the partitions of the database."""
+        db_path = pathlib.Path(db_file)
+        return str(db_path.parent / (db_path.stem + PartitionRouter.FOLDER_SUFFIX))
+
+    @staticmethod
+    def GetPartitionName(_datetime):
+        """@param _datetime A datetime instance holding the local time.
+           @return The name of the partition (YYYY_MM) holding the time."""
+        return _datetime.strftime("%Y_%m")
+
+    @staticmethod
+    def GetPartitionFile(db_file, partition_name):
+        """@param db_file The main database file.
+           @param partition_name The name of the partition.
+           @return The partition file."""
+        return os.path.join(PartitionRouter.GetPartitionFolder(db_file), partition_name + ".db")
+
+    @staticmethod
+    def GetMonthRange(partition_name):
+        """@param partition_name The name of the partition.
+           @return A tuple holding the start of the month and the start of the next month (milliseconds since the epoch)."""
+        year, month = [int(value) for value in partition_name.split("_")]
+        start = datetime(year, month, 1)
+        if month == 12:
+            stop = datetime(year+1, 1, 1)
+        else:
+            stop = datetime(year, month+1, 1)
+        return (int(mktime(start.timetuple()))*1000, int(mktime(stop.timetuple()))*1000)
+
+    @staticmethod
+    def IsClosed(partition_file):
+        """@param partition_file The partition file.
+           @return True if the partition has been closed."""
+        return not os.stat(partition_file).st_mode & stat.S_IWUSR
+
+    @staticmethod
+    def Close(partition_file):
+        """@brief Close a partition. The ct6_app must have closed it's connection to the partition.
+           @param partition_file The partition file.
+           @return True if the partition was closed. False if it could not be closed because another
+                   connection (e.g. the GUI or an export) has it open. The caller should try again later."""
+        # Don't wait for other connections to close the partition.
+        conn = sqlite3.connect(partition_file, timeout=0)
+        try:
+            # Move all the rows into the database file so that it can be read without the WAL file.
+            busy = conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchone()[0]
+            if busy:
+                return False
+            journal_mode = conn.execute("PRAGMA journal_mode=DELETE;").fetchone()[0]
+            if journal_mode.lower() != "delete":
+                return False
+
+        except sqlite3.OperationalError as ex:
+            if "locked" not in str(ex) and "busy" not in str(ex):
+                raise
+            return False
+
+        finally:
+            conn.close()
+        os.chmod(partition_file, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        return True
+
+    def __init__(self, db_file):
+        """@brief Constructor
+           @param db_file The main database file."""
+        self._db_file = db_file
+        self._attached_list = []
+
+    def get_partition_list(self, start=None, stop=None):
+        """@brief Get the partitions holding rows in a period of time.
+           @param start The start of the period (milliseconds since the epoch) or None if unlimited.
+           @param stop The end of the period (milliseconds since the epoch, not included) or None if unlimited.
+           @return A list of partition names in time order."""
+        partition_list = []
+        partition_folder = PartitionRouter.GetPartitionFolder(self._db_file)
+        if os.path.isdir(partition_folder):
+            for entry in sorted(os.listdir(partition_folder)):
+                if entry.endswith(".db"):
+                    partition_name = entry[:-3]
+                    month_start, month_stop = PartitionRouter.GetMonthRange(partition_name)
+                    if (start is None or month_stop > start) and (stop is None or month_start < stop):
+                        partition_list.append(partition_name)
+        return partition_list
+
+    def attach(self, conn, partition_list, immutable=True):
+        """@brief Attach partitions to a connection to the main database.
+           @param conn The connection to the main database.
+           @param partition_list The names of the partitions to attach.
+           @param immutable If True the connection must have been opened with uri=True. The partitions are
+                            opened read only and closed partitions are opened with immutable=1.
+                            If False the partitions are attached using their file name."""
+        for partition_name in partition_list:
+            partition_file = PartitionRouter.GetPartitionFile(self._db_file, partition_name)
+            if immutable:
+                partition_uri = pathlib.Path(partition_file).absolute().as_uri() + "?mode=ro"
+                if PartitionRouter.IsClosed(partition_file):
+                    partition_uri += "&immutable=1"
+            else:
+                partition_uri = partition_file
+            schema_name = PartitionRouter.SCHEMA_PREFIX + partition_name
+            conn.execute(f"ATTACH DATABASE ? AS {schema_name};", (partition_uri,))
+            self._attached_list.append(schema_name)
+
+    def detach(self, conn):
+        """@brief Detach all the partitions attached to a connection.
+           @param conn The connection to the main database."""
+        for schema_name in self._attached_list:
+            conn.execute(f"DETACH DATABASE {schema_name};")
+        self._attached_list = []
+
+    def get_select_sql(self, table_name, columns, where, include_main=True):
+        """@brief Get the SQL that selects rows from the main database and the attached partitions.
+           @param table_name The name of the table.
+           @param columns The comma separated columns to select.
+           @param where The WHERE clause applied to each table.
+           @param include_main If False only the attached partitions are selected from.
+           @return The SQL SELECT statement. The parameters in the where clause must be named
+                   as they are used once per table."""
+        select_list = []
+        schema_list = list(self._attached_list)
+        if include_main:
+            schema_list.insert(0, "main")
+        for schema_name in schema_list:
+            select_list.append(f"SELECT {columns} FROM {schema_name}.{table_name} WHERE {where}")
+        return " UNION ALL ".join(select_list)
+
+    def _get_partition_groups(self, start, stop):
+        """@param start The start of the period (milliseconds since the epoch) or None if unlimited.
+           @param stop The end of the period (milliseconds since the epoch, not included) or None if unlimited.
+           @return A list of the lists of partitions that are attached together. The list always
+                   holds at least one list so that the main database is read."""
+        partition_list = self.get_partition_list(start, stop)
+        group_list = [partition_list[index:index+PartitionRouter.MAX_ATTACHED] for index in range(0, len(partition_list), PartitionRouter.MAX_ATTACHED)]
+        return group_list or [[]]
+
+    def fetch_all(self, conn, table_name, columns, where, params, start, stop, immutable=True):
+        """@brief Read rows from the main database and the partitions holding rows in a period of time.
+           @param conn The connection to the main database.
+           @param table_name The name of the table.
+           @param columns The comma separated columns to select. The first column must be the TIMESTAMP.
+           @param where The WHERE clause (named parameters) that selects the rows in the period.
+           @param params A dict holding the WHERE clause parameters.
+           @param start The start of the period (milliseconds since the epoch) or None if unlimited.
+           @param stop The end of the period (milliseconds since the epoch, not included) or None if unlimited.
+           @param immutable See attach().
+           @return A list of rows in TIMESTAMP order."""
+        row_list = []
+        group_list = self._get_partition_groups(start, stop)
+        for index, partition_list in enumerate(group_list):
+            self.attach(conn, partition_list, immutable=immutable)
+            try:
+                select_sql = self.get_select_sql(table_name, columns, where, include_main=index == 0)
+                if len(group_list) == 1:
+                    row_list.extend(conn.execute(f"{select_sql} ORDER BY 1;", params).fetchall())
+                else:
+                    row_list.extend(conn.execute(select_sql + ";", params).fetchall())
+
+            finally:
+                self.detach(conn)
+        # The rows read in each step are only sorted together here.
+        if len(group_list) > 1:
+            row_list.sort(key=lambda row: row[0])
+        return row_list
+
+    def fetch_chunks(self, conn, table_name, columns, where, params, start, stop, chunk_rows, immutable=True):
+        """@brief Read rows from the main database and the partitions holding rows in a period of time
+                  in chunks. Unlike fetch_all() the caller may stop reading before all the rows are read
+                  and only chunk_rows rows are held in memory at a time. The generator must be closed (or
+                  exhausted) before the connection is used again so that the partitions are detached.
+           @param conn The connection to the main database.
+           @param table_name The name of the table.
+           @param columns The comma separated columns to select. The first column must be the TIMESTAMP.
+           @param where The WHERE clause (named parameters) that selects the rows in the period.
+           @param params A dict holding the WHERE clause parameters.
+           @param start The start of the period (milliseconds since the epoch) or None if unlimited.
+           @param stop The end of the period (milliseconds since the epoch, not included) or None if unlimited.
+           @param chunk_rows The max number of rows in each chunk.
+           @param immutable See attach().
+           @return A generator of lists of rows in TIMESTAMP order."""
+        group_list = self._get_partition_groups(start, stop)
+        # The main database is read with each group of partitions but only the rows in the months of the
+        # group are selected so that each group is read in TIMESTAMP order after the previous group.
+        boundary_list = [None] + [PartitionRouter.GetMonthRange(partition_list[0])[0] for partition_list in group_list[1:]] + [None]
+        for index, partition_list in enumerate(group_list):
+            group_where = where
+            group_params = dict(params)
+            if boundary_list[index] is not None:
+                group_where += " AND TIMESTAMP >= :group_start"
+                group_params["group_start"] = boundary_list[index]
+            if boundary_list[index+1] is not None:
+                group_where += " AND TIMESTAMP < :group_stop"
+                group_params["group_stop"] = boundary_list[index+1]
+            self.attach(conn, partition_list, immutable=immutable)
+            cursor = None
+            try:
+                select_sql = self.get_select_sql(table_name, columns, group_where)
+                cursor = conn.execute(f"{select_sql} ORDER BY 1;", group_params)
+                while True:
+                    row_list = cursor.fetchmany(chunk_rows)
+                    if not row_list:
+                        break
+                    yield row_list
+
+            finally:
+                # The partitions can't be detached while the statement is active.
+                if cursor:
+                    cursor.close()
+                self.detach(conn)
+
+    def count(self, conn, table_name, where, params, start, stop, immutable=True):
+        """@brief Count the rows in the main database and the partitions holding rows in a period of time.
+           @param conn The connection to the main database.
+           @param table_name The name of the table.
+           @param where The WHERE clause (named parameters) that selects the rows in the period.
+           @param params A dict holding the WHERE clause parameters.
+           @param start The start of the period (milliseconds since the epoch) or None if unlimited.
+           @param stop The end of the period (milliseconds since the epoch, not included) or None if unlimited.
+           @param immutable See attach().
+           @return The number of rows."""
+        row_count = 0
+        for index, partition_list in enumerate(self._get_partition_groups(start, stop)):
+            self.attach(conn, partition_list, immutable=immutable)
+            try:
+                select_sql = self.get_select_sql(table_name, "COUNT(*) AS ROW_COUNT", where, include_main=index == 0)
+                row_count += conn.execute(f"SELECT TOTAL(ROW_COUNT) FROM ({select_sql});", params).fetchone()[0]
+
+            finally:
+                self.detach(conn)
+        return int(row_count)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import threading
+
+from collections import OrderedDict
+
+class CacheEntry(object):
+    """@brief Holds a single query result held in the QueryCache."""
+
+    __slots__ = ("value", "size", "watermark", "immutable")
+
+    def __init__(self, value, size, watermark, immutable):
+        """@brief Constructor.
+           @param value The query result.
+           @param size The number of bytes used by the query result.
+           @param watermark The ingest watermark of the database when the query was executed.
+           @param immutable True if the rows in the period of the query can no longer change."""
+        self.value = value
+        self.size = size
+        self.watermark = watermark
+        self.immutable = immutable
+
+
+class QueryCache(object):
+    """@brief Responsible for holding the results of recent database queries so that the same period is
+              not read again when the user returns to it. The least recently used results are removed
+              when the memory used exceeds the limit.
+              - Results of periods that can no longer change are held until they are removed to free memory.
+              - Other results are only returned while the ingest watermark of the database (which changes
+                each time rows are committed to it) is the same as when they were read."""
+
+    def __init__(self, max_bytes):
+        """@brief Constructor
+           @param max_bytes The max number of bytes of query results held. 0 disables the cache."""
+        self._max_bytes = max_bytes
+        self._entry_dict = OrderedDict()
+        self._size = 0
+        self._hit_count = 0
+        self._miss_count = 0
+        # The database is read by a thread started for each query.
+        self._lock = threading.Lock()
+
+    def get(self, key, watermark):
+        """@brief Get a query result.
+           @param key The key of the query.
+           @param watermark The current ingest watermark of the database.
+           @return The query result or None if not held."""
+        with self._lock:
+            entry = self._entry_dict.get(key)
+            if entry is not None and not entry.immutable and entry.watermark != watermark:
+                # Rows have been committed since the query was executed.
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._miss_count += 1
+                return None
+            self._entry_dict.move_to_end(key)
+            self._hit_count += 1
+            return entry.value
+
+    def put(self, key, value, size, watermark, immutable):
+        """@brief Add a query result.
+           @param key The key of the query.
+           @param value The query result.
+           @param size The number of bytes used by the query result.
+           @param watermark The ingest watermark of the database when the query was executed.
+           @param immutable True if the rows in the period of the query can no longer change."""
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._entry_dict:
+                self._remove(key)
+            self._entry_dict[key] = CacheEntry(value, size, watermark, immutable)
+            self._size += size
+            while self._size > self._max_bytes:
+                self._remove(next(iter(self._entry_dict)))
+
+    def get_stats_text(self):
+        """@return A description of the cache usage."""
+        with self._lock:
+            return f"{len(self._entry_dict)} results ({self._size/1E6:.1f} of {self._max_bytes/1E6:.1f} MB), {self._hit_count} hits, {self._miss_count} misses."
+
+    def _remove(self, key):
+        """@brief Remove a query result. The lock must be held.
+           @param key The key of the query."""
+        entry = self._entry_dict.pop(key)
+        self._size -= entry.size
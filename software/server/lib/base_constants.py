@@ -224,6 +224,10 @@ class BaseConstants(object):
     LOW_RES_DATA_TABLE_LIST = [MINUTE_RES_DB_DATA_TABLE_NAME,
                                HOUR_RES_DB_DATA_TABLE_NAME,
                                DAY_RES_DB_DATA_TABLE_NAME]
+    # Holds the state of the minute, hour and day rollups so they can be resumed when the ct6_app restarts.
+    ROLLUP_STATE_TABLE_NAME             = 'CT6_ROLLUP_STATE'
+    # Holds the gaps in the data received from a CT6 unit (E.G network or power outages).
+    GAP_TABLE_NAME                      = 'CT6_GAP'
 
     # Used by ct6_app to save to sqlite databases.
     CT6_DB_META_TABLE_SCHEMA_SQLITE  = "ID INTEGER PRIMARY KEY, " \
@@ -236,6 +240,12 @@ class BaseConstants(object):
                                       f"{CT5_NAME} VARCHAR(64), " \
                                       f"{CT6_NAME} VARCHAR(64)"
 
+    # Used by ct6_app to save to sqlite databases.
+    CT6_DB_ROLLUP_STATE_TABLE_SCHEMA_SQLITE = "ID INTEGER PRIMARY KEY, STATE TEXT"
+
+    # Used by ct6_app to save to sqlite databases. The TIMESTAMP of the last row before and the first row after each gap.
+    CT6_DB_GAP_TABLE_SCHEMA_SQLITE = "GAP_START INTEGER PRIMARY KEY, GAP_STOP INTEGER"
+
     # Used by ct6_app to save to sqlite databases.
     CT6_DB_TABLE_SCHEMA_SQLITE   = "TIMESTAMP:TEXT " \
                                    "{}:REAL " \
@@ -294,6 +304,34 @@ class BaseConstants(object):
                                                           TEMPERATURE,
                                                           RSSI_DBM)
 
+    # The same table schema but the TIMESTAMP is held as milliseconds since the epoch.
+    CT6_DB_TABLE_SCHEMA_SQLITE_V1 = CT6_DB_TABLE_SCHEMA_SQLITE.replace("TIMESTAMP:TEXT", "TIMESTAMP:INTEGER", 1)
+
+    # The energy (Wh) imported (positive power) and exported (negative power, held as a negative value)
+    # by each CT during each minute, hour or day.
+    CT1_IMPORT_WH = "CT1_IMPORT_WH"
+    CT2_IMPORT_WH = "CT2_IMPORT_WH"
+    CT3_IMPORT_WH = "CT3_IMPORT_WH"
+    CT4_IMPORT_WH = "CT4_IMPORT_WH"
+    CT5_IMPORT_WH = "CT5_IMPORT_WH"
+    CT6_IMPORT_WH = "CT6_IMPORT_WH"
+    CT1_EXPORT_WH = "CT1_EXPORT_WH"
+    CT2_EXPORT_WH = "CT2_EXPORT_WH"
+    CT3_EXPORT_WH = "CT3_EXPORT_WH"
+    CT4_EXPORT_WH = "CT4_EXPORT_WH"
+    CT5_EXPORT_WH = "CT5_EXPORT_WH"
+    CT6_EXPORT_WH = "CT6_EXPORT_WH"
+    # The power column and the import and export energy columns of each CT.
+    CT_ENERGY_COLUMN_LIST = ((CT1_ACT_WATTS, CT1_IMPORT_WH, CT1_EXPORT_WH),
+                             (CT2_ACT_WATTS, CT2_IMPORT_WH, CT2_EXPORT_WH),
+                             (CT3_ACT_WATTS, CT3_IMPORT_WH, CT3_EXPORT_WH),
+                             (CT4_ACT_WATTS, CT4_IMPORT_WH, CT4_EXPORT_WH),
+                             (CT5_ACT_WATTS, CT5_IMPORT_WH, CT5_EXPORT_WH),
+                             (CT6_ACT_WATTS, CT6_IMPORT_WH, CT6_EXPORT_WH))
+
+    # The minute, hour and day tables also hold the energy columns.
+    CT6_DB_ROLLUP_TABLE_SCHEMA_SQLITE_V2 = CT6_DB_TABLE_SCHEMA_SQLITE_V1 + "".join([f" {import_col}:REAL {export_col}:REAL" for _, import_col, export_col in CT_ENERGY_COLUMN_LIST])
+
     # Used by ct6_app to read from sqlite databases.
     TIMESTAMP_INDEX = 0
 
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+import psutil
+import objgraph
+
+from time import perf_counter, sleep
+
+class TimingStats(object):
+    """@brief Responsible for holding the stats of a set of measured times."""
+
+    __slots__ = ("count", "total_secs", "max_secs")
+
+    def __init__(self):
+        """@brief Constructor."""
+        self.count = 0
+        self.total_secs = 0.0
+        self.max_secs = 0.0
+
+    def add(self, secs):
+        """@brief Add a measured time.
+           @param secs The time in seconds."""
+        self.count += 1
+        self.total_secs += secs
+        if secs > self.max_secs:
+            self.max_secs = secs
+
+    def __str__(self):
+        return f"count={self.count}, mean={(self.total_secs/self.count)*1000:.3f} MS, max={self.max_secs*1000:.3f} MS"
+
+
+class Span(object):
+    """@brief A context manager that records the time taken to execute a block of code."""
+
+    __slots__ = ("_instrumentation", "_name", "_start_time")
+
+    def __init__(self, instrumentation, name):
+        """@brief Constructor.
+           @param instrumentation The Instrumentation instance to record the time in.
+           @param name The name of the span."""
+        self._instrumentation = instrumentation
+        self._name = name
+        self._start_time = None
+
+    def __enter__(self):
+        self._start_time = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._instrumentation.observe(self._name, perf_counter() - self._start_time)
+        return False
+
+
+class NullSpan(object):
+    """@brief A context manager that does nothing. Used when instrumentation is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class NullInstrumentation(object):
+    """@brief Has the same interface as Instrumentation but does nothing."""
+
+    NULL_SPAN = NullSpan()
+
+    def span(self, name):
+        return NullInstrumentation.NULL_SPAN
+
+    def observe(self, name, secs):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def start(self):
+        pass
+
+    def sample(self):
+        pass
+
+
+class Instrumentation(object):
+    """@brief Responsible for recording the time taken by the code (spans), counting events and
+              periodically reporting these along with the CPU and memory usage. Nothing is reported
+              per event, only when sample() is called."""
+
+    DEFAULT_SAMPLE_SECS = 60
+
+    @staticmethod
+    def Create(uio, enabled, sample_secs=DEFAULT_SAMPLE_SECS, object_census=True):
+        """@brief Create an instrumentation instance.
+           @param uio A UIO instance used to report the stats as debug messages.
+           @param enabled If False an instance that does nothing is returned.
+           @param sample_secs The period in seconds at which the stats are reported.
+           @param object_census If True report the most common python object types when sampled.
+                  This is expensive as it visits every object tracked by the garbage collector.
+           @return An Instrumentation or NullInstrumentation instance."""
+        if enabled:
+            return Instrumentation(uio, sample_secs=sample_secs, object_census=object_census)
+        return NullInstrumentation()
+
+    def __init__(self, uio, sample_secs=DEFAULT_SAMPLE_SECS, object_census=True):
+        """@brief Constructor
+           @param uio A UIO instance.
+           @param sample_secs The period in seconds at which the stats are reported.
+           @param object_census If True report the most common python object types when sampled."""
+        self._uio = uio
+        self._sample_secs = sample_secs
+        self._object_census = object_census
+        self._lock = threading.Lock()
+        self._timing_stats_dict = {}
+        self._counter_dict = {}
+        self._sampler_thread = None
+
+    def span(self, name):
+        """@brief Get a context manager that records the time taken to execute a block of code.
+           @param name The name of the span.
+           @return A Span instance."""
+        return Span(self, name)
+
+    def observe(self, name, secs):
+        """@brief Record a measured time.
+           @param name The name of the measurement.
+           @param secs The time in seconds."""
+        with self._lock:
+            timing_stats = self._timing_stats_dict.get(name)
+            if timing_stats is None:
+                timing_stats = TimingStats()
+                self._timing_stats_dict[name] = timing_stats
+            timing_stats.add(secs)
+
+    def count(self, name, value=1):
+        """@brief Increment a counter.
+           @param name The name of the counter.
+           @param value The value to add to the counter."""
+        with self._lock:
+            self._counter_dict[name] = self._counter_dict.get(name, 0) + value
+
+    def start(self):
+        """@brief Start a thread that calls sample() periodically."""
+        if self._sampler_thread is None:
+            self._sampler_thread = threading.Thread(target=self._sampler)
+            self._sampler_thread.daemon = True
+            self._sampler_thread.start()
+
+    def _sampler(self):
+        """@brief Periodically report the stats."""
+        while True:
+            sleep(self._sample_secs)
+            try:
+                self.sample()
+            except Exception as ex:
+                self._uio.error(str(ex))
+
+    def sample(self):
+        """@brief Report the CPU/memory usage and the spans and counters recorded since the last sample."""
+        with self._lock:
+            timing_stats_dict = self._timing_stats_dict
+            counter_dict = self._counter_dict
+            self._timing_stats_dict = {}
+            self._counter_dict = {}
+
+        for name in sorted(timing_stats_dict):
+            self._uio.debug(f"SPAN: {name: <30} {timing_stats_dict[name]}")
+
+        for name in sorted(counter_dict):
+            self._uio.debug(f"COUNTER: {name: <27} {counter_dict[name]}")
+
+        _, _, load15 = psutil.getloadavg()
+        loadAvg = (load15/os.cpu_count()) * 100
+        virtual_memory = psutil.virtual_memory()
+        usedMB = virtual_memory.used/1000000
+        freeMB = virtual_memory.free/1000000
+        self._uio.debug(f"CPU Load AVG: {loadAvg:.1f}, Used Mem (MB): {usedMB:.1f} Free Mem (MB): {freeMB:.1f}")
+
+        if self._object_census:
+            objList = objgraph.most_common_types()
+            for elemList in objList:
+                _type = elemList[0]
+                _count = elemList[1]
+                self._uio.debug(f"Found {_count: <8.0f} object of type {_type}")
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+from array import array
+from datetime import datetime, timedelta
+
+class MeanBucket(object):
+    """@brief Responsible for holding the running sums of the records in a single minute, hour or day
+              so that the mean can be calculated when the bucket closes. The memory used does not
+              depend on the number of records added."""
+
+    # The same as BaseConstants.TIMESTAMP. It is not imported so that this module does not depend
+    # on the lib package and can be tested on its own.
+    TIMESTAMP = "TIMESTAMP"
+
+    __slots__ = ("count", "first_timestamp", "_timestamp_offset_sum", "_keys", "_sums")
+
+    def __init__(self):
+        """@brief Constructor."""
+        self.count = 0
+        self.first_timestamp = None
+        self._timestamp_offset_sum = 0.0
+        self._keys = None
+        self._sums = None
+
+    def add(self, record):
+        """@brief Add a record to the bucket.
+           @param record A dict containing the TIMESTAMP (a datetime instance) and numeric values."""
+        timestamp = record[MeanBucket.TIMESTAMP]
+        if self.count == 0:
+            if self._keys is None:
+                self._keys = tuple(key for key in record if key != MeanBucket.TIMESTAMP)
+            self.first_timestamp = timestamp
+            self._timestamp_offset_sum = 0.0
+            self._sums = array('d', [record[key] for key in self._keys])
+
+        else:
+            # Sum the offset from the first timestamp to retain us resolution in the mean timestamp.
+            self._timestamp_offset_sum += (timestamp - self.first_timestamp).total_seconds()
+            sums = self._sums
+            index = 0
+            for key in self._keys:
+                sums[index] += record[key]
+                index += 1
+
+        self.count += 1
+
+    def restart(self, record):
+        """@brief Empty the bucket and add a record to it.
+           @param record The first record of the next bucket."""
+        self.count = 0
+        self.add(record)
+
+    def get_mean(self):
+        """@return A dict containing the mean of each value in the bucket, including the TIMESTAMP."""
+        mean_dict = {MeanBucket.TIMESTAMP: self.first_timestamp + timedelta(seconds=self._timestamp_offset_sum/self.count)}
+        index = 0
+        for key in self._keys:
+            mean_dict[key] = self._sums[index]/self.count
+            index += 1
+        return mean_dict
+
+    def get_state(self):
+        """@return A list holding the state of the bucket. This can be converted to JSON."""
+        first_timestamp = None
+        if self.first_timestamp is not None:
+            first_timestamp = self.first_timestamp.isoformat()
+        keys = None
+        if self._keys is not None:
+            keys = list(self._keys)
+        sums = None
+        if self._sums is not None:
+            sums = self._sums.tolist()
+        return [self.count, first_timestamp, self._timestamp_offset_sum, keys, sums]
+
+    def set_state(self, state):
+        """@brief Restore the state of the bucket.
+           @param state A list returned by get_state()."""
+        count, first_timestamp, timestamp_offset_sum, keys, sums = state
+        self.count = count
+        self.first_timestamp = None
+        if first_timestamp is not None:
+            self.first_timestamp = datetime.fromisoformat(first_timestamp)
+        self._timestamp_offset_sum = timestamp_offset_sum
+        self._keys = None
+        if keys is not None:
+            self._keys = tuple(keys)
+        self._sums = None
+        if sums is not None:
+            self._sums = array('d', sums)
+
+
+class RollupAccumulator(object):
+    """@brief Responsible for calculating the records of the minute, hour and day tables from the
+              records received from a single CT6 unit.
+              - The minute record is the mean of all records received in the minute.
+              - The hour record is the mean of the first record received in each minute.
+              - The day record is the mean of the first record received in each hour.
+              The energy (Wh) imported and exported may also be calculated. The power in each record is
+              taken to have been present since the previous record. Each record is added to the energy
+              of the minute, hour and day it opens or is in. No energy is added for a time since the
+              previous record longer than the max energy interval as the power during it is unknown
+              (e.g. the CT6 unit was offline). The energy of a minute with too few records
+              is added to the next minute so that the energy of the minutes in an hour or day adds up to
+              the energy of the hour or day."""
+
+    MINUTE_INDEX = 0
+    HOUR_INDEX = 1
+    DAY_INDEX = 2
+
+    # We may get two readings in the same second (microseconds apart) but we don't want to add
+    # data to the database unless it's valid. We should have 60 second values in a minute but this
+    # will vary as poll/response and network delays to-from the CT6 device may move the sampling times.
+    MIN_MINUTE_RECORD_COUNT = 3
+
+    __slots__ = ("_buckets", "_energy_column_list", "_max_energy_secs", "_energy_sums", "last_timestamp")
+
+    @staticmethod
+    def GetBucketStart(timestamp, index):
+        """@param timestamp A datetime instance.
+           @param index MINUTE_INDEX, HOUR_INDEX or DAY_INDEX.
+           @return The start of the minute, hour or day containing the timestamp."""
+        if index == RollupAccumulator.MINUTE_INDEX:
+            return timestamp.replace(second=0, microsecond=0)
+        if index == RollupAccumulator.HOUR_INDEX:
+            return timestamp.replace(minute=0, second=0, microsecond=0)
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def __init__(self, energy_column_list=(), max_energy_secs=None):
+        """@brief Constructor.
+           @param energy_column_list A list of (power key, import energy key, export energy key) tuples.
+                  The import and export energy keys are added to the mean records of the closed buckets.
+           @param max_energy_secs The max time (seconds) since the previous record for which energy is added.
+                  If None energy is added for any time since the previous record."""
+        self._buckets = (MeanBucket(), MeanBucket(), MeanBucket())
+        self._energy_column_list = tuple(energy_column_list)
+        self._max_energy_secs = max_energy_secs
+        # The import and export Wh of each power key in the minute, hour and day buckets.
+        self._energy_sums = tuple(array('d', [0.0]*(len(self._energy_column_list)*2)) for _ in self._buckets)
+        # The TIMESTAMP of the last record added.
+        self.last_timestamp = None
+
+    def add(self, record):
+        """@brief Add a record received from a CT6 unit.
+           @param record A dict containing the TIMESTAMP (a datetime instance) and numeric values.
+           @return A list of (index, mean record) tuples for each bucket that closed. The index is
+                   MINUTE_INDEX, HOUR_INDEX or DAY_INDEX."""
+        closed_list = []
+        timestamp = record[MeanBucket.TIMESTAMP]
+        elapsed_hours = None
+        if self._energy_column_list and self.last_timestamp is not None:
+            elapsed_secs = (timestamp - self.last_timestamp).total_seconds()
+            if self._max_energy_secs is None or elapsed_secs <= self._max_energy_secs:
+                elapsed_hours = elapsed_secs/3600.0
+        self.last_timestamp = timestamp
+        minute_bucket, hour_bucket, day_bucket = self._buckets
+        # The start of each bucket is compared rather than the minute, hour or day value so that a bucket
+        # restored after the app was stopped for a day or more is not merged with the records received
+        # at the same time of a later day.
+        # If we've moved into the next minute
+        if minute_bucket.count > 0 and RollupAccumulator.GetBucketStart(timestamp, RollupAccumulator.MINUTE_INDEX) != RollupAccumulator.GetBucketStart(minute_bucket.first_timestamp, RollupAccumulator.MINUTE_INDEX):
+            if minute_bucket.count >= RollupAccumulator.MIN_MINUTE_RECORD_COUNT:
+                closed_list.append((RollupAccumulator.MINUTE_INDEX, minute_bucket.get_mean()))
+                minute_bucket.restart(record)
+
+                # If we've moved into the next hour
+                if hour_bucket.count > 0 and RollupAccumulator.GetBucketStart(timestamp, RollupAccumulator.HOUR_INDEX) != RollupAccumulator.GetBucketStart(hour_bucket.first_timestamp, RollupAccumulator.HOUR_INDEX):
+                    closed_list.append((RollupAccumulator.HOUR_INDEX, hour_bucket.get_mean()))
+                    hour_bucket.restart(record)
+
+                    # If we've moved into the next day
+                    if day_bucket.count > 0 and timestamp.date() != day_bucket.first_timestamp.date():
+                        closed_list.append((RollupAccumulator.DAY_INDEX, day_bucket.get_mean()))
+                        day_bucket.restart(record)
+
+                    else:
+                        day_bucket.add(record)
+
+                else:
+                    hour_bucket.add(record)
+
+            else:
+                # Too few records to produce a valid minute record so discard them.
+                minute_bucket.restart(record)
+
+        else:
+            minute_bucket.add(record)
+
+        if self._energy_column_list:
+            self._update_energy(record, elapsed_hours, closed_list)
+
+        return closed_list
+
+    def _update_energy(self, record, elapsed_hours, closed_list):
+        """@brief Add the energy sums to the mean records of the closed buckets and add the energy
+                  since the previous record to the energy sums.
+           @param record The record added.
+           @param elapsed_hours The time since the previous record or None if no energy is added for it.
+           @param closed_list The list of (index, mean record) tuples for each bucket that closed."""
+        for index, mean_record in closed_list:
+            energy_sums = self._energy_sums[index]
+            sum_index = 0
+            for _, import_key, export_key in self._energy_column_list:
+                mean_record[import_key] = energy_sums[sum_index]
+                mean_record[export_key] = energy_sums[sum_index+1]
+                energy_sums[sum_index] = 0.0
+                energy_sums[sum_index+1] = 0.0
+                sum_index += 2
+
+        if elapsed_hours is not None:
+            sum_index = 0
+            for power_key, _, _ in self._energy_column_list:
+                wh = record[power_key]*elapsed_hours
+                if wh >= 0.0:
+                    energy_index = sum_index
+                else:
+                    energy_index = sum_index+1
+                for energy_sums in self._energy_sums:
+                    energy_sums[energy_index] += wh
+                sum_index += 2
+
+    def get_first_timestamp(self, index):
+        """@param index MINUTE_INDEX, HOUR_INDEX or DAY_INDEX.
+           @return The TIMESTAMP of the first record in the minute, hour or day that has not yet
+                   closed or None if no records have been added."""
+        bucket = self._buckets[index]
+        if bucket.count == 0:
+            return None
+        return bucket.first_timestamp
+
+    def get_state(self):
+        """@return A dict holding the state of the accumulator. This can be converted to JSON."""
+        last_timestamp = None
+        if self.last_timestamp is not None:
+            last_timestamp = self.last_timestamp.isoformat()
+        return {"LAST_TIMESTAMP": last_timestamp,
+                "BUCKETS": [bucket.get_state() for bucket in self._buckets],
+                "ENERGY_SUMS": [energy_sums.tolist() for energy_sums in self._energy_sums]}
+
+    def set_state(self, state_dict):
+        """@brief Restore the state of the accumulator.
+           @param state_dict A dict returned by get_state()."""
+        self.last_timestamp = None
+        if state_dict["LAST_TIMESTAMP"] is not None:
+            self.last_timestamp = datetime.fromisoformat(state_dict["LAST_TIMESTAMP"])
+        for bucket, bucket_state in zip(self._buckets, state_dict["BUCKETS"]):
+            bucket.set_state(bucket_state)
+        # The energy sums are not present in the state saved before they were added.
+        energy_sums_list = state_dict.get("ENERGY_SUMS")
+        for index, energy_sums in enumerate(self._energy_sums):
+            if energy_sums_list and len(energy_sums_list[index]) == len(energy_sums):
+                energy_sums[:] = array('d', energy_sums_list[index])
+            else:
+                energy_sums[:] = array('d', [0.0]*len(energy_sums))
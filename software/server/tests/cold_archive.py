@@ -0,0 +1 @@
+../ct6/cold_archive.py
\ No newline at end of file
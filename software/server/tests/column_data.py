@@ -0,0 +1 @@
+../ct6/column_data.py
\ No newline at end of file
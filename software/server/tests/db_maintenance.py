@@ -0,0 +1 @@
+../ct6/db_maintenance.py
\ No newline at end of file
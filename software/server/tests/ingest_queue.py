@@ -0,0 +1 @@
+../ct6/ingest_queue.py
\ No newline at end of file
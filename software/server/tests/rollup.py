@@ -0,0 +1 @@
+../lib/rollup.py
\ No newline at end of file
@@ -1,8 +1,18 @@
 import unittest
 import string
 import copy
+import os
+import shutil
+import tempfile
 from mean_stats import MeanCT6StatsDict
-from random import randint, choices
+from column_data import ColumnData
+from ingest_queue import IngestQueue
+from cold_archive import ColdArchive
+from rollup import RollupAccumulator
+from db_maintenance import DBMaintenance
+from datetime import date, datetime, timedelta
+import json
+from random import randint, choices, uniform
 
 class TestCT6(unittest.TestCase):
 
@@ -91,5 +101,361 @@ class TestCT6(unittest.TestCase):
         last_assy_str = mean_stats_dict[TestCT6.ASSY]
         assert assy_str == last_assy_str
 
+class TestKWh(unittest.TestCase):
+
+    CT_COUNT = 6
+    ROW_COUNT = 5000
+
+    def _get_row_list(self):
+        """@return A list of rows holding a timestamp (ms) followed by the power of each CT.
+                   The time between rows and the sign of the power vary."""
+        row_list = []
+        timestamp = 1700000000000
+        for _ in range(TestKWh.ROW_COUNT):
+            timestamp += randint(200, 60000)
+            row_list.append([timestamp] + [uniform(-5000.0, 5000.0) for _ in range(TestKWh.CT_COUNT)])
+        return row_list
+
+    def _get_row_kwh(self, row_list, index, invert):
+        """@brief Calculate the kWh of a CT one row at a time as the GUI did before the kWh of all CT's were
+                  calculated in a single pass.
+           @return A tuple holding the total, positive and negative kWh."""
+        wattHoursList = []
+        pWattHoursList = []
+        nWattHoursList = []
+        lastTime = None
+        for row in row_list:
+            thisTime = row[0]
+            watts = row[index]
+            if invert:
+                watts = -watts
+            if lastTime is not None:
+                elapsedHours = (thisTime-lastTime)/3600000.0
+                wh = elapsedHours*watts
+                if wh >= 0.0:
+                    pWattHoursList.append(wh)
+                else:
+                    nWattHoursList.append(wh)
+                wattHoursList.append(wh)
+            lastTime = thisTime
+        return sum(wattHoursList)/1000.0, sum(pWattHoursList)/1000.0, sum(nWattHoursList)/1000.0
+
+    def test_kwh(self):
+        """@brief Check the kWh of all the CT's calculated in a single pass match the kWh calculated one row at a time."""
+        row_list = self._get_row_list()
+        column_data = ColumnData(row_list)
+        index_list = list(range(1, TestKWh.CT_COUNT+1))
+        for invert in (False, True):
+            kwh_arrays = column_data.get_kwh(index_list, invert)
+            for ct_index, index in enumerate(index_list):
+                expected = self._get_row_kwh(row_list, index, invert)
+                for kwh_array, expected_kwh in zip(kwh_arrays, expected):
+                    self.assertAlmostEqual(kwh_array[ct_index], expected_kwh, places=6)
+
+    def test_kwh_ct_subset(self):
+        """@brief Check the kWh of a subset of the CT's are returned in the order requested."""
+        row_list = self._get_row_list()
+        column_data = ColumnData(row_list)
+        total_array, pos_array, neg_array = column_data.get_kwh([5, 2], False)
+        self.assertEqual(len(total_array), 2)
+        self.assertAlmostEqual(total_array[0], self._get_row_kwh(row_list, 5, False)[0], places=6)
+        self.assertAlmostEqual(total_array[1], self._get_row_kwh(row_list, 2, False)[0], places=6)
+        self.assertAlmostEqual(total_array[0], pos_array[0]+neg_array[0], places=6)
+
+class TestIngestQueue(unittest.TestCase):
+
+    ASSY = "ASSY"
+
+    def setUp(self):
+        """This method runs before each test."""
+        self.temp_folder = tempfile.mkdtemp()
+        self.journal_file = os.path.join(self.temp_folder, "journal")
+
+    def tearDown(self):
+        """This method runs after each test."""
+        shutil.rmtree(self.temp_folder)
+
+    def _get_queue(self):
+        """@return An IngestQueue that spills all but the first two dev_dicts to the journal."""
+        return IngestQueue(2, IngestQueue.SPILL, self.journal_file, TestIngestQueue.ASSY)
+
+    def _get_all(self, ingest_queue):
+        """@return All the dev_dicts in the queue, including those in the journal. Each chunk
+                   is committed as it is read."""
+        dev_dict_list = []
+        while True:
+            _dev_dict_list = ingest_queue.get_all()
+            ingest_queue.commit_replay()
+            if not _dev_dict_list:
+                return dev_dict_list
+            dev_dict_list.extend(_dev_dict_list)
+
+    def test_replay_incomplete_journal(self):
+        """@brief Check that the journal is replayed if the app stopped while a dev_dict was being spilled."""
+        ingest_queue = self._get_queue()
+        for index in range(5):
+            ingest_queue.put({TestIngestQueue.ASSY: "A", "x": index})
+        # The journal now holds dev_dicts 2, 3 and 4. Remove the end of the last line.
+        with open(self.journal_file, 'r+') as fd:
+            fd.truncate(os.path.getsize(self.journal_file) - 5)
+
+        # Restart
+        ingest_queue = self._get_queue()
+        self.assertEqual(ingest_queue.qsize(), 1)
+        ingest_queue.put({TestIngestQueue.ASSY: "A", "x": 5})
+        dev_dict_list = self._get_all(ingest_queue)
+        self.assertEqual([dev_dict["x"] for dev_dict in dev_dict_list], [2, 3, 5])
+        self.assertEqual(ingest_queue.qsize(), 0)
+        self.assertFalse(os.path.isfile(self.journal_file))
+
+    def test_invalid_journal_line(self):
+        """@brief Check that a line in the journal that can't be read is skipped."""
+        with open(self.journal_file, 'w') as fd:
+            fd.write('{"ASSY": "A", "x": 0}\n{"ASSY": "A", "x"\n{"ASSY": "A", "x": 2}\n')
+        ingest_queue = self._get_queue()
+        dev_dict_list = self._get_all(ingest_queue)
+        self.assertEqual([dev_dict["x"] for dev_dict in dev_dict_list], [0, 2])
+        self.assertEqual(ingest_queue.qsize(), 0)
+
+    def test_replay_not_committed(self):
+        """@brief Check that the dev_dicts replayed from the journal are only removed from it once committed."""
+        ingest_queue = self._get_queue()
+        for index in range(7):
+            ingest_queue.put({TestIngestQueue.ASSY: "A", "x": index})
+        self.assertEqual([dev_dict["x"] for dev_dict in ingest_queue.get_all()], [0, 1])
+        self.assertEqual([dev_dict["x"] for dev_dict in ingest_queue.get_all()], [2, 3])
+        ingest_queue.commit_replay()
+        self.assertEqual([dev_dict["x"] for dev_dict in ingest_queue.get_all()], [4, 5])
+
+        # The app stops before 4 and 5 are committed.
+        ingest_queue = self._get_queue()
+        self.assertEqual([dev_dict["x"] for dev_dict in ingest_queue.get_all()], [4, 5])
+        self.assertEqual([dev_dict["x"] for dev_dict in ingest_queue.get_all()], [6])
+        self.assertEqual(ingest_queue.get_all(), [])
+        self.assertEqual(ingest_queue.qsize(), 0)
+        self.assertTrue(os.path.isfile(self.journal_file))
+
+        # The app stops again before 4, 5 and 6 are committed.
+        ingest_queue = self._get_queue()
+        self.assertEqual([dev_dict["x"] for dev_dict in self._get_all(ingest_queue)], [4, 5, 6])
+        self.assertFalse(os.path.isfile(self.journal_file))
+        self.assertFalse(os.path.isfile(self.journal_file + IngestQueue.OFFSET_FILE_SUFFIX))
+
+    def test_move_journal(self):
+        """@brief Check that the dev_dicts not yet committed are moved from a journal to the journal selected for each."""
+        ingest_queue = self._get_queue()
+        for index in range(8):
+            ingest_queue.put({TestIngestQueue.ASSY: "AB"[index%2], "x": index})
+        ingest_queue.get_all()
+        self.assertEqual([dev_dict["x"] for dev_dict in ingest_queue.get_all()], [2, 3])
+        ingest_queue.commit_replay()
+
+        # The app stops. On restart the journal of each CT6 unit is replayed.
+        journal_file_dict = {"A": self.journal_file + ".A", "B": self.journal_file + ".B"}
+        move_count = IngestQueue.MoveJournal(self.journal_file, lambda dev_dict: journal_file_dict[dev_dict[TestIngestQueue.ASSY]])
+        self.assertEqual(move_count, 4)
+        self.assertFalse(os.path.isfile(self.journal_file))
+        self.assertFalse(os.path.isfile(self.journal_file + IngestQueue.OFFSET_FILE_SUFFIX))
+        for assy, expected_list in (("A", [4, 6]), ("B", [5, 7])):
+            ingest_queue = IngestQueue(2, IngestQueue.SPILL, journal_file_dict[assy], TestIngestQueue.ASSY)
+            self.assertEqual([dev_dict["x"] for dev_dict in self._get_all(ingest_queue)], expected_list)
+
+    def test_qsize_after_metrics(self):
+        """@brief Check that reading the metrics does not change the number of dev_dicts in the queue."""
+        ingest_queue = self._get_queue()
+        for index in range(5):
+            ingest_queue.put({TestIngestQueue.ASSY: "A", "x": index})
+        self.assertEqual(ingest_queue.qsize(), 5)
+        metrics = ingest_queue.get_metrics()
+        self.assertEqual(metrics[IngestQueue.SPILL_COUNT], 3)
+        self.assertEqual(ingest_queue.qsize(), 5)
+        self.assertEqual(len(self._get_all(ingest_queue)), 5)
+        self.assertEqual(ingest_queue.qsize(), 0)
+
+class TestColdArchive(unittest.TestCase):
+
+    COLUMN_LIST = ("TIMESTAMP", "CT1_ACT_WATTS", "CT1_PF", "VOLTAGE", "TEMPERATURE", "RSSI_DBM")
+    DAY = date(2024, 3, 1)
+    ROW_COUNT = 2000
+
+    def setUp(self):
+        """This method runs before each test."""
+        self.temp_folder = tempfile.mkdtemp()
+        self.cold_archive = ColdArchive(os.path.join(self.temp_folder, "ASSY.db"))
+
+    def tearDown(self):
+        """This method runs after each test."""
+        shutil.rmtree(self.temp_folder)
+
+    def _get_row_list(self, _date):
+        """@return A list of rows of a day holding values in the range of each column.
+                   The time between rows varies."""
+        row_list = []
+        timestamp = ColdArchive.GetEpochMS(_date)
+        for _ in range(TestColdArchive.ROW_COUNT):
+            timestamp += randint(1, 40000)
+            row_list.append((timestamp, uniform(-5000.0, 5000.0), uniform(-1.0, 1.0), uniform(200.0, 260.0), uniform(-20.0, 80.0), uniform(-90.0, -30.0)))
+        return row_list
+
+    def _check_rows(self, row_list, expected_row_list):
+        """@brief Check the rows read from the archive match the rows written to it to the resolution of each column."""
+        self.assertEqual(len(row_list), len(expected_row_list))
+        tolerance_list = [0.5/ColdArchive.GetColumnEncoding(col_name)[1] for col_name in TestColdArchive.COLUMN_LIST[1:]]
+        # float32 holds about 7 significant digits.
+        tolerance_list[0] = 0.001
+        for row, expected_row in zip(row_list, expected_row_list):
+            self.assertEqual(row[0], expected_row[0])
+            for value, expected_value, tolerance in zip(row[1:], expected_row[1:], tolerance_list):
+                self.assertAlmostEqual(value, expected_value, delta=tolerance)
+
+    def test_round_trip(self):
+        """@brief Check the rows of a day are read back as they were written."""
+        row_list = self._get_row_list(TestColdArchive.DAY)
+        self.cold_archive.write_day(TestColdArchive.DAY, TestColdArchive.COLUMN_LIST, row_list)
+        self.assertEqual(self.cold_archive.get_day_list(), [TestColdArchive.DAY])
+        self.assertEqual(self.cold_archive.get_stop(), ColdArchive.GetEpochMS(TestColdArchive.DAY + timedelta(days=1)))
+        self._check_rows(self.cold_archive.read(TestColdArchive.COLUMN_LIST, row_list[0][0], row_list[-1][0]+1), row_list)
+
+        # A subset of the rows, with a column that is not in the archive.
+        start = row_list[100][0]
+        stop = row_list[200][0]
+        read_row_list = self.cold_archive.read(("TIMESTAMP", "CT1_ACT_WATTS", "CT2_ACT_WATTS"), start, stop)
+        self.assertEqual([row[0] for row in read_row_list], [row[0] for row in row_list[100:200]])
+        self.assertEqual(set(row[2] for row in read_row_list), {None})
+
+    def test_out_of_range(self):
+        """@brief Check values that can't be held in the dtype of a column are clipped."""
+        timestamp = ColdArchive.GetEpochMS(TestColdArchive.DAY)
+        row_list = [(timestamp, 1E6, 5.0, 700.0, -400.0, -5000.0),
+                    (timestamp+1000, -1E6, -5.0, -1.0, 400.0, 5000.0)]
+        self.cold_archive.write_day(TestColdArchive.DAY, TestColdArchive.COLUMN_LIST, row_list)
+        read_row_list = self.cold_archive.read(TestColdArchive.COLUMN_LIST, timestamp, timestamp+2000)
+        self._check_rows(read_row_list, [(timestamp, 1E6, 32767/10000.0, 65535/100.0, -32768/100.0, -32768/10.0),
+                                         (timestamp+1000, -1E6, -32768/10000.0, 0.0, 32767/100.0, 32767/10.0)])
+
+    def test_read_across_days(self):
+        """@brief Check a period that starts in one archived day and stops in the next."""
+        next_day = TestColdArchive.DAY + timedelta(days=1)
+        row_list = self._get_row_list(TestColdArchive.DAY)
+        next_row_list = self._get_row_list(next_day)
+        self.cold_archive.write_day(TestColdArchive.DAY, TestColdArchive.COLUMN_LIST, row_list)
+        self.cold_archive.write_day(next_day, TestColdArchive.COLUMN_LIST, next_row_list)
+        start = row_list[-500][0]
+        stop = next_row_list[500][0]
+        read_row_list = self.cold_archive.read(TestColdArchive.COLUMN_LIST, start, stop)
+        self._check_rows(read_row_list, row_list[-500:] + next_row_list[:500])
+
+    def test_empty_day(self):
+        """@brief Check a day with no rows is archived."""
+        self.cold_archive.write_day(TestColdArchive.DAY, TestColdArchive.COLUMN_LIST, [])
+        self.assertEqual(self.cold_archive.get_day_list(), [TestColdArchive.DAY])
+        day_start = ColdArchive.GetEpochMS(TestColdArchive.DAY)
+        self.assertEqual(self.cold_archive.read(TestColdArchive.COLUMN_LIST, day_start, day_start + 86400000), [])
+        column_dict = ColdArchive.Read(self.cold_archive.get_day_file(TestColdArchive.DAY))
+        self.assertEqual(sorted(column_dict.keys()), sorted(TestColdArchive.COLUMN_LIST))
+        for column in column_dict.values():
+            self.assertEqual(len(column), 0)
+
+class TestRollupAccumulator(unittest.TestCase):
+
+    TIMESTAMP = "TIMESTAMP"
+    VALUE = "V"
+    POWER = "P"
+    IMPORT = "IMP"
+    EXPORT = "EXP"
+
+    def _add(self, rollup_accumulator, timestamp, value):
+        """@brief Add a record holding the same value and power.
+           @return A list of the (index, mean record) tuples of the buckets that closed."""
+        return rollup_accumulator.add({TestRollupAccumulator.TIMESTAMP: timestamp,
+                                       TestRollupAccumulator.VALUE: value,
+                                       TestRollupAccumulator.POWER: value})
+
+    def _restart(self, rollup_accumulator):
+        """@return A RollupAccumulator restored from the state of another, as when the app restarts."""
+        state = json.loads(json.dumps(rollup_accumulator.get_state()))
+        _rollup_accumulator = RollupAccumulator(((TestRollupAccumulator.POWER, TestRollupAccumulator.IMPORT, TestRollupAccumulator.EXPORT),), 30)
+        _rollup_accumulator.set_state(state)
+        return _rollup_accumulator
+
+    def test_restart_next_day(self):
+        """@brief Check the buckets restored when the app restarts at the same time of a later day are
+                  closed rather than merged with the records of the later day."""
+        rollup_accumulator = self._restart(RollupAccumulator())
+        start = datetime(2026, 10, 1, 8, 59, 0)
+        for secs in range(0, 68*60, 10):
+            self._add(rollup_accumulator, start + timedelta(seconds=secs), 1.0)
+        # The day bucket opens when the first hour closes. The minute 10:06, hour 10 and day buckets are open.
+
+        rollup_accumulator = self._restart(rollup_accumulator)
+        next_day = datetime(2026, 10, 2, 10, 6, 30)
+        closed_list = self._add(rollup_accumulator, next_day, 4.0)
+        self.assertEqual([index for index, _ in closed_list], [RollupAccumulator.MINUTE_INDEX, RollupAccumulator.HOUR_INDEX, RollupAccumulator.DAY_INDEX])
+        for _, mean_record in closed_list:
+            self.assertEqual(mean_record[TestRollupAccumulator.TIMESTAMP].date(), start.date())
+            self.assertEqual(mean_record[TestRollupAccumulator.VALUE], 1.0)
+
+        for secs in range(1, 4):
+            self.assertEqual(self._add(rollup_accumulator, next_day + timedelta(seconds=secs), 4.0), [])
+        closed_list = self._add(rollup_accumulator, datetime(2026, 10, 2, 10, 7, 0), 4.0)
+        self.assertEqual(len(closed_list), 1)
+        index, mean_record = closed_list[0]
+        self.assertEqual(index, RollupAccumulator.MINUTE_INDEX)
+        self.assertEqual(mean_record[TestRollupAccumulator.TIMESTAMP].date(), next_day.date())
+        self.assertEqual(mean_record[TestRollupAccumulator.VALUE], 4.0)
+
+    def test_energy(self):
+        """@brief Check the energy of each bucket. 3600 W for one second is 1 Wh."""
+        rollup_accumulator = self._restart(RollupAccumulator())
+        start = datetime(2026, 10, 1, 10, 0, 0)
+        for secs in range(60):
+            self._add(rollup_accumulator, start + timedelta(seconds=secs), 3600.0)
+        closed_list = self._add(rollup_accumulator, start + timedelta(seconds=60), 3600.0)
+        self.assertEqual(len(closed_list), 1)
+        self.assertAlmostEqual(closed_list[0][1][TestRollupAccumulator.IMPORT], 59.0)
+        self.assertEqual(closed_list[0][1][TestRollupAccumulator.EXPORT], 0.0)
+
+        for secs in range(61, 120):
+            self._add(rollup_accumulator, start + timedelta(seconds=secs), -3600.0)
+        # The power is unknown during a gap so no energy is added for it.
+        gap_stop = datetime(2026, 10, 1, 11, 30, 58)
+        closed_list = self._add(rollup_accumulator, gap_stop, 3600.0)
+        self.assertEqual([index for index, _ in closed_list], [RollupAccumulator.MINUTE_INDEX, RollupAccumulator.HOUR_INDEX])
+        minute_record = closed_list[0][1]
+        self.assertAlmostEqual(minute_record[TestRollupAccumulator.IMPORT], 1.0)
+        self.assertAlmostEqual(minute_record[TestRollupAccumulator.EXPORT], -59.0)
+        hour_record = closed_list[1][1]
+        self.assertAlmostEqual(hour_record[TestRollupAccumulator.IMPORT], 60.0)
+        self.assertAlmostEqual(hour_record[TestRollupAccumulator.EXPORT], -59.0)
+
+        # Minute 11:30 holds too few records so its energy (1 Wh) is carried to the next minute.
+        self.assertEqual(self._add(rollup_accumulator, gap_stop + timedelta(seconds=1), 3600.0), [])
+        self.assertEqual(self._add(rollup_accumulator, gap_stop + timedelta(seconds=2), 3600.0), [])
+        for secs in range(3, 33):
+            self._add(rollup_accumulator, gap_stop + timedelta(seconds=secs), 3600.0)
+        # The energy is held in the state saved when the app stops.
+        rollup_accumulator = self._restart(rollup_accumulator)
+        for secs in range(33, 62):
+            self._add(rollup_accumulator, gap_stop + timedelta(seconds=secs), 3600.0)
+        closed_list = self._add(rollup_accumulator, gap_stop + timedelta(seconds=62), 3600.0)
+        self.assertEqual(len(closed_list), 1)
+        self.assertAlmostEqual(closed_list[0][1][TestRollupAccumulator.IMPORT], 61.0)
+
+class TestDBMaintenance(unittest.TestCase):
+
+    def test_quiet_day(self):
+        """@brief Check the quiet hours are in the same day when they span midnight."""
+        db_maintenance = DBMaintenance(None, 23, 2, 10)
+        start = datetime(2026, 10, 1, 23, 0, 0)
+        for minutes in range(0, 180, 10):
+            _datetime = start + timedelta(minutes=minutes)
+            self.assertTrue(db_maintenance.is_quiet_time(_datetime))
+            self.assertEqual(db_maintenance.get_quiet_day(_datetime), start.date())
+        self.assertFalse(db_maintenance.is_quiet_time(start + timedelta(hours=3)))
+
+        db_maintenance = DBMaintenance(None, 2, 5, 10)
+        self.assertEqual(db_maintenance.get_quiet_day(datetime(2026, 10, 2, 2, 0, 0)), date(2026, 10, 2))
+        self.assertEqual(db_maintenance.get_quiet_day(datetime(2026, 10, 2, 4, 59, 0)), date(2026, 10, 2))
+
 if __name__ == '__main__':
     unittest.main()